@@ -1,11 +1,29 @@
-from flask import Flask, render_template_string, request
+from flask import Flask, Response, request, stream_with_context, url_for
+import hashlib
+import json
+import os
+import queue
 import sqlite3
+import threading
+import time
 from datetime import datetime, timedelta
+from typing import NamedTuple
+
+from db import RowCache
+from export import next_day, orders_csv, settlements_csv
 
 app = Flask(__name__)
 DB_PATH = "taxi.db"
 DRIVER_PERCENT = 0.80  # 80% водителю
 SERVICE_PERCENT = 0.20  # 20% сервису
+ORDERS_PAGE_SIZE = 100      # заказов на странице по умолчанию
+ORDERS_PAGE_SIZE_MAX = 1000
+API_CACHE_SIZE = 256        # ответов API в кэше
+API_CACHE_TTL = 3600        # секунд; устаревшие по data_version вытесняются раньше
+EVENTS_POLL_INTERVAL = 1.0  # секунд между проверками data_version
+EVENTS_HEARTBEAT = 15       # секунд тишины до пинга — прокси не рвут соединение
+EVENTS_QUEUE_SIZE = 1000    # кадров в очереди браузера; переполнилась — отключаем
+EVENTS_BATCH = 500          # событий за один запрос к журналу
 
 HTML_TEMPLATE = """
 <!DOCTYPE html>
@@ -236,6 +254,14 @@ HTML_TEMPLATE = """
             font-size: 0.85em;
             white-space: nowrap;
         }
+        .status-expired {
+            background: #dc3545;
+            color: white;
+            padding: 5px 10px;
+            border-radius: 5px;
+            font-size: 0.85em;
+            white-space: nowrap;
+        }
         .no-data {
             text-align: center;
             padding: 40px;
@@ -273,6 +299,25 @@ HTML_TEMPLATE = """
         .tab:hover {
             border-color: #667eea;
         }
+        .pager {
+            display: flex;
+            justify-content: space-between;
+            padding: 15px 20px;
+        }
+        .live-bar {
+            background: white;
+            padding: 15px 25px;
+            border-radius: 15px;
+            box-shadow: 0 5px 15px rgba(0,0,0,0.1);
+            margin-bottom: 30px;
+            color: #666;
+        }
+        .live-bar b {
+            color: #667eea;
+        }
+        .live-new {
+            background: #fff8e1;
+        }
     </style>
 </head>
 <body>
@@ -311,6 +356,7 @@ HTML_TEMPLATE = """
                             <option value="new" {% if selected_status == 'new' %}selected{% endif %}>Новые</option>
                             <option value="accepted" {% if selected_status == 'accepted' %}selected{% endif %}>В работе</option>
                             <option value="completed" {% if selected_status == 'completed' %}selected{% endif %}>Завершенные</option>
+                            <option value="expired" {% if selected_status == 'expired' %}selected{% endif %}>Истёкшие</option>
                         </select>
                     </div>
                 </div>
@@ -320,10 +366,20 @@ HTML_TEMPLATE = """
                     <button type="button" onclick="setToday()" class="btn btn-success">📅 Сегодня</button>
                     <button type="button" onclick="setWeek()" class="btn btn-success">📅 Неделя</button>
                     <button type="button" onclick="setMonth()" class="btn btn-success">📅 Месяц</button>
+                    <a href="{{ url_for('export_orders', date_from=date_from, date_to=date_to) }}" class="btn btn-secondary">📥 Заказы CSV</a>
+                    <a href="{{ url_for('export_settlements', date_from=date_from, date_to=date_to) }}" class="btn btn-secondary">📥 Расчёт CSV</a>
                 </div>
             </form>
         </div>
 
+        <div class="live-bar" id="live-bar">
+            <span id="live-dot">⚪</span> Сегодня:
+            <b id="live-orders">—</b> заказов ·
+            <b id="live-completed">—</b> выполнено ·
+            <b id="live-revenue">—</b> ₸ ·
+            ожидают водителя: <b id="live-open">—</b>
+        </div>
+
         <div class="stats-grid">
             <div class="stat-card">
                 <h3>Всего заказов</h3>
@@ -370,7 +426,11 @@ HTML_TEMPLATE = """
                     </div>
                     <div class="stat-card">
                         <h3>Рейтинг</h3>
-                        <div class="value rating">⭐ {{ driver_detail.rating }}</div>
+                        <div class="value rating">⭐ {{ driver_detail.rating|rating }}</div>
+                        <div class="label">Оценок: {{ driver_detail.rating_count }}</div>
+                        <div class="label">
+                            {% for stars, count in driver_detail.stars %}{{ stars }}⭐ {{ count }}{% if not loop.last %} · {% endif %}{% endfor %}
+                        </div>
                     </div>
                     <div class="stat-card">
                         <h3>Заработано</h3>
@@ -406,7 +466,7 @@ HTML_TEMPLATE = """
                         <tr>
                             <td>{{ loop.index }}</td>
                             <td class="driver-name">{{ driver.name }}</td>
-                            <td class="rating">⭐ {{ driver.rating }}</td>
+                            <td class="rating">⭐ {{ driver.rating|rating }}</td>
                             <td>{{ driver.total_orders }}</td>
                             <td>{{ driver.completed_orders }}</td>
                             <td class="money">{{ driver.total_sum }} ₸</td>
@@ -430,9 +490,8 @@ HTML_TEMPLATE = """
         <div class="data-table">
             <div class="table-header">
                 <h2>📋 Заказы за период</h2>
-                <span>Всего: {{ orders|length }}</span>
+                <span>Всего: {{ stats.total_orders }}</span>
             </div>
-            {% if orders %}
             <div class="table-container">
                 <table>
                     <thead>
@@ -448,26 +507,28 @@ HTML_TEMPLATE = """
                             <th>Оценка</th>
                         </tr>
                     </thead>
-                    <tbody>
-                        {% for order in orders %}
-                        <tr>
+                    <tbody id="orders-body">
+                        {% for order in orders_page %}
+                        <tr id="order-{{ order.id }}">
                             <td>#{{ order.id }}</td>
                             <td>{{ order.created_at }}</td>
                             <td>{{ order.from_addr }}</td>
                             <td>{{ order.to_addr }}</td>
                             <td class="money">{{ order.price }} ₸</td>
                             <td class="phone">{{ order.phone }}</td>
-                            <td>{{ order.driver_name or '—' }}</td>
-                            <td>
+                            <td data-field="driver">{{ order.driver_name or '—' }}</td>
+                            <td data-field="status">
                                 {% if order.completed == 1 %}
                                     <span class="status-completed">Завершён</span>
                                 {% elif order.status == 'accepted' %}
                                     <span class="status-accepted">В работе</span>
+                                {% elif order.status == 'expired' %}
+                                    <span class="status-expired">Истёк</span>
                                 {% else %}
                                     <span class="status-new">Новый</span>
                                 {% endif %}
                             </td>
-                            <td class="rating">
+                            <td class="rating" data-field="rating">
                                 {% if order.rating %}
                                     {{ order.rating }} ⭐
                                 {% else %}
@@ -475,13 +536,16 @@ HTML_TEMPLATE = """
                                 {% endif %}
                             </td>
                         </tr>
+                        {% else %}
+                        <tr id="no-orders"><td colspan="9" class="no-data">Нет заказов за выбранный период</td></tr>
                         {% endfor %}
                     </tbody>
                 </table>
             </div>
-            {% else %}
-            <div class="no-data">Нет заказов за выбранный период</div>
-            {% endif %}
+            <div class="pager">
+                {% if orders_page.cursor %}<a class="driver-link" href="{{ orders_page.first_url() }}">⏮ К новым</a>{% endif %}
+                {% if orders_page.has_more %}<a class="driver-link" href="{{ orders_page.next_url() }}">Следующие {{ orders_page.page_size }} →</a>{% endif %}
+            </div>
         </div>
     </div>
 
@@ -510,6 +574,68 @@ HTML_TEMPLATE = """
             document.querySelector('input[name="date_to"]').value = today.toISOString().split('T')[0];
             document.querySelector('form').submit();
         }
+
+        // Живые обновления: /events присылает события заказов и счётчики за сегодня
+        const LIVE_PREPEND = {{ live_prepend|tojson }};
+        const STATUSES = {
+            new: ['status-new', 'Новый'],
+            accepted: ['status-accepted', 'В работе'],
+            completed: ['status-completed', 'Завершён'],
+            expired: ['status-expired', 'Истёк'],
+        };
+
+        function cell(text, className) {
+            const td = document.createElement('td');
+            td.textContent = text;
+            if (className) td.className = className;
+            return td;
+        }
+
+        function fillOrder(row, order) {
+            const [statusClass, statusText] = STATUSES[order.completed == 1 ? 'completed' : order.status] || STATUSES.new;
+            const status = document.createElement('span');
+            status.className = statusClass;
+            status.textContent = statusText;
+            row.querySelector('[data-field="status"]').replaceChildren(status);
+            row.querySelector('[data-field="driver"]').textContent = order.driver_name || '—';
+            row.querySelector('[data-field="rating"]').textContent = order.rating ? order.rating + ' ⭐' : '—';
+        }
+
+        function onOrderEvent(event) {
+            const order = JSON.parse(event.data);
+            let row = document.getElementById('order-' + order.order_id);
+            if (!row) {
+                if (order.kind !== 'created' || !LIVE_PREPEND) return;
+                row = document.createElement('tr');
+                row.id = 'order-' + order.order_id;
+                row.className = 'live-new';
+                row.append(
+                    cell('#' + order.order_id), cell(order.created_at), cell(order.from_addr), cell(order.to_addr),
+                    cell(order.price + ' ₸', 'money'), cell(order.phone, 'phone'),
+                    cell('', ''), cell('', ''), cell('', 'rating'),
+                );
+                ['driver', 'status', 'rating'].forEach((field, i) => row.children[6 + i].dataset.field = field);
+                document.getElementById('no-orders')?.remove();
+                document.getElementById('orders-body').prepend(row);
+            }
+            fillOrder(row, order);
+        }
+
+        function onStats(event) {
+            const stats = JSON.parse(event.data);
+            for (const key of ['orders', 'completed', 'revenue', 'open']) {
+                document.getElementById('live-' + key).textContent = stats[key];
+            }
+        }
+
+        if (window.EventSource) {
+            const source = new EventSource('{{ url_for("events") }}');
+            source.addEventListener('order', onOrderEvent);
+            source.addEventListener('stats', onStats);
+            source.addEventListener('reload', () => location.reload());
+            source.onopen = () => document.getElementById('live-dot').textContent = '🟢';
+            source.onerror = () => document.getElementById('live-dot').textContent = '⚪';
+        }
     </script>
 </body>
 </html>
@@ -520,81 +646,244 @@ def get_db_connection():
     conn.row_factory = sqlite3.Row
     return conn
 
-@app.route('/')
-def dashboard():
-    conn = get_db_connection()
-    
-    # Получаем параметры фильтрации
-    date_from = request.args.get('date_from', '')
-    date_to = request.args.get('date_to', '')
-    selected_driver = request.args.get('driver_id', '')
-    selected_status = request.args.get('status', '')
-    view_mode = request.args.get('view', '')
-    
-    # Если даты не указаны, берем последний месяц
-    if not date_from and not date_to:
-        date_to = datetime.now().strftime('%Y-%m-%d')
-        date_from = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
-    
-    # Строим WHERE условие для фильтрации
-    where_conditions = []
+@app.template_filter('rating')
+def format_rating(value):
+    return f"{value:.1f}" if value else 'N/A'
+
+# Шаблон компилируется один раз при импорте, а не на каждый запрос
+DASHBOARD_TEMPLATE = app.jinja_env.from_string(HTML_TEMPLATE)
+
+def order_filters(date_from, date_to, selected_driver, selected_status, cursor=None):
+    """
+    WHERE по orders: период [date_from, date_to + 1 день), водитель, статус и курсор страницы.
+    created_at сравниваем как строку, а не DATE(created_at) — так работают индексы.
+    """
+    conditions = []
     params = []
     
     if date_from:
-        where_conditions.append("DATE(o.created_at) >= ?")
+        conditions.append("o.created_at >= ?")
         params.append(date_from)
     
-    if date_to:
-        where_conditions.append("DATE(o.created_at) <= ?")
-        params.append(date_to)
+    created_before = next_day(date_to) if date_to else None
+    if cursor and (created_before is None or cursor[0] < created_before):
+        # Верхняя граница одна — курсор; при двух SQLite может взять для индекса менее точную
+        conditions.append("o.created_at <= ? AND (o.created_at, o.id) < (?, ?)")
+        params.extend([cursor[0], cursor[0], cursor[1]])
+    elif created_before:
+        conditions.append("o.created_at < ?")
+        params.append(created_before)
     
     if selected_driver:
-        where_conditions.append("o.driver_id = ?")
+        conditions.append("o.driver_id = ?")
         params.append(selected_driver)
     
     if selected_status == 'new':
-        where_conditions.append("o.status = 'new'")
+        conditions.append("o.status = 'new'")
     elif selected_status == 'accepted':
-        where_conditions.append("o.status = 'accepted' AND o.completed = 0")
+        conditions.append("o.status = 'accepted' AND o.completed = 0")
     elif selected_status == 'completed':
-        where_conditions.append("o.completed = 1")
-    
-    where_clause = "WHERE " + " AND ".join(where_conditions) if where_conditions else ""
+        conditions.append("o.completed = 1")
+    elif selected_status == 'expired':
+        conditions.append("o.status = 'expired'")
     
-    # Получаем всех водителей для селекта
-    all_drivers = conn.execute("SELECT id, name FROM drivers ORDER BY name").fetchall()
-    
-    # Общая статистика за период
-    stats_query = f"""
-        SELECT 
-            COUNT(*) as total_orders,
-            SUM(CASE WHEN completed = 1 THEN 1 ELSE 0 END) as completed_orders,
-            COALESCE(SUM(CASE WHEN status = 'accepted' OR completed = 1 THEN price ELSE 0 END), 0) as total_revenue
-        FROM orders o
-        {where_clause}
+    return conditions, params
+
+def where_sql(conditions) -> str:
+    return "WHERE " + " AND ".join(conditions) if conditions else ""
+
+def parse_orders_cursor(value: str):
+    """'2026-10-18 16:41:39|123' → ('2026-10-18 16:41:39', 123); None для первой страницы"""
+    created_at, _, order_id = value.rpartition('|')
+    if not created_at or not order_id.isdigit():
+        return None
+    return created_at, int(order_id)
+
+class OrdersPage:
+    """
+    Страница заказов по keyset-курсору (created_at, id), от новых к старым.
+    Строки читаются из курсора SQLite по мере рендеринга — первые попадают
+    в ответ раньше, чем запрос дочитан.
     """
-    stats_row = conn.execute(stats_query, params).fetchone()
+
+    def __init__(self, conn, conditions, params, page_size, cursor, url_args):
+        self.page_size = page_size
+        self.cursor = cursor
+        self.has_more = False
+        self.last = None
+        self._url_args = url_args
+        self._rows = conn.execute(f"""
+            SELECT 
+                o.*,
+                d.name as driver_name
+            FROM orders o
+            LEFT JOIN drivers d ON o.driver_id = d.id
+            {where_sql(conditions)}
+            ORDER BY o.created_at DESC, o.id DESC
+            LIMIT ?
+        """, params + [page_size + 1])
+
+    def __iter__(self):
+        for count, row in enumerate(self._rows):
+            if count == self.page_size:
+                self.has_more = True  # лишняя строка — признак следующей страницы
+                break
+            self.last = row
+            yield row
+        self._rows.close()
+
+    def next_cursor(self) -> str:
+        return f"{self.last['created_at']}|{self.last['id']}"
+
+    def next_url(self):
+        return url_for('dashboard', **self._url_args, cursor=self.next_cursor())
+
+    def first_url(self):
+        return url_for('dashboard', **self._url_args)
+
+class Filters(NamedTuple):
+    """Фильтры дашборда и API; кортеж — готовый ключ кэша"""
+    date_from: str
+    date_to: str
+    driver_id: str
+    status: str
+
+def parse_filters(args) -> Filters:
+    """Фильтры из параметров запроса; без дат — последний месяц"""
+    date_from = args.get('date_from', '')
+    date_to = args.get('date_to', '')
+    if not date_from and not date_to:
+        date_to = datetime.now().strftime('%Y-%m-%d')
+        date_from = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
+    return Filters(date_from, date_to, args.get('driver_id', ''), args.get('status', ''))
+
+def parse_page(args):
+    """(page_size, cursor) таблицы заказов из параметров запроса"""
+    try:
+        page_size = min(max(int(args.get('page_size', ORDERS_PAGE_SIZE)), 1), ORDERS_PAGE_SIZE_MAX)
+    except ValueError:
+        page_size = ORDERS_PAGE_SIZE
+    return page_size, parse_orders_cursor(args.get('cursor', ''))
+
+def day_filters(f: Filters):
+    """Условия периода по daily_driver_stats"""
+    conditions = []
+    params = []
+    if f.date_from:
+        conditions.append("s.day >= ?")
+        params.append(f.date_from)
+    if f.date_to:
+        conditions.append("s.day <= ?")
+        params.append(f.date_to)
+    return conditions, params
+
+def with_shares(row: dict) -> dict:
+    """Доли водителя и сервиса от total_sum"""
+    row['driver_share'] = int(row['total_sum'] * DRIVER_PERCENT)
+    row['service_share'] = int(row['total_sum'] * SERVICE_PERCENT)
+    return row
+
+# Сводки без фильтра по статусу берём из дневных агрегатов daily_driver_stats:
+# стоимость зависит от числа дней в периоде, а не от числа заказов.
+# Статус в агрегатах не разложен — с ним считаем по orders.
+
+def query_stats(conn, f: Filters) -> dict:
+    """Общая статистика за период"""
+    if not f.status:
+        day_conditions, day_params = day_filters(f)
+        if f.driver_id:
+            day_conditions.append("s.driver_id = ?")
+            day_params.append(f.driver_id)
+        stats_row = conn.execute(f"""
+            SELECT 
+                COALESCE(SUM(s.orders), 0) as total_orders,
+                COALESCE(SUM(s.completed), 0) as completed_orders,
+                COALESCE(SUM(s.revenue), 0) as total_revenue
+            FROM daily_driver_stats s
+            {where_sql(day_conditions)}
+        """, day_params).fetchone()
+    else:
+        where_conditions, params = order_filters(f.date_from, f.date_to, f.driver_id, f.status)
+        stats_row = conn.execute(f"""
+            SELECT 
+                COUNT(*) as total_orders,
+                SUM(CASE WHEN completed = 1 THEN 1 ELSE 0 END) as completed_orders,
+                COALESCE(SUM(CASE WHEN status = 'accepted' OR completed = 1 THEN price ELSE 0 END), 0) as total_revenue
+            FROM orders o
+            {where_sql(where_conditions)}
+        """, params).fetchone()
     
     total_revenue = stats_row['total_revenue']
-    driver_revenue = int(total_revenue * DRIVER_PERCENT)
-    service_revenue = int(total_revenue * SERVICE_PERCENT)
-    
-    stats = {
+    return {
         'total_orders': stats_row['total_orders'],
         'completed_orders': stats_row['completed_orders'],
         'total_revenue': total_revenue,
-        'driver_revenue': driver_revenue,
-        'service_revenue': service_revenue
+        'driver_revenue': int(total_revenue * DRIVER_PERCENT),
+        'service_revenue': int(total_revenue * SERVICE_PERCENT)
     }
+
+def query_driver_detail(conn, f: Filters):
+    """Детальный отчет по выбранному водителю; None, если водителя нет"""
+    day_conditions, day_params = day_filters(f)
+    driver_row = conn.execute(f"""
+        SELECT 
+            d.name,
+            d.rating,
+            d.rating_count,
+            d.stars_1, d.stars_2, d.stars_3, d.stars_4, d.stars_5,
+            COALESCE(SUM(s.orders), 0) as total_orders,
+            COALESCE(SUM(s.completed), 0) as completed_orders,
+            COALESCE(SUM(s.revenue), 0) as total_sum
+        FROM drivers d
+        LEFT JOIN daily_driver_stats s ON s.driver_id = d.id {"".join(" AND " + c for c in day_conditions)}
+        WHERE d.id = ?
+        GROUP BY d.id
+    """, day_params + [f.driver_id]).fetchone()
     
-    # Детальный отчет по водителю
-    show_driver_detail = False
-    driver_detail = None
-    
-    if view_mode == 'detail' and selected_driver:
-        show_driver_detail = True
-        driver_query = f"""
+    if not driver_row:
+        return None
+    return with_shares({
+        'name': driver_row['name'],
+        'rating': driver_row['rating'],
+        'rating_count': driver_row['rating_count'] or 0,
+        'stars': [(n, driver_row[f'stars_{n}'] or 0) for n in range(5, 0, -1)],
+        'total_orders': driver_row['total_orders'],
+        'completed_orders': driver_row['completed_orders'],
+        'total_sum': driver_row['total_sum'],
+    })
+
+def query_drivers(conn, f: Filters) -> list:
+    """Статистика по водителям за период (фильтр по водителю не применяется)"""
+    if not f.status:
+        day_conditions, day_params = day_filters(f)
+        # Без фильтров по дате — все водители, с фильтром — только с заказами за период
+        join = "JOIN" if day_conditions else "LEFT JOIN"
+        drivers_data = conn.execute(f"""
+            SELECT 
+                d.id,
+                d.name,
+                d.rating,
+                COALESCE(s.total_orders, 0) as total_orders,
+                COALESCE(s.completed_orders, 0) as completed_orders,
+                COALESCE(s.total_sum, 0) as total_sum
+            FROM drivers d
+            {join} (
+                SELECT driver_id,
+                       SUM(orders) as total_orders,
+                       SUM(completed) as completed_orders,
+                       SUM(revenue) as total_sum
+                FROM daily_driver_stats s
+                {where_sql(day_conditions)}
+                GROUP BY driver_id
+                HAVING SUM(orders) > 0
+            ) s ON s.driver_id = d.id
+            ORDER BY total_sum DESC
+        """, day_params).fetchall()
+    else:
+        driver_where, driver_params = order_filters(f.date_from, f.date_to, '', f.status)
+        drivers_data = conn.execute(f"""
             SELECT 
+                d.id,
                 d.name,
                 d.rating,
                 COUNT(o.id) as total_orders,
@@ -602,99 +891,359 @@ def dashboard():
                 COALESCE(SUM(CASE WHEN o.status = 'accepted' OR o.completed = 1 THEN o.price ELSE 0 END), 0) as total_sum
             FROM drivers d
             LEFT JOIN orders o ON d.id = o.driver_id
-            WHERE d.id = ?
-        """
-        detail_params = [selected_driver]
-        
-        if date_from:
-            driver_query += " AND DATE(o.created_at) >= ?"
-            detail_params.append(date_from)
-        if date_to:
-            driver_query += " AND DATE(o.created_at) <= ?"
-            detail_params.append(date_to)
-        
-        driver_query += " GROUP BY d.id, d.name, d.rating"
-        
-        driver_row = conn.execute(driver_query, detail_params).fetchone()
-        
-        if driver_row:
-            total_sum = driver_row['total_sum']
-            driver_detail = {
-                'name': driver_row['name'],
-                'rating': f"{driver_row['rating']:.1f}" if driver_row['rating'] else 'N/A',
-                'total_orders': driver_row['total_orders'],
-                'completed_orders': driver_row['completed_orders'],
-                'total_sum': total_sum,
-                'driver_share': int(total_sum * DRIVER_PERCENT),
-                'service_share': int(total_sum * SERVICE_PERCENT)
-            }
+            {where_sql(driver_where)}
+            GROUP BY d.id
+            ORDER BY total_sum DESC
+        """, driver_params).fetchall()
     
-    # Статистика по водителям
-    drivers_query = f"""
-        SELECT 
-            d.id,
-            d.name,
-            d.rating,
-            COUNT(o.id) as total_orders,
-            SUM(CASE WHEN o.completed = 1 THEN 1 ELSE 0 END) as completed_orders,
-            COALESCE(SUM(CASE WHEN o.status = 'accepted' OR o.completed = 1 THEN o.price ELSE 0 END), 0) as total_sum
-        FROM drivers d
-        LEFT JOIN orders o ON d.id = o.driver_id
+    return [with_shares({
+        'id': row['id'],
+        'name': row['name'] or 'Неизвестно',
+        'rating': row['rating'],
+        'total_orders': row['total_orders'],
+        'completed_orders': row['completed_orders'],
+        'total_sum': row['total_sum'],
+    }) for row in drivers_data]
+
+def orders_page(conn, f: Filters, page_size, cursor, url_args) -> OrdersPage:
+    conditions, params = order_filters(f.date_from, f.date_to, f.driver_id, f.status, cursor)
+    return OrdersPage(conn, conditions, params, page_size, cursor, url_args)
+
+@app.route('/')
+def dashboard():
+    conn = get_db_connection()
+    f = parse_filters(request.args)
+    view_mode = request.args.get('view', '')
+    
+    # Получаем всех водителей для селекта
+    all_drivers = conn.execute("SELECT id, name FROM drivers ORDER BY name").fetchall()
+    
+    show_driver_detail = view_mode == 'detail' and bool(f.driver_id)
+    driver_detail = query_driver_detail(conn, f) if show_driver_detail else None
+    
+    # Заказы за период — одна страница по курсору
+    page_size, cursor = parse_page(request.args)
+    url_args = {k: v for k, v in request.args.items() if k != 'cursor'}
+    url_args.update(date_from=f.date_from, date_to=f.date_to)
+    
+    context = dict(
+        date_from=f.date_from,
+        date_to=f.date_to,
+        selected_driver=f.driver_id,
+        selected_status=f.status,
+        all_drivers=all_drivers,
+        stats=query_stats(conn, f),
+        drivers=query_drivers(conn, f),
+        orders_page=orders_page(conn, f, page_size, cursor, url_args),
+        show_driver_detail=show_driver_detail,
+        driver_detail=driver_detail,
+        # Новые заказы дописываем сверху только на первой странице без фильтров водителя и статуса
+        live_prepend=(not cursor and not f.driver_id and not f.status
+                      and (not f.date_to or f.date_to >= datetime.now().strftime('%Y-%m-%d')))
+    )
+    app.update_template_context(context)
+    
+    def generate():
+        try:
+            yield from DASHBOARD_TEMPLATE.generate(context)
+        finally:
+            conn.close()
+    
+    # Страница уходит браузеру по частям, пока рендерится таблица заказов
+    return Response(stream_with_context(generate()), mimetype='text/html')
+
+# ---------------------
+# JSON API с условными GET
+# ---------------------
+class DataVersion:
     """
+    PRAGMA data_version на постоянном соединении: значение меняется, только когда
+    другое соединение (бот, stats.py) закоммитило изменения в БД.
+    """
+
+    def __init__(self):
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def get(self) -> int:
+        with self._lock:
+            if self._conn is None:
+                self._conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+            return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+data_version = DataVersion()
+api_cache = RowCache(API_CACHE_SIZE, API_CACHE_TTL)
+api_cache_lock = threading.Lock()
+# data_version считается с нуля в каждом процессе — ETag прошлого запуска не должен совпасть
+API_BOOT_ID = os.urandom(4).hex()
+
+def api_response(key: tuple, build):
+    """
+    JSON-ответ с ETag = запуск + data_version + параметры. Совпал If-None-Match — 304
+    без запросов к БД; иначе тело из кэша, пока data_version не сменилась.
+    """
+    # Версию читаем до запросов: если коммит случится во время сборки,
+    # ответ уйдёт со старым ETag и пересоберётся на следующем опросе
+    version = data_version.get()
+    digest = hashlib.sha1(repr(key).encode()).hexdigest()[:16]
+    etag = f"{API_BOOT_ID}-{version}-{digest}"
     
-    if where_conditions:
-        # Убираем условие по driver_id из where_conditions для общего списка водителей
-        driver_where = [c for c in where_conditions if 'driver_id' not in c]
-        driver_params = [p for i, p in enumerate(params) if i < len(driver_where)]
-        if driver_where:
-            drivers_query += " WHERE " + " AND ".join(driver_where)
-            drivers_data = conn.execute(drivers_query + " GROUP BY d.id ORDER BY total_sum DESC", driver_params).fetchall()
-        else:
-            drivers_data = conn.execute(drivers_query + " GROUP BY d.id ORDER BY total_sum DESC").fetchall()
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
     else:
-        drivers_data = conn.execute(drivers_query + " GROUP BY d.id ORDER BY total_sum DESC").fetchall()
+        with api_cache_lock:
+            entry = api_cache.get(key)
+        if entry and entry[0] == version:
+            body = entry[1]
+        else:
+            conn = get_db_connection()
+            try:
+                body = json.dumps(build(conn), ensure_ascii=False)
+            finally:
+                conn.close()
+            with api_cache_lock:
+                api_cache.put(key, (version, body))
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'  # клиент хранит ответ, но каждый раз сверяет ETag
+    return response
+
+@app.route('/api/stats')
+def api_stats():
+    f = parse_filters(request.args)
     
-    drivers = []
-    for row in drivers_data:
-        total_sum = row['total_sum']
-        drivers.append({
-            'id': row['id'],
-            'name': row['name'] or 'Неизвестно',
-            'rating': f"{row['rating']:.1f}" if row['rating'] else 'N/A',
-            'total_orders': row['total_orders'],
-            'completed_orders': row['completed_orders'],
-            'total_sum': total_sum,
-            'driver_share': int(total_sum * DRIVER_PERCENT),
-            'service_share': int(total_sum * SERVICE_PERCENT)
-        })
+    def build(conn):
+        data = {'filters': f._asdict(), 'stats': query_stats(conn, f)}
+        if f.driver_id:
+            data['driver'] = query_driver_detail(conn, f)
+        return data
+    return api_response(('stats', f), build)
+
+@app.route('/api/drivers')
+def api_drivers():
+    f = parse_filters(request.args)
+    return api_response(('drivers', f), lambda conn: {'filters': f._asdict(), 'drivers': query_drivers(conn, f)})
+
+@app.route('/api/orders')
+def api_orders():
+    f = parse_filters(request.args)
+    page_size, cursor = parse_page(request.args)
     
-    # Заказы за период
-    orders_query = f"""
-        SELECT 
-            o.*,
-            d.name as driver_name
-        FROM orders o
-        LEFT JOIN drivers d ON o.driver_id = d.id
-        {where_clause}
-        ORDER BY o.created_at DESC
+    def build(conn):
+        page = orders_page(conn, f, page_size, cursor, {})
+        orders = [dict(row) for row in page]
+        return {
+            'filters': f._asdict(),
+            'orders': orders,
+            'next_cursor': page.next_cursor() if page.has_more else None,
+        }
+    return api_response(('orders', f, page_size, cursor), build)
+
+# ---------------------
+# Живые обновления (Server-Sent Events)
+# ---------------------
+def fetch_order_events(conn, after_id: int, limit: int = EVENTS_BATCH) -> list:
+    """События журнала order_events после after_id вместе с текущим состоянием заказа"""
+    return [dict(row) for row in conn.execute("""
+        SELECT e.id, e.kind, e.order_id, e.created_at AS event_at,
+               o.created_at, o.from_addr, o.to_addr, o.price, o.phone,
+               COALESCE(o.driver_name, d.name) AS driver_name, o.status, o.completed, o.rating
+        FROM order_events e
+        LEFT JOIN orders o ON o.id = e.order_id
+        LEFT JOIN drivers d ON d.id = o.driver_id
+        WHERE e.id > ?
+        ORDER BY e.id
+        LIMIT ?
+    """, (after_id, limit))]
+
+def query_live_stats(conn) -> dict:
+    """Счётчики за сегодня и число заказов без водителя"""
+    today = conn.execute("""
+        SELECT COALESCE(SUM(orders), 0), COALESCE(SUM(completed), 0), COALESCE(SUM(revenue), 0)
+        FROM daily_driver_stats WHERE day = DATE('now')
+    """).fetchone()
+    open_orders = conn.execute("SELECT COUNT(*) FROM orders WHERE status = 'new'").fetchone()[0]
+    return {'orders': today[0], 'completed': today[1], 'revenue': today[2], 'open': open_orders}
+
+def event_frame(event: dict) -> str:
+    return f"id: {event['id']}\nevent: order\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+def stats_frame(stats: dict) -> str:
+    return f"event: stats\ndata: {json.dumps(stats)}\n\n"
+
+class Subscriber:
+    """Очередь кадров одного браузера: (id события или None, кадр)"""
+
+    def __init__(self):
+        self.queue = queue.Queue(EVENTS_QUEUE_SIZE)
+        self.overflow = False
+
+class EventHub:
+    """
+    Один поток на всех подписчиков: раз в EVENTS_POLL_INTERVAL сверяет PRAGMA data_version,
+    и только если БД менялась — дочитывает order_events после последнего id.
+    Кадры сериализуются один раз и раздаются во все очереди.
     """
-    orders = conn.execute(orders_query, params).fetchall()
+
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stats = None  # последний кадр счётчиков — новому подписчику сразу
+        self._last_id = 0   # последнее разосланное событие order_events
+
+    def subscribe(self) -> Subscriber:
+        subscriber = Subscriber()
+        with self._lock:
+            self._subscribers.add(subscriber)
+            if self._stats is not None:
+                subscriber.queue.put_nowait((None, self._stats))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='event-hub', daemon=True)
+                self._thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def _publish(self, frames: list):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                for frame in frames:
+                    subscriber.queue.put_nowait(frame)
+            except queue.Full:
+                # Браузер не успевает читать: отключаем, он переподключится
+                # с Last-Event-ID и дочитает пропущенное из журнала
+                subscriber.overflow = True
+                self.unsubscribe(subscriber)
+
+    def _run(self):
+        conn = None
+        try:
+            conn = get_db_connection()
+            version, idle = None, True
+            while True:
+                with self._lock:
+                    was_idle, idle = idle, not self._subscribers
+                try:
+                    if was_idle and not idle:
+                        # Пока подписчиков не было, журнал не читали. Новому подписчику старые
+                        # события не нужны (переподключение дочитает их по Last-Event-ID)
+                        self._last_id = conn.execute(
+                            "SELECT COALESCE(MAX(id), 0) FROM order_events"
+                        ).fetchone()[0]
+                        version = None
+                        with self._lock:
+                            self._stats = None
+                    if not idle:
+                        version = self._poll(conn, version)
+                except Exception as e:
+                    # Ошибка одного опроса (база занята, файл заменён) не останавливает поток
+                    print(f"Ошибка опроса order_events: {e}")
+                    conn.close()
+                    conn = get_db_connection()
+                    version = None
+                time.sleep(EVENTS_POLL_INTERVAL)
+        finally:
+            if conn is not None:
+                conn.close()
+            # Поток всё же упал — следующий подписчик запустит новый
+            with self._lock:
+                self._thread = None
+
+    def _poll(self, conn, version):
+        """Дочитать журнал после _last_id, если БД менялась; возвращает новую data_version"""
+        current = conn.execute("PRAGMA data_version").fetchone()[0]
+        if current == version:
+            return version
+        frames = []
+        while True:
+            events = fetch_order_events(conn, self._last_id)
+            frames.extend((event['id'], event_frame(event)) for event in events)
+            if events:
+                self._last_id = events[-1]['id']
+            if len(events) < EVENTS_BATCH:
+                break
+        if frames or self._stats is None:
+            stats = stats_frame(query_live_stats(conn))
+            with self._lock:
+                self._stats = stats
+            frames.append((None, stats))
+            self._publish(frames)
+        return current
+
+event_hub = EventHub()
+
+@app.route('/events')
+def events():
+    subscriber = event_hub.subscribe()
+    # Переподключение: браузер присылает id последнего события — дочитываем пропущенное
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    backlog = []
+    if last_event_id.isdigit():
+        conn = get_db_connection()
+        try:
+            backlog = fetch_order_events(conn, int(last_event_id))
+        finally:
+            conn.close()
     
-    conn.close()
+    def generate():
+        sent_id = int(last_event_id) if last_event_id.isdigit() else 0
+        try:
+            yield "retry: 3000\n\n"
+            if len(backlog) == EVENTS_BATCH:
+                yield "event: reload\ndata: {}\n\n"  # пропущено слишком много — проще перезагрузить страницу
+                return
+            for event in backlog:
+                sent_id = event['id']
+                yield event_frame(event)
+            while True:
+                try:
+                    event_id, frame = subscriber.queue.get(timeout=EVENTS_HEARTBEAT)
+                except queue.Empty:
+                    if subscriber.overflow:
+                        return
+                    yield ": ping\n\n"
+                    continue
+                if event_id is not None:
+                    if event_id <= sent_id:
+                        continue  # уже отправлено из журнала
+                    sent_id = event_id
+                yield frame
+        finally:
+            event_hub.unsubscribe(subscriber)
     
-    return render_template_string(
-        HTML_TEMPLATE,
-        date_from=date_from,
-        date_to=date_to,
-        selected_driver=selected_driver,
-        selected_status=selected_status,
-        all_drivers=all_drivers,
-        stats=stats,
-        drivers=drivers,
-        orders=orders,
-        show_driver_detail=show_driver_detail,
-        driver_detail=driver_detail
-    )
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# ---------------------
+# Выгрузка CSV
+# ---------------------
+def csv_response(name: str, export):
+    """Потоковый CSV за период из фильтров: export(conn, date_from, date_to, ...) — генератор кусков"""
+    f = parse_filters(request.args)
+    conn = get_db_connection()
+    
+    def generate():
+        try:
+            yield from export(conn, f.date_from, f.date_to, DRIVER_PERCENT, SERVICE_PERCENT)
+        finally:
+            conn.close()
+    
+    filename = f"{name}_{f.date_from or 'start'}_{f.date_to or 'now'}.csv"
+    return Response(generate(), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+@app.route('/export/orders.csv')
+def export_orders():
+    return csv_response('orders', orders_csv)
+
+@app.route('/export/settlements.csv')
+def export_settlements():
+    return csv_response('settlements', settlements_csv)
 
 if __name__ == '__main__':
     print("🚀 Запуск админ-панели...")
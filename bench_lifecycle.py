@@ -0,0 +1,106 @@
+# bench_lifecycle.py — цена слежения за заказами, которые никто не принимает:
+# колесо таймеров (lifecycle.OrderLifecycle поверх scheduler.TimerWheel) против
+# периодического опроса orders. База временная: --orders заказов за 90 дней,
+# из них --open открытых за последние ORDER_EXPIRE_AFTER секунд.
+#
+#   python bench_lifecycle.py --orders 300000 --open 5000
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import db
+import lifecycle
+from scheduler import Scheduler, TimerWheel
+
+POLL_SQL = ("SELECT id FROM orders {hint} WHERE status='new' "
+            "AND created_at < datetime('now', '-{age} seconds')")
+
+
+def fill(path: str, orders: int, open_orders: int, seed: int):
+    rnd = random.Random(seed)
+    conn = sqlite3.connect(path)
+    rows = []
+    for n in range(orders):
+        if n < open_orders:
+            age, status = rnd.uniform(0, lifecycle.ORDER_EXPIRE_AFTER), 'new'
+        else:
+            age, status = rnd.uniform(0, 90 * 86400), 'accepted'
+        rows.append((status, 1 if status == 'accepted' else 0, rnd.randrange(1, 50_000), f"-{int(age)} seconds"))
+    conn.executemany(
+        "INSERT INTO orders (from_addr, to_addr, price, status, completed, passenger_id, created_at) "
+        "VALUES ('A', 'B', 700, ?, ?, ?, datetime('now', ?))", rows
+    )
+    conn.commit()
+    return conn
+
+
+def timed(fn, repeat: int = 1) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+async def run(args):
+    tmp = tempfile.TemporaryDirectory()
+    path = os.path.join(tmp.name, "bench.db")
+    await db.init_db(path, write_pipeline=False)
+    conn = fill(path, args.orders, args.open, args.seed)
+
+    print(f"Заказов {args.orders}, открытых {args.open}")
+    age = lifecycle.ORDER_BUMP_AFTER
+    for name, hint in (("опрос по idx_orders_open", "INDEXED BY idx_orders_open"),
+                       ("опрос без индекса", "NOT INDEXED")):
+        sql = POLL_SQL.format(hint=hint, age=age)
+        ms = timed(lambda: conn.execute(sql).fetchall(), args.repeat)
+        print(f"{name:<28}{ms:9.2f} мс за опрос, {ms * 3600 / args.poll:9.0f} мс в час при опросе раз в {args.poll} с")
+
+    started = time.perf_counter()
+    rows = await db.open_orders()
+    load_ms = (time.perf_counter() - started) * 1000
+
+    async def on_bump(order_id):
+        return True
+
+    async def on_expire(order_id):
+        return True
+
+    timers = Scheduler()
+    wheel = TimerWheel(timers)
+    orders = lifecycle.OrderLifecycle(wheel, on_bump, on_expire)
+    started = time.perf_counter()
+    orders.rebuild(rows)
+    rebuild_ms = (time.perf_counter() - started) * 1000
+    print(f"{'рестарт: open_orders':<28}{load_ms:9.2f} мс, таймеры {rebuild_ms:.2f} мс на {len(rows)} заказов")
+
+    # Новые заказы: поставить таймеры и снять, когда заказ приняли
+    ids = range(10**9, 10**9 + args.open)
+    track_us = timed(lambda: [orders.track(order_id) for order_id in ids]) / args.open * 1000
+    forget_us = timed(lambda: [orders.forget(order_id) for order_id in ids]) / args.open * 1000
+    print(f"{'колесо: новый заказ':<28}{track_us:9.2f} мкс, принят (снять таймеры) {forget_us:.2f} мкс")
+
+    # Полный оборот колеса с открытыми заказами: все тики подряд
+    slots = len(wheel._slots)
+    wheel._next = asyncio.get_running_loop().time() - slots * wheel.tick
+    turn_ms = timed(wheel._tick)
+    print(f"{'колесо: тик':<28}{turn_ms / slots * 1000:9.2f} мкс за тик, "
+          f"{turn_ms / slots * 3600 / wheel.tick:9.0f} мс в час при тике раз в {wheel.tick:g} с")
+    await asyncio.sleep(0)
+    await timers.close()
+    conn.close()
+    await db.close_db()
+    tmp.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Колесо таймеров против опроса orders")
+    parser.add_argument("--orders", type=int, default=300_000)
+    parser.add_argument("--open", type=int, default=5000)
+    parser.add_argument("--poll", type=float, default=10, help="период опроса, секунд")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(run(parser.parse_args()))
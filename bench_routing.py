@@ -0,0 +1,104 @@
+# bench_routing.py — микробенчмарк выбора хендлера: цепочка lambda-фильтров
+# (как было в bot.py) против Router из routing.py. Для каждого числа кнопок
+# меряется худший случай — нажата последняя зарегистрированная кнопка.
+#
+#   python bench_routing.py --buttons 3 10 50 200 --updates 2000
+import argparse
+import asyncio
+import time
+
+from aiogram import Bot, Dispatcher, types
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+
+from routing import CallbackRoute, OrderPayload, Router
+
+USER_ID = 100_000
+
+
+async def noop_message(message, state=None):
+    pass
+
+
+async def noop_callback(callback, payload=None):
+    pass
+
+
+# ---------------------
+# Две конфигурации диспетчера
+# ---------------------
+def legacy_dispatcher(bot: Bot, buttons: int) -> Dispatcher:
+    dp = Dispatcher(bot, storage=MemoryStorage())
+    for i in range(buttons):
+        text = f"Кнопка {i}"
+        dp.register_message_handler(noop_message, lambda m, text=text: m.text == text)
+    for i in range(buttons):
+        prefix = f"btn{i}_"
+
+        async def parse(callback: types.CallbackQuery):
+            await noop_callback(callback, int(callback.data.split("_")[1]))
+        dp.register_callback_query_handler(parse, lambda c, prefix=prefix: c.data.startswith(prefix))
+    return dp
+
+
+def routed_dispatcher(bot: Bot, buttons: int) -> Dispatcher:
+    dp = Dispatcher(bot, storage=MemoryStorage())
+    router = Router()
+    router.setup(dp)
+    for i in range(buttons):
+        router.text(f"Кнопка {i}")(noop_message)
+        router.callback(CallbackRoute(f"btn{i}", OrderPayload))(noop_callback)
+    return dp
+
+
+# ---------------------
+# Апдейты
+# ---------------------
+def message_update(update_id: int, text: str) -> types.Update:
+    return types.Update(**{"update_id": update_id, "message": {
+        "message_id": update_id, "date": 0, "text": text,
+        "chat": {"id": USER_ID, "type": "private"},
+        "from": {"id": USER_ID, "is_bot": False, "first_name": "Bench"},
+    }})
+
+
+def callback_update(update_id: int, data: str) -> types.Update:
+    return types.Update(**{"update_id": update_id, "callback_query": {
+        "id": str(update_id), "chat_instance": "bench", "data": data,
+        "from": {"id": USER_ID, "is_bot": False, "first_name": "Bench"},
+        "message": {"message_id": 1, "date": 0, "text": "",
+                    "chat": {"id": USER_ID, "type": "private"}},
+    }})
+
+
+async def measure(dp: Dispatcher, updates) -> float:
+    """Микросекунд на апдейт; каждый апдейт — в своей задаче, как в webhook.py"""
+    started = time.perf_counter()
+    for update in updates:
+        await asyncio.create_task(dp.process_update(update))
+    return (time.perf_counter() - started) / len(updates) * 1e6
+
+
+async def main(args):
+    bot = Bot("123456789:BENCH")
+    Bot.set_current(bot)
+    print(f"{'кнопок':>7}{'текст: было':>14}{'стало':>9}{'callback: было':>17}{'стало':>9}  мкс/апдейт")
+    for buttons in args.buttons:
+        last = buttons - 1
+        texts = [message_update(n, f"Кнопка {last}") for n in range(args.updates)]
+        callbacks = [callback_update(n, f"btn{last}_{n}") for n in range(args.updates)]
+        row = []
+        for kind in (texts, callbacks):
+            for build in (legacy_dispatcher, routed_dispatcher):
+                dp = build(bot, buttons)
+                Dispatcher.set_current(dp)
+                await measure(dp, kind[:100])  # прогрев
+                row.append(await measure(dp, kind))
+        print(f"{buttons:>7}{row[0]:>14.1f}{row[1]:>9.1f}{row[2]:>17.1f}{row[3]:>9.1f}")
+    await (await bot.get_session()).close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Цепочка фильтров против Router")
+    parser.add_argument("--buttons", type=int, nargs="+", default=[3, 10, 50, 200])
+    parser.add_argument("--updates", type=int, default=2000)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,103 @@
+# bench_templates.py — профилирование клавиатур и текстов одного заказа:
+# объекты aiogram + prepare_arg + f-строки (как было) против шаблонов
+# templates.py (как стало). Сначала сверяет, что результат побайтно тот же.
+#
+#   python bench_templates.py --orders 20000
+import argparse
+import cProfile
+import os
+import pstats
+import time
+import tracemalloc
+
+os.environ.setdefault("BOT_TOKEN", "123456789:BENCH")
+import bot  # noqa: E402
+from aiogram.utils.payload import prepare_arg  # noqa: E402
+
+PHONE = "+77071234567"
+
+
+def legacy_order(order_id: int, from_addr: str, to_addr: str, price: int):
+    """Всё, что бот сериализует за один заказ — прежним способом"""
+    return [
+        prepare_arg(bot.main_menu_kb()),
+        prepare_arg(bot.trip_type_kb()),
+        prepare_arg(bot.cancel_kb()),
+        prepare_arg(bot.cancel_kb()),
+        prepare_arg(bot.cancel_kb()),
+        prepare_arg(bot.phone_kb(PHONE)),
+        f"🚕 Жаңа тапсырыс #{order_id}\n📍 {from_addr} → {to_addr}\n💰 {price} ₸\n📱 {PHONE}",
+        prepare_arg(bot.accept_keyboard(order_id)),
+        prepare_arg(bot.main_menu_kb()),
+        f"✅ Сіз тапсырысты қабылдадыңыз #{order_id}\n⭐ Сіздің рейтингіңіз: {4.75:.1f} ({12})",
+        prepare_arg(bot.complete_trip_keyboard(order_id)),
+        f"✅ Сапар аяқталды #{order_id}\nЖүргізушіні бағалаңыз:",
+        prepare_arg(bot.rating_keyboard(order_id)),
+    ]
+
+
+def template_order(order_id: int, from_addr: str, to_addr: str, price: int):
+    """То же самое через шаблоны"""
+    return [
+        bot.MAIN_MENU_KB,
+        bot.TRIP_TYPE_KB,
+        bot.CANCEL_KB,
+        bot.CANCEL_KB,
+        bot.CANCEL_KB,
+        bot.PHONE_CONFIRM_KB.render(saved_phone=PHONE),
+        bot.ORDER_BROADCAST_TEXT.render(order_id=order_id, from_addr=from_addr, to_addr=to_addr,
+                                        price=price, phone=PHONE),
+        bot.ACCEPT_KB.render(order_id=order_id),
+        bot.MAIN_MENU_KB,
+        bot.ORDER_ACCEPTED_TEXT.render(order_id=order_id, average=4.75, count=12),
+        bot.COMPLETE_KB.render(order_id=order_id),
+        bot.TRIP_COMPLETED_TEXT.render(order_id=order_id),
+        bot.RATING_KB.render(order_id=order_id),
+    ]
+
+
+def orders(count: int):
+    addresses = ['Төле би 12', 'Абай "Арман" ТЦ', 'Қонаев\\5', 'Жібек жолы {2}']
+    return [(n, addresses[n % 4], addresses[(n + 1) % 4], 500 + n % 1000) for n in range(1, count + 1)]
+
+
+def check(sample):
+    for args in sample:
+        assert legacy_order(*args) == template_order(*args), args
+    print(f"Вывод совпадает на {len(sample)} заказах ✅")
+
+
+def measure(build, sample):
+    started = time.perf_counter()
+    for args in sample:
+        build(*args)
+    elapsed = (time.perf_counter() - started) / len(sample) * 1e6
+
+    tracemalloc.start()
+    for args in sample[:1000]:
+        build(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    for args in sample[:1000]:
+        build(*args)
+    profiler.disable()
+    calls = pstats.Stats(profiler).total_calls / min(len(sample), 1000)
+    return elapsed, calls, peak
+
+
+def main(args):
+    sample = orders(args.orders)
+    check(sample[:1000])
+    print(f"{'':<10}{'мкс/заказ':>11}{'вызовов/заказ':>15}{'пик памяти, КБ':>16}")
+    for name, build in (("было", legacy_order), ("стало", template_order)):
+        elapsed, calls, peak = measure(build, sample)
+        print(f"{name:<10}{elapsed:>11.1f}{calls:>15.0f}{peak / 1024:>16.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Клавиатуры и тексты: объекты против шаблонов")
+    parser.add_argument("--orders", type=int, default=20000)
+    main(parser.parse_args())
@@ -1,21 +1,68 @@
 import os
 import re
+import time
 import asyncio
+from datetime import datetime
 from dotenv import load_dotenv
 from aiogram import Bot, Dispatcher, types
+from aiogram.bot.api import TelegramAPIServer, TELEGRAM_PRODUCTION
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
-from aiogram.contrib.fsm_storage.memory import MemoryStorage
 from aiogram.utils import executor
+from aiogram.utils.exceptions import TelegramAPIError
 import db
+import dispatch
+import lifecycle
+from fsm_storage import SQLiteStorage
+from routing import Router, ACCEPT, COMPLETE, RATE, HISTORY
+from templates import KeyboardTemplate, TextTemplate, static
+import send_scheduler
+from send_scheduler import SendScheduler, PRIORITY_BOARD, PRIORITY_BROADCAST, PRIORITY_CLAIM, PRIORITY_REPLY
+from scheduler import Scheduler, TimerWheel
+from group_board import GroupBoard
 
 load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 GROUP_ID = int(os.getenv("GROUP_ID", "-1003084604599"))
+DB_PATH = os.getenv("DB_PATH", db.DB_PATH)
+# Воркер supervisor.py «index/count»: после рестарта он поднимает таймеры только своих пассажиров
+BOT_SHARD = tuple(int(part) for part in os.getenv("BOT_SHARD", "0/1").split("/"))
+# Другой адрес Bot API — локальный сервер или fake_telegram.py для нагрузочных тестов
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
 
-storage = MemoryStorage()
-bot = Bot(token=BOT_TOKEN)
+# Состояния FSM переживают рестарт: хранятся в taxi.db (таблица fsm_state)
+storage = SQLiteStorage()
+bot = Bot(
+    token=BOT_TOKEN,
+    server=TelegramAPIServer.from_base(TELEGRAM_API_URL) if TELEGRAM_API_URL else TELEGRAM_PRODUCTION
+)
 dp = Dispatcher(bot, storage=storage)
+# Кнопки (тексты и callback_data) выбираются одним поиском в словаре — см. routing.py
+router = Router()
+# Все исходящие сообщения идут через очередь с лимитами Telegram
+outbox = SendScheduler(
+    bot,
+    global_rate=float(os.getenv("SEND_GLOBAL_RATE", send_scheduler.GLOBAL_RATE)),
+    private_rate=float(os.getenv("SEND_PRIVATE_RATE", send_scheduler.PRIVATE_RATE)),
+    group_rate=float(os.getenv("SEND_GROUP_RATE", send_scheduler.GROUP_RATE)),
+)
+# Таймеры заказов (волны предложений) — одна куча на весь процесс,
+# таймеры жизненного цикла заказов — в колесе поверх неё
+timers = Scheduler()
+wheel = TimerWheel(timers)
+# Пост заказа в группе переписывается при принятии, завершении и истечении заказа
+board = GroupBoard(outbox, GROUP_ID)
+
+def reply(message: types.Message, text: str, **kwargs):
+    """Ответить в чат сообщения через очередь; ждать результат не обязательно"""
+    return outbox.send_message(message.chat.id, text, **kwargs)
+
+def edit_message(callback: types.CallbackQuery, text: str = None, **kwargs):
+    """Изменить сообщение с inline-кнопкой через очередь; без text — только клавиатуру"""
+    chat_id, message_id = callback.message.chat.id, callback.message.message_id
+    if text is None:
+        return outbox.submit(chat_id, lambda: bot.edit_message_reply_markup(chat_id, message_id, **kwargs))
+    return outbox.submit(chat_id, lambda: bot.edit_message_text(text, chat_id, message_id, **kwargs))
 
 # ---------------------
 # Валидация номера
@@ -67,8 +114,14 @@ def trip_type_kb():
     kb.add(types.KeyboardButton("❌ Болдырмау"))
     return kb
 
-def phone_kb():
+def phone_confirm_text(phone: str) -> str:
+    return f"✅ {phone}"
+
+def phone_kb(saved_phone: str = None):
     kb = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
+    if saved_phone:
+        # Постоянный пассажир подтверждает сохранённый номер одним нажатием
+        kb.add(types.KeyboardButton(phone_confirm_text(saved_phone)))
     kb.add(types.KeyboardButton("📱 Телефонды жіберу", request_contact=True))
     kb.add(types.KeyboardButton("❌ Болдырмау"))
     return kb
@@ -78,17 +131,30 @@ def cancel_kb():
     kb.add(types.KeyboardButton("❌ Болдырмау"))
     return kb
 
+ADDRESS_BUTTON_MAX = 64  # длинные адреса не предлагаем кнопкой
+
+def address_kb(addresses, exclude: str = None, location: bool = False):
+    """Последние адреса пассажира кнопками + отмена; location — кнопка геолокации"""
+    kb = types.ReplyKeyboardMarkup(resize_keyboard=True)
+    if location:
+        kb.add(types.KeyboardButton("📍 Геолокация жіберу", request_location=True))
+    for address in addresses:
+        if address != exclude and len(address) <= ADDRESS_BUTTON_MAX:
+            kb.add(types.KeyboardButton(address))
+    kb.add(types.KeyboardButton("❌ Болдырмау"))
+    return kb
+
 def accept_keyboard(order_id: int):
     keyboard = types.InlineKeyboardMarkup()
     keyboard.add(types.InlineKeyboardButton(
-        "🚕 Қабылдау", callback_data=f"accept_{order_id}"
+        "🚕 Қабылдау", callback_data=ACCEPT.encode(order_id)
     ))
     return keyboard
 
 def complete_trip_keyboard(order_id: int):
     keyboard = types.InlineKeyboardMarkup()
     keyboard.add(types.InlineKeyboardButton(
-        "✅ Сапар аяқталды", callback_data=f"complete_{order_id}"
+        "✅ Сапар аяқталды", callback_data=COMPLETE.encode(order_id)
     ))
     return keyboard
 
@@ -96,58 +162,164 @@ def rating_keyboard(order_id: int):
     keyboard = types.InlineKeyboardMarkup(row_width=5)
     for i in range(1, 6):
         keyboard.insert(types.InlineKeyboardButton(
-            str(i) + "⭐", callback_data=f"rate_{order_id}_{i}"
+            str(i) + "⭐", callback_data=RATE.encode(order_id, i)
         ))
     return keyboard
 
+# ---------------------
+# Шаблоны: JSON клавиатур и тексты собираются один раз при импорте
+# ---------------------
+MAIN_MENU_KB = static(main_menu_kb())
+TRIP_TYPE_KB = static(trip_type_kb())
+PHONE_KB = static(phone_kb())
+CANCEL_KB = static(cancel_kb())
+PHONE_CONFIRM_KB = KeyboardTemplate(phone_kb, 'saved_phone')
+ACCEPT_KB = KeyboardTemplate(accept_keyboard, 'order_id')
+COMPLETE_KB = KeyboardTemplate(complete_trip_keyboard, 'order_id')
+RATING_KB = KeyboardTemplate(rating_keyboard, 'order_id')
+
+ORDER_BROADCAST_TEXT = TextTemplate(
+    "🚕 Жаңа тапсырыс #{order_id}\n📍 {from_addr} → {to_addr}\n💰 {price} ₸\n📱 {phone}"
+)
+ORDER_ACCEPTED_TEXT = TextTemplate(
+    "✅ Сіз тапсырысты қабылдадыңыз #{order_id}\n⭐ Сіздің рейтингіңіз: {average:.1f} ({count})"
+)
+TRIP_COMPLETED_TEXT = TextTemplate("✅ Сапар аяқталды #{order_id}\nЖүргізушіні бағалаңыз:")
+TRIP_RATED_TEXT = TextTemplate("✅ Сапар аяқталды #{order_id}\nСіздің бағаңыз: {stars}⭐")
+ORDER_OFFER_TEXT = TextTemplate(
+    "🚕 Жаңа тапсырыс #{order_id}\n📍 {from_addr} → {to_addr}\n💰 {price} ₸\n📱 {phone}\n"
+    "📏 Сізден {distance:.1f} км"
+)
+ORDER_BUMP_TEXT = TextTemplate(
+    "🔁 Тапсырыс әлі ашық #{order_id}\n📍 {from_addr} → {to_addr}\n💰 {price} ₸\n📱 {phone}"
+)
+ORDER_EXPIRED_TEXT = TextTemplate(
+    "⌛ #{order_id} тапсырысын ешкім қабылдамады, уақыты өтті.\n"
+    "Қайта шақыру үшін «🚕 Такси шақыру» батырмасын басыңыз."
+)
+OFFER_TAKEN_TEXT = TextTemplate("❌ Тапсырыс #{order_id} басқа жүргізушіге берілді")
+# Пост заказа в группе после смены статуса: без кнопки и без телефона пассажира
+BOARD_ACCEPTED_TEXT = TextTemplate(
+    "✅ Тапсырыс қабылданды #{order_id}\n📍 {from_addr} → {to_addr}\n💰 {price} ₸\n🚕 {driver_name}"
+)
+BOARD_COMPLETED_TEXT = TextTemplate("🏁 Сапар аяқталды #{order_id}\n📍 {from_addr} → {to_addr}\n💰 {price} ₸")
+BOARD_EXPIRED_TEXT = TextTemplate("⌛ Тапсырыстың уақыты өтті #{order_id}\n📍 {from_addr} → {to_addr}\n💰 {price} ₸")
+
 # ---------------------
 # Команда /start
 # ---------------------
 @dp.message_handler(commands=['start'], state='*')
 async def start_cmd(message: types.Message, state: FSMContext):
     await state.finish()
-    await message.answer(
+    reply(
+        message,
         "Сәлем! Такси шақыру үшін төмендегі батырманы басыңыз 👇",
-        reply_markup=main_menu_kb()
+        reply_markup=MAIN_MENU_KB
     )
 
+# ---------------------
+# Смена водителя: /online и /offline
+# ---------------------
+DRIVER_MEMBER_STATUSES = {'creator', 'administrator', 'member', 'restricted'}
+
+async def is_group_driver(user: types.User) -> bool:
+    """Водитель — тот, кто уже принимал заказы или состоит в группе водителей"""
+    if await db.get_driver(user.id):
+        return True
+    try:
+        member = await bot.get_chat_member(GROUP_ID, user.id)
+    except TelegramAPIError:
+        return False
+    if member.status not in DRIVER_MEMBER_STATUSES:
+        return False
+    await db.register_driver(user.id, user.full_name or user.username)
+    return True
+
+async def set_online(message: types.Message, online: bool) -> bool:
+    if not await is_group_driver(message.from_user):
+        return False
+    update_presence(message.from_user.id, 'online' if online else 'offline')
+    return True
+
+@dp.message_handler(commands=['online'], state='*')
+async def online_cmd(message: types.Message):
+    if not await set_online(message, True):
+        reply(message, "❌ Бұл команда тек жүргізушілерге арналған.")
+        return
+    reply(
+        message,
+        "✅ Сіз желідесіз — тапсырыстар жеке хабарламамен келеді.\n"
+        "📍 Жақын тапсырыстар үшін геолокацияны трансляциямен бөлісіңіз.\n"
+        "Жұмысты аяқтау: /offline"
+    )
+
+@dp.message_handler(commands=['offline'], state='*')
+async def offline_cmd(message: types.Message):
+    if not await set_online(message, False):
+        reply(message, "❌ Бұл команда тек жүргізушілерге арналған.")
+        return
+    reply(message, "⏸ Сіз желіден шықтыңыз. Қайта оралу: /online")
+
+# Кнопки меню — раньше шагов FSM, чтобы «Болдырмау» срабатывала в любом состоянии
+router.setup(dp)
+
 # ---------------------
 # Отмена заказа
 # ---------------------
-@dp.message_handler(lambda m: m.text == "❌ Болдырмау", state='*')
+@router.text("❌ Болдырмау", state='*')
 async def cancel_order(message: types.Message, state: FSMContext):
     await state.finish()
-    await message.answer("Тапсырыс болдырылмады", reply_markup=main_menu_kb())
+    reply(message, "Тапсырыс болдырылмады", reply_markup=MAIN_MENU_KB)
 
 # ---------------------
 # Процесс заказа
 # ---------------------
-@dp.message_handler(lambda m: m.text == "🚕 Такси шақыру")
-async def start_order(message: types.Message):
+TRIP_TYPES = {
+    "🏙 Қала ішінде": "city",
+    "🌄 Қаладан тыс": "intercity",
+}
+
+@router.text("🚕 Такси шақыру")
+async def start_order(message: types.Message, state: FSMContext):
     await OrderStates.waiting_trip_type.set()
-    await message.answer("Сапар түрін таңдаңыз:", reply_markup=trip_type_kb())
+    reply(message, "Сапар түрін таңдаңыз:", reply_markup=TRIP_TYPE_KB)
 
 @dp.message_handler(state=OrderStates.waiting_trip_type)
 async def get_trip_type(message: types.Message, state: FSMContext):
-    if message.text == "🏙 Қала ішінде":
-        trip_type = "city"
-        trip_type_text = "🏙 Қала ішінде"
-    elif message.text == "🌄 Қаладан тыс":
-        trip_type = "intercity"
-        trip_type_text = "🌄 Қаладан тыс"
-    else:
-        await message.answer("Сапар түрін таңдаңыз:", reply_markup=trip_type_kb())
+    trip_type = TRIP_TYPES.get(message.text)
+    if trip_type is None:
+        reply(message, "Сапар түрін таңдаңыз:", reply_markup=TRIP_TYPE_KB)
         return
 
-    await state.update_data(trip_type=trip_type, trip_type_text=trip_type_text)
+    await state.update_data(trip_type=trip_type, trip_type_text=message.text)
     await OrderStates.waiting_from.set()
-    await message.answer("Қай жерден кетесіз? (мекенжайды енгізіңіз)", reply_markup=cancel_kb())
+    passenger = await db.get_passenger(message.from_user.id)
+    reply(
+        message,
+        "Қай жерден кетесіз? (мекенжайды енгізіңіз)",
+        reply_markup=address_kb(db.passenger_addresses(passenger), location=dispatch.DISPATCH_ENABLED)
+    )
 
 @dp.message_handler(state=OrderStates.waiting_from)
 async def get_from_addr(message: types.Message, state: FSMContext):
-    await state.update_data(from_addr=message.text)
+    await state.update_data(from_addr=message.text, pickup=None)
+    await ask_to_addr(message, message.text)
+
+@dp.message_handler(content_types=types.ContentType.LOCATION, state=OrderStates.waiting_from)
+async def get_from_location(message: types.Message, state: FSMContext):
+    lat, lon = message.location.latitude, message.location.longitude
+    from_addr = f"{lat:.5f}, {lon:.5f}"
+    await state.update_data(from_addr=from_addr, pickup=[lat, lon])
+    await ask_to_addr(message, from_addr)
+
+async def ask_to_addr(message: types.Message, from_addr: str):
     await OrderStates.waiting_to.set()
-    await message.answer("Қайда барасыз? (мекенжайды енгізіңіз)", reply_markup=cancel_kb())
+    passenger = await db.get_passenger(message.from_user.id)
+    reply(
+        message,
+        "Қайда барасыз? (мекенжайды енгізіңіз)",
+        reply_markup=address_kb(db.passenger_addresses(passenger), exclude=from_addr)
+    )
 
 @dp.message_handler(state=OrderStates.waiting_to)
 async def get_to_addr(message: types.Message, state: FSMContext):
@@ -156,9 +328,10 @@ async def get_to_addr(message: types.Message, state: FSMContext):
     data = await state.get_data()
     trip_type = data.get('trip_type', 'city')
     price_hint = "Мысал: 500, 700, 1000" if trip_type == 'city' else "Мысал: 2000, 3000, 5000"
-    await message.answer(
+    reply(
+        message,
         f"💰 Өзіңіздің баға ұсынысыңызды жазыңыз (теңгемен):\n\n{price_hint}",
-        reply_markup=cancel_kb()
+        reply_markup=CANCEL_KB
     )
 
 @dp.message_handler(state=OrderStates.waiting_price)
@@ -168,14 +341,23 @@ async def get_price(message: types.Message, state: FSMContext):
         if price < 100 or price > 100000:
             raise ValueError
     except ValueError:
-        await message.answer("❌ Қате формат! 100-100000 теңге аралығында сан енгізіңіз.", reply_markup=cancel_kb())
+        reply(message, "❌ Қате формат! 100-100000 теңге аралығында сан енгізіңіз.", reply_markup=CANCEL_KB)
         return
 
     await state.update_data(price=price)
     await OrderStates.waiting_phone.set()
-    await message.answer(
+    passenger = await db.get_passenger(message.from_user.id)
+    if passenger and passenger['phone']:
+        reply(
+            message,
+            "Нөміріңізді растаңыз немесе басқа нөмір жіберіңіз:",
+            reply_markup=PHONE_CONFIRM_KB.render(saved_phone=passenger['phone'])
+        )
+        return
+    reply(
+        message,
         "Телефон нөміріңізді жіберіңіз:\n📱 Қазақстандық нөмір енгізіңіз.",
-        reply_markup=phone_kb()
+        reply_markup=PHONE_KB
     )
 
 @dp.message_handler(content_types=types.ContentType.CONTACT, state=OrderStates.waiting_phone)
@@ -183,57 +365,426 @@ async def get_phone_contact(message: types.Message, state: FSMContext):
     phone = message.contact.phone_number
     is_valid, cleaned_phone = validate_kz_phone(phone)
     if not is_valid:
-        await message.answer("❌ Қате нөмір! Қайта жіберіңіз.", reply_markup=phone_kb())
+        reply(message, "❌ Қате нөмір! Қайта жіберіңіз.", reply_markup=PHONE_KB)
         return
     await process_phone(message, state, cleaned_phone)
 
 @dp.message_handler(state=OrderStates.waiting_phone)
 async def get_phone_text(message: types.Message, state: FSMContext):
+    passenger = await db.get_passenger(message.from_user.id)
+    if passenger and passenger['phone'] and message.text == phone_confirm_text(passenger['phone']):
+        # Номер уже проверен при первом заказе
+        await process_phone(message, state, passenger['phone'])
+        return
     phone = message.text
     is_valid, cleaned_phone = validate_kz_phone(phone)
     if not is_valid:
-        await message.answer("❌ Қате нөмір! Қайта жіберіңіз.", reply_markup=phone_kb())
+        reply(message, "❌ Қате нөмір! Қайта жіберіңіз.", reply_markup=PHONE_KB)
         return
     await process_phone(message, state, cleaned_phone)
 
 async def process_phone(message: types.Message, state: FSMContext, phone: str):
     data = await state.get_data()
-    order_id = await db.insert_order(
-        data['from_addr'], data['to_addr'], data['price'], phone, message.from_user.id, data.get('trip_type', 'city')
+    # Обе записи уходят в одну пачку пайплайна записи
+    order_id, _ = await asyncio.gather(
+        db.insert_order(
+            data['from_addr'], data['to_addr'], data['price'], phone, message.from_user.id, data.get('trip_type', 'city')
+        ),
+        db.save_passenger(message.from_user.id, phone, data['from_addr'], data['to_addr']),
     )
-    msg = await bot.send_message(
+    order = dict(order_id=order_id, from_addr=data['from_addr'], to_addr=data['to_addr'],
+                 price=data['price'], phone=phone)
+    if not (dispatch.DISPATCH_ENABLED and await dispatch_order(order, data.get('pickup'))):
+        broadcast_order(order)
+    order_lifecycle.track(order_id)
+    await state.finish()
+    reply(message, "✅ Тапсырыс жіберілді!", reply_markup=MAIN_MENU_KB)
+
+def broadcast_order(order: dict, template: TextTemplate = ORDER_BROADCAST_TEXT):
+    """Заказ в группу водителей; id сообщения в группе сохраняется в заказе"""
+    async def save_group_message(msg: types.Message):
+        row = await db.update_group_message_id(order['order_id'], msg.message_id)
+        # Заказ приняли (или он истёк), пока пост был в очереди: строка захвата
+        # была без group_message_id, и пост переписываем отсюда
+        if row is not None and row['status'] != 'new':
+            show_on_board(row, board_template(row))
+
+    outbox.send_message(
         GROUP_ID,
-        f"🚕 Жаңа тапсырыс #{order_id}\n📍 {data['from_addr']} → {data['to_addr']}\n💰 {data['price']} ₸\n📱 {phone}",
-        reply_markup=accept_keyboard(order_id)
+        template.render(**order),
+        priority=PRIORITY_BROADCAST,
+        on_sent=save_group_message,
+        reply_markup=ACCEPT_KB.render(order_id=order['order_id'])
     )
-    await db.update_group_message_id(order_id, msg.message_id)
-    await state.finish()
-    await message.answer("✅ Тапсырыс жіберілді!", reply_markup=main_menu_kb())
+
+# ---------------------
+# Заказ водителям на смене (DISPATCH_ENABLED=1, см. dispatch.py)
+# ---------------------
+# Под supervisor.py у каждого воркера свой реестр. Водителя проверяет только
+# воркер, получивший его апдейт; готовое изменение он отдаёт остальным через
+# share_presence, а те применяют его в apply_presence без проверок и ответов
+drivers_online = dispatch.OnlineRegistry()
+share_presence = None  # supervisor.py ставит функцию (изменение: dict) → None
+# order_id → {'order', 'waves' (оставшиеся волны), 'offers' [(chat_id, message_id)], 'timer'}
+dispatch_orders = {}
+
+@dp.message_handler(content_types=types.ContentType.LOCATION, state='*')
+@dp.edited_message_handler(content_types=types.ContentType.LOCATION, state='*')
+async def driver_location(message: types.Message):
+    """
+    Геолокация водителя. Трансляция присылает правки того же сообщения и
+    держит водителя на смене; разовая точка только уточняет позицию.
+    """
+    driver_id = message.from_user.id
+    location = message.location
+    if location.live_period:
+        if not await is_group_driver(message.from_user):
+            return
+        action = 'online'
+        expires = message.date.timestamp() + location.live_period
+    elif message.edit_date:
+        # Трансляция остановлена — точка больше не обновится
+        update_presence(driver_id, 'stop')
+        return
+    else:
+        action = 'touch'
+        expires = time.time() + dispatch.LOCATION_TTL
+    update_presence(driver_id, action, (location.latitude, location.longitude, expires))
+
+def update_presence(driver_id: int, action: str, location: tuple = None):
+    """Изменение смены уже проверенного водителя: здесь и в реестрах остальных воркеров"""
+    change = {'driver_id': driver_id, 'action': action, 'location': location}
+    apply_presence(change)
+    if share_presence is not None:
+        share_presence(change)
+
+def apply_presence(change: dict):
+    """action: online / offline / touch (разовая точка) / stop (трансляция остановлена)"""
+    driver_id, action, location = change['driver_id'], change['action'], change['location']
+    if action == 'online':
+        drivers_online.go_online(driver_id)
+    elif action == 'offline':
+        drivers_online.go_offline(driver_id)
+    elif action == 'touch':
+        drivers_online.touch(driver_id)
+    elif action == 'stop':
+        drivers_online.index.remove(driver_id)
+    if location:
+        drivers_online.locate(driver_id, *location)
+
+async def dispatch_order(order: dict, pickup) -> bool:
+    """Разослать заказ волнами водителям на смене; False — свободных нет"""
+    # Берём с запасом: часть водителей может быть занята
+    limit = dispatch.DISPATCH_K * dispatch.DISPATCH_WAVES
+    candidates = drivers_online.candidates(pickup, limit * 2)
+    busy = await db.busy_drivers((driver_id for _, driver_id in candidates), dispatch.DISPATCH_BUSY_HOURS)
+    waves = dispatch.plan_waves([c for c in candidates if c[1] not in busy][:limit])
+    if not waves:
+        return False
+    dispatch_orders[order['order_id']] = {'order': order, 'waves': waves, 'offers': [], 'timer': None}
+    return send_wave(order['order_id'])
+
+def send_wave(order_id: int) -> bool:
+    """Следующая волна предложений в личку; False — волн не осталось"""
+    state = dispatch_orders[order_id]
+    order = state['order']
+    offers = state['offers']
+
+    async def save_offer(msg: types.Message):
+        offers.append((msg.chat.id, msg.message_id))
+
+    while state['waves']:
+        # Пока шли прошлые волны, кто-то мог уйти со смены
+        wave = [(km, driver_id) for km, driver_id in state['waves'].pop(0)
+                if drivers_online.is_online(driver_id)]
+        if not wave:
+            continue
+        drivers_online.offered(driver_id for _, driver_id in wave)
+        for km, driver_id in wave:
+            text = (ORDER_OFFER_TEXT.render(distance=km, **order) if km is not None
+                    else ORDER_BROADCAST_TEXT.render(**order))
+            outbox.send_message(
+                driver_id, text,
+                priority=PRIORITY_BROADCAST,
+                on_sent=save_offer,
+                reply_markup=ACCEPT_KB.render(order_id=order_id)
+            )
+        state['timer'] = timers.call_later(dispatch.DISPATCH_OFFER_TIMEOUT, next_wave, order_id)
+        return True
+    return False
+
+async def next_wave(order_id: int):
+    """Волна не ответила: следующая волна, после последней — в группу"""
+    state = dispatch_orders.get(order_id)
+    if state is None:
+        return
+    row = await db.get_order(order_id, cached=False)
+    if row is None or row['status'] != 'new':
+        # Принят через другой воркер (supervisor.py) — сообщаем остальным
+        withdraw_offers(order_id, row['driver_id'] if row is not None else None)
+        return
+    if send_wave(order_id):
+        return
+    broadcast_order(state['order'])
+    withdraw_offers(order_id)
+
+def withdraw_offers(order_id: int, winner_id: int = None):
+    """Убрать кнопку у предложений заказа; проигравшим — что заказ уже отдан"""
+    state = dispatch_orders.pop(order_id, None)
+    if state is None:
+        return
+    if state['timer'] is not None:
+        state['timer'].cancel()
+    for chat_id, message_id in state['offers']:
+        if chat_id == winner_id or winner_id is None:
+            outbox.submit(chat_id, lambda c=chat_id, m=message_id: bot.edit_message_reply_markup(c, m))
+        else:
+            outbox.submit(chat_id, lambda c=chat_id, m=message_id: bot.edit_message_text(
+                OFFER_TAKEN_TEXT.render(order_id=order_id), c, m
+            ))
+
+# ---------------------
+# Заказы, которые никто не принимает (см. lifecycle.py)
+# ---------------------
+def order_fields(row) -> dict:
+    return dict(order_id=row['id'], from_addr=row['from_addr'], to_addr=row['to_addr'],
+                price=row['price'], phone=row['phone'])
+
+def show_on_board(row, template: TextTemplate, priority: int = PRIORITY_BOARD):
+    """Переписать пост заказа в группе (если он там есть) под новый статус"""
+    if row['group_message_id']:
+        board.update(row['group_message_id'], template.render(
+            driver_name=row['driver_name'] or "Жүргізуші", **order_fields(row)
+        ), priority=priority)
+
+def board_template(row) -> TextTemplate:
+    """Вид поста в группе для статуса заказа"""
+    if row['status'] == 'expired':
+        return BOARD_EXPIRED_TEXT
+    return BOARD_COMPLETED_TEXT if row['completed'] else BOARD_ACCEPTED_TEXT
+
+def delete_group_message(row):
+    message_id = row['group_message_id']
+    if message_id:
+        outbox.submit(GROUP_ID, lambda: bot.delete_message(GROUP_ID, message_id))
+
+async def bump_open_order(order_id: int) -> bool:
+    """Старый пост уходит из группы, заказ публикуется заново внизу ленты"""
+    row = await db.get_order(order_id, cached=False)
+    if row is None or row['status'] != 'new':
+        return False
+    withdraw_offers(order_id)
+    delete_group_message(row)
+    broadcast_order(order_fields(row), ORDER_BUMP_TEXT)
+    return True
+
+async def expire_open_order(order_id: int) -> bool:
+    """Закрыть заказ статусом expired и сообщить пассажиру"""
+    row = await db.expire_order(order_id)
+    if row is None:
+        return False
+    withdraw_offers(order_id)
+    show_on_board(row, BOARD_EXPIRED_TEXT)
+    if row['passenger_id']:
+        outbox.send_message(
+            row['passenger_id'],
+            ORDER_EXPIRED_TEXT.render(order_id=order_id),
+            reply_markup=MAIN_MENU_KB
+        )
+    return True
+
+order_lifecycle = lifecycle.OrderLifecycle(wheel, bump_open_order, expire_open_order)
+
+# ---------------------
+# История заказов
+# ---------------------
+HISTORY_STATUS = {
+    'new': "🕐 Жаңа",
+    'accepted': "🚕 Қабылданды",
+    'expired': "⌛ Уақыты өтті",
+}
+HISTORY_ROLES = {'d': 'driver', 'p': 'passenger'}
+# Водитель, который сам ездит пассажиром, переключается между историями
+HISTORY_SWITCH = {'driver': "🧍 Жолаушы ретінде", 'passenger': "🚕 Жүргізуші ретінде"}
+HISTORY_TITLE = {'driver': " (жүргізуші)", 'passenger': " (жолаушы)"}
+# Адрес длиннее обрезается: страница из db.HISTORY_PAGE_SIZE заказов
+# должна влезать в 4096 символов сообщения Telegram
+HISTORY_ADDR_MAX = 200
+
+def encode_history_cursor(cursor) -> tuple:
+    # (created_at, id) → ("20261018153000", 123), чтобы влезть в 64 байта callback_data
+    created_at, order_id = cursor
+    return re.sub(r'\D', '', str(created_at)), order_id
+
+def decode_history_cursor(stamp: str, order_id: int):
+    """Курсор из callback_data; None, если он пуст или испорчен — тогда показываем первую страницу"""
+    try:
+        created_at = datetime.strptime(stamp, "%Y%m%d%H%M%S").strftime("%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return None
+    return created_at, order_id
+
+def short_addr(addr) -> str:
+    addr = str(addr or '')
+    return addr if len(addr) <= HISTORY_ADDR_MAX else addr[:HISTORY_ADDR_MAX - 1] + "…"
+
+def history_keyboard(role: str, older, newer, other_role: str = None):
+    keyboard = types.InlineKeyboardMarkup(row_width=2)
+    buttons = []
+    if newer:
+        buttons.append(types.InlineKeyboardButton(
+            "◀️ Жаңалары", callback_data=HISTORY.encode(role[0], 'n', *encode_history_cursor(newer))
+        ))
+    if older:
+        buttons.append(types.InlineKeyboardButton(
+            "Ескілері ▶️", callback_data=HISTORY.encode(role[0], 'o', *encode_history_cursor(older))
+        ))
+    if buttons:
+        keyboard.row(*buttons)
+    if other_role:
+        # Пустой курсор — первая страница другой роли
+        keyboard.row(types.InlineKeyboardButton(
+            HISTORY_SWITCH[role], callback_data=HISTORY.encode(other_role[0], 'o', '', 0)
+        ))
+    return keyboard
+
+def history_text(rows, title: str = "") -> str:
+    lines = [f"📊 Сіздің тапсырыстарыңыз{title}:\n"]
+    for order in rows:
+        status = "✅ Аяқталды" if order['completed'] else HISTORY_STATUS.get(order['status'], order['status'])
+        line = (f"#{order['id']} · {order['created_at']}\n"
+                f"📍 {short_addr(order['from_addr'])} → {short_addr(order['to_addr'])}\n"
+                f"💰 {order['price']} ₸ · {status}")
+        if order['rating']:
+            line += f" · {order['rating']}⭐"
+        lines.append(line)
+    return "\n\n".join(lines)
+
+async def history_view(user_id: int, role: str, cursor=None, direction: str = 'older'):
+    """(текст, клавиатура) страницы истории; None, если в этой роли заказов нет"""
+    rows, older, newer = await db.get_order_history_page(user_id, role, cursor, direction)
+    if not rows:
+        return None
+    other_role = None
+    # История водителя бывает только у зарегистрированного водителя
+    if await db.get_driver(user_id):
+        other_role = 'passenger' if role == 'driver' else 'driver'
+        other_rows, _, _ = await db.get_order_history_page(user_id, other_role, page_size=1)
+        if not other_rows:
+            other_role = None
+    title = HISTORY_TITLE[role] if other_role else ""
+    return history_text(rows, title), history_keyboard(role, older, newer, other_role)
+
+@router.text("📊 Менің тапсырыстарым")
+async def my_orders(message: types.Message, state: FSMContext):
+    user_id = message.from_user.id
+    # Водитель видит сначала заказы, которые возил; без них — свои поездки
+    view = None
+    if await db.get_driver(user_id):
+        view = await history_view(user_id, 'driver')
+    if view is None:
+        view = await history_view(user_id, 'passenger')
+    if view is None:
+        reply(message, "Сізде әлі тапсырыс жоқ.", reply_markup=MAIN_MENU_KB)
+        return
+    text, keyboard = view
+    reply(message, text, reply_markup=keyboard)
+
+@router.callback(HISTORY)
+async def callback_history(callback: types.CallbackQuery, payload):
+    role = HISTORY_ROLES.get(payload.role)
+    if role is None:
+        await callback.answer()
+        return
+    cursor = decode_history_cursor(payload.stamp, payload.order_id)
+    direction = 'newer' if payload.direction == 'n' and cursor is not None else 'older'
+    view = await history_view(callback.from_user.id, role, cursor, direction)
+    if view is not None:
+        text, keyboard = view
+        edit_message(callback, text, reply_markup=keyboard)
+    await callback.answer()
 
 # ---------------------
 # Обработка callback-ов
 # ---------------------
-@dp.callback_query_handler(lambda c: c.data.startswith("accept_"))
-async def callback_accept(callback: types.CallbackQuery):
-    order_id = int(callback.data.split("_")[1])
+@router.callback(ACCEPT)
+async def callback_accept(callback: types.CallbackQuery, payload):
+    order_id = payload.order_id
     driver_id = callback.from_user.id
     driver_name = callback.from_user.full_name or callback.from_user.username or "Жүргізуші"
-    ok = await db.try_accept_order(order_id, driver_id)
-    order = await db.get_order(order_id)
-    if not order or not ok:
+    order = await db.claim_order(order_id, driver_id, driver_name)
+    if not order:
         await callback.answer("Бұл тапсырыс қабылданған.", show_alert=True)
         return
-    await bot.send_message(driver_id, f"✅ Сіз тапсырысты қабылдадыңыз #{order_id}")
+    show_on_board(order, BOARD_ACCEPTED_TEXT)
+    await db.register_driver(driver_id, driver_name)
+    drivers_online.touch(driver_id)
+    withdraw_offers(order_id, driver_id)
+    order_lifecycle.forget(order_id)
+    # Оценки ставят у пассажиров — под supervisor.py в других воркерах
+    rating = await db.get_driver_rating(driver_id, cached=False)
+    outbox.send_message(
+        driver_id,
+        ORDER_ACCEPTED_TEXT.render(order_id=order_id, average=rating['average'], count=rating['count']),
+        priority=PRIORITY_CLAIM,
+        reply_markup=COMPLETE_KB.render(order_id=order_id)
+    )
     await callback.answer("Тапсырыс қабылданды!")
 
+@router.callback(COMPLETE)
+async def callback_complete(callback: types.CallbackQuery, payload):
+    order = await db.complete_order(payload.order_id, callback.from_user.id)
+    if not order:
+        await callback.answer("Бұл тапсырысты аяқтау мүмкін емес.", show_alert=True)
+        return
+    edit_message(callback)
+    # Кнопки на посте уже нет — правка не срочная
+    show_on_board(order, BOARD_COMPLETED_TEXT, PRIORITY_REPLY)
+    drivers_online.touch(callback.from_user.id)
+    if order['passenger_id']:
+        outbox.send_message(
+            order['passenger_id'],
+            TRIP_COMPLETED_TEXT.render(order_id=order['id']),
+            reply_markup=RATING_KB.render(order_id=order['id'])
+        )
+    await callback.answer("Сапар аяқталды!")
+
+@router.callback(RATE)
+async def callback_rate(callback: types.CallbackQuery, payload):
+    order = await db.get_order(payload.order_id)
+    if not order or order['passenger_id'] != callback.from_user.id or not 1 <= payload.stars <= 5:
+        await callback.answer("Бұл тапсырысты бағалау мүмкін емес.", show_alert=True)
+        return
+    if not await db.set_rating(payload.order_id, payload.stars):
+        # Не записалось: либо оценка уже есть, либо поездка не завершена
+        order = await db.get_order(payload.order_id, cached=False)
+        if order and order['rating']:
+            await callback.answer("Сіз бұл сапарды бағалап қойдыңыз.")
+        else:
+            await callback.answer("Бұл тапсырысты бағалау мүмкін емес.", show_alert=True)
+        return
+    edit_message(callback, TRIP_RATED_TEXT.render(order_id=order['id'], stars=payload.stars))
+    await callback.answer("Рахмет!")
+
 # ---------------------
 # Запуск через polling
 # ---------------------
 async def on_startup(_):
-    await db.init_db()
+    await db.init_db(DB_PATH)
+    await db.prune_order_events()
+    await storage.start()
+    outbox.start()
+    timers.start()
+    stale = await db.expire_stale_orders(lifecycle.ORDER_STALE_AFTER)
+    restored = order_lifecycle.rebuild(await db.open_orders(*BOT_SHARD))
+    print(f"Открытых заказов: {restored}, закрыто давних: {stale}")
     print("✅ База данных инициализирована!")
 
 async def on_shutdown(_):
+    await timers.close()
+    await outbox.close()
+    await storage.close()
+    await db.close_db()
     print("🛑 Бот өшірілді.")
 
 if __name__ == '__main__':
@@ -1,18 +1,197 @@
+import asyncio
+import json
+import re
+import time
+from collections import OrderedDict
+
 import aiosqlite
 
 DB_PATH = "taxi.db"
-db_conn: aiosqlite.Connection | None = None  # глобальное соединение
+db_conn: aiosqlite.Connection | None = None  # глобальное соединение, через него идут записи
+# Чтения вне записи — через отдельное соединение: на db_conn пачка писателя держит
+# открытую транзакцию, и чтение между её запросами увидело бы (и положило в кэш)
+# строки, которые ещё могут откатиться
+read_conn: aiosqlite.Connection | None = None
+
+# Пайплайн записи: один писатель собирает изменения в пачки и коммитит их
+# одной транзакцией (один fsync на пачку вместо одного на запрос)
+WRITE_BATCH_SIZE = 64        # максимум изменений в одной транзакции
+WRITE_FLUSH_LATENCY = 0.005  # сколько ждать добора пачки, секунд
+BUSY_TIMEOUT_MS = 5000       # ожидание блокировки записи другим процессом
+
+_write_queue: asyncio.Queue | None = None
+_writer_task: asyncio.Task | None = None
+# Без пайплайна записи транзакции на общем соединении идут по одной
+_write_lock: asyncio.Lock | None = None
+
+# Движок захвата заказов: гонка водителей решается в памяти,
+# в БД уходит только запрос победителя
+CLAIMS_MAX = 10000  # сколько решённых заказов помнить
+_CLAIM_PENDING = object()  # победитель выбран, запись ещё идёт
+_CLAIM_LOST = object()     # заказ уже был принят (по данным БД)
+_claims: "OrderedDict[int, object]" = OrderedDict()
+
+
+# ---------------------
+# Кэш строк orders/drivers/passengers
+# ---------------------
+class RowCache:
+    """LRU-кэш строк с TTL и счётчиками hit/miss/eviction"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._rows: "OrderedDict[int, tuple]" = OrderedDict()
+
+    def get(self, key):
+        entry = self._rows.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires, row = entry
+        if expires < time.monotonic():
+            del self._rows[key]
+            self.evictions += 1
+            self.misses += 1
+            return None
+        self._rows.move_to_end(key)
+        self.hits += 1
+        return row
+
+    def put(self, key, row):
+        if row is None:
+            self.invalidate(key)
+            return
+        self._rows[key] = (time.monotonic() + self.ttl, row)
+        self._rows.move_to_end(key)
+        while len(self._rows) > self.maxsize:
+            self._rows.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        self._rows.pop(key, None)
+
+    def clear(self):
+        self._rows.clear()
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._rows),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+ORDER_CACHE_SIZE = 4096
+ORDER_CACHE_TTL = 300   # секунд
+DRIVER_CACHE_SIZE = 2048
+DRIVER_CACHE_TTL = 600  # секунд
+PASSENGER_CACHE_SIZE = 4096
+PASSENGER_CACHE_TTL = 600  # секунд
+
+order_cache = RowCache(ORDER_CACHE_SIZE, ORDER_CACHE_TTL)
+# Под supervisor.py оценку пишет воркер пассажира, и свежий рейтинг есть только
+# в его кэше — где он показывается водителю, читайте с cached=False
+driver_cache = RowCache(DRIVER_CACHE_SIZE, DRIVER_CACHE_TTL)
+passenger_cache = RowCache(PASSENGER_CACHE_SIZE, PASSENGER_CACHE_TTL)
+
+
+def cache_stats() -> dict:
+    """Счётчики кэшей — для подбора размеров"""
+    return {
+        'orders': order_cache.stats(),
+        'drivers': driver_cache.stats(),
+        'passengers': passenger_cache.stats(),
+    }
 
 
 # ---------------------
 # Инициализация базы
 # ---------------------
-async def init_db(path: str = DB_PATH):
-    global db_conn
-    db_conn = await aiosqlite.connect(path)
+async def init_db(path: str = DB_PATH, write_pipeline: bool = True,
+                  batch_size: int = WRITE_BATCH_SIZE,
+                  flush_latency: float = WRITE_FLUSH_LATENCY):
+    global db_conn, _write_lock
+    _write_lock = asyncio.Lock()
+    # isolation_level=None — транзакциями управляем сами (BEGIN/COMMIT)
+    db_conn = await aiosqlite.connect(path, isolation_level=None)
+    await db_conn.execute("PRAGMA journal_mode=WAL")
+    await db_conn.execute("PRAGMA synchronous=NORMAL")
+    # Несколько процессов бота (supervisor.py) пишут в одну базу — ждём блокировку
+    await db_conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+
+    db_conn.row_factory = aiosqlite.Row
+    await migrate(db_conn)
+
+    global read_conn
+    read_conn = await aiosqlite.connect(path, isolation_level=None)
+    await read_conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    await read_conn.execute("PRAGMA query_only=1")
+    read_conn.row_factory = aiosqlite.Row
+
+    if write_pipeline:
+        start_write_pipeline(batch_size, flush_latency)
+    print("База данных инициализирована!")
+
+
+async def close_db():
+    """Дописать очередь записи и закрыть соединение"""
+    global db_conn, read_conn
+    await stop_write_pipeline()
+    if read_conn is not None:
+        await read_conn.close()
+        read_conn = None
+    if db_conn is not None:
+        await db_conn.close()
+        db_conn = None
+
+
+# ---------------------
+# Миграции схемы
+# ---------------------
+# Версия схемы хранится в PRAGMA user_version: миграция N переводит базу
+# с версии N-1 на N. Новые миграции добавляются только в конец списка.
+async def _table_columns(conn, table: str) -> set:
+    cur = await conn.execute(f"PRAGMA table_info({table})")
+    rows = await cur.fetchall()
+    await cur.close()
+    return {row[1] for row in rows}
+
+
+# Колонки базовой схемы, которых может не быть в таблицах старых версий бота.
+# ALTER TABLE не принимает DEFAULT CURRENT_TIMESTAMP, поэтому created_at — без него
+LEGACY_COLUMNS = {
+    'orders': {
+        'from_addr': "TEXT",
+        'to_addr': "TEXT",
+        'price': "INTEGER",
+        'phone': "TEXT",
+        'passenger_id': "INTEGER",
+        'status': "TEXT DEFAULT 'new'",
+        'driver_id': "INTEGER",
+        'group_message_id': "INTEGER",
+        'trip_type': "TEXT DEFAULT 'city'",
+        'completed': "INTEGER DEFAULT 0",
+        'rating': "INTEGER DEFAULT 0",
+        'created_at': "TIMESTAMP",
+    },
+    'drivers': {
+        'name': "TEXT",
+        'car_model': "TEXT",
+        'rating': "REAL DEFAULT 0",
+        'rating_count': "INTEGER DEFAULT 0",
+    },
+}
 
-    # Создаём таблицу orders
-    await db_conn.execute("""
+
+async def _migration_base_schema(conn):
+    """базовые таблицы orders и drivers"""
+    await conn.execute("""
         CREATE TABLE IF NOT EXISTS orders (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             from_addr TEXT,
@@ -29,9 +208,7 @@ async def init_db(path: str = DB_PATH):
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     """)
-
-    # Создаём таблицу drivers
-    await db_conn.execute("""
+    await conn.execute("""
         CREATE TABLE IF NOT EXISTS drivers (
             id INTEGER PRIMARY KEY,
             name TEXT,
@@ -41,151 +218,902 @@ async def init_db(path: str = DB_PATH):
         )
     """)
 
-    # Проверяем и добавляем новые колонки (миграция)
+    # Старые базы могли быть созданы до появления этих колонок, а следующие
+    # миграции строят по ним индексы и триггеры — добавляем все недостающие
+    for table, legacy_columns in LEGACY_COLUMNS.items():
+        columns = await _table_columns(conn, table)
+        for column, definition in legacy_columns.items():
+            if column not in columns:
+                await conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+async def _migration_driver_name(conn):
+    """колонка orders.driver_name для stats.py"""
+    # Раньше её добавлял отдельный скрипт add_driver_name_column.py
+    if 'driver_name' not in await _table_columns(conn, "orders"):
+        await conn.execute("ALTER TABLE orders ADD COLUMN driver_name TEXT")
+
+
+async def _migration_orders_indexes(conn):
+    """индексы orders для истории, фильтров админки и статистики"""
+    await conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_orders_driver_created ON orders(driver_id, created_at)"
+    )
+    await conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_orders_status_created ON orders(status, completed, created_at)"
+    )
+    await conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_orders_passenger_created ON orders(passenger_id, created_at)"
+    )
+    # Частичный индекс: открытых заказов мало, индекс остаётся крошечным
+    await conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_orders_open ON orders(created_at) WHERE status='new'"
+    )
+
+
+async def _migration_driver_rating_aggregates(conn):
+    """сумма и гистограмма оценок водителей"""
+    await conn.execute("ALTER TABLE drivers ADD COLUMN rating_sum INTEGER DEFAULT 0")
+    for stars in range(1, 6):
+        await conn.execute(f"ALTER TABLE drivers ADD COLUMN stars_{stars} INTEGER DEFAULT 0")
+    await rebuild_rating_aggregates(conn)
+
+
+async def _migration_fsm_state(conn):
+    """таблица fsm_state для SQLiteStorage"""
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS fsm_state (
+            chat TEXT NOT NULL,
+            user TEXT NOT NULL,
+            state TEXT,
+            data TEXT,
+            PRIMARY KEY (chat, user)
+        ) WITHOUT ROWID
+    """)
+
+
+async def _migration_passengers(conn):
+    """профили пассажиров: телефон и последние адреса"""
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS passengers (
+            id INTEGER PRIMARY KEY,
+            phone TEXT,
+            addresses TEXT DEFAULT '[]',
+            orders_count INTEGER DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    # Заполняем из истории: последний телефон и последние адреса каждого пассажира
+    cur = await conn.execute(
+        "SELECT passenger_id, phone, from_addr, to_addr FROM orders "
+        "WHERE passenger_id IS NOT NULL ORDER BY passenger_id, id DESC"
+    )
+    profiles = {}
+    async for row in cur:
+        # Старые заказы хранили номер как ввели; берём только нормализованный +7XXXXXXXXXX,
+        # остальные пассажиры пройдут проверку номера при следующем заказе
+        phone = row["phone"] if re.fullmatch(r'\+7\d{10}', row["phone"] or '') else None
+        profile = profiles.setdefault(row["passenger_id"], {'phone': phone, 'addresses': [], 'count': 0})
+        profile['count'] += 1
+        profile['addresses'] = _recent_addresses(profile['addresses'], row["from_addr"], row["to_addr"], prepend=False)
+    await cur.close()
+    await conn.executemany(
+        "INSERT OR IGNORE INTO passengers (id, phone, addresses, orders_count) VALUES (?, ?, ?, ?)",
+        [(pid, p['phone'], json.dumps(p['addresses'], ensure_ascii=False), p['count'])
+         for pid, p in profiles.items()]
+    )
+
+
+async def _migration_daily_driver_stats(conn):
+    """дневные агрегаты по водителям daily_driver_stats"""
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS daily_driver_stats (
+            day TEXT NOT NULL,
+            driver_id INTEGER NOT NULL,
+            orders INTEGER NOT NULL DEFAULT 0,
+            completed INTEGER NOT NULL DEFAULT 0,
+            revenue INTEGER NOT NULL DEFAULT 0,
+            rating_sum INTEGER NOT NULL DEFAULT 0,
+            rating_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, driver_id)
+        ) WITHOUT ROWID
+    """)
+    for statement in DAILY_STATS_TRIGGERS:
+        await conn.execute(statement)
+    await conn.execute(DAILY_STATS_CLEAR_SQL)
+    await conn.execute(DAILY_STATS_REBUILD_SQL)
+
+
+async def _migration_orders_created_index(conn):
+    """индекс orders(created_at) для постраничной таблицы заказов в админке"""
+    # Ключ страницы (created_at, id): id — это rowid, он уже лежит в каждой записи индекса
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_created ON orders(created_at)")
+
+
+async def _migration_order_events(conn):
+    """журнал событий заказов order_events для живой админки"""
+    # AUTOINCREMENT: id не переиспользуются после чистки, читатели идут по id > последнего
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS order_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            driver_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_order_events_created ON order_events(created_at)")
+    for statement in ORDER_EVENTS_TRIGGERS:
+        await conn.execute(statement)
+
+
+async def _migration_report_checkpoint(conn):
+    """таблицы отчётов stats.py: итоги по периодам, учтённые заказы, контрольная точка"""
+    # Итоги по водителю за день/неделю/месяц (start — первый день периода)
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS report_totals (
+            period TEXT NOT NULL,
+            start TEXT NOT NULL,
+            driver_id INTEGER NOT NULL,
+            orders INTEGER NOT NULL DEFAULT 0,
+            completed INTEGER NOT NULL DEFAULT 0,
+            revenue INTEGER NOT NULL DEFAULT 0,
+            rating_sum INTEGER NOT NULL DEFAULT 0,
+            rating_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (period, start, driver_id)
+        ) WITHOUT ROWID
+    """)
+    # Вклад каждого заказа в том виде, в каком он уже учтён в report_totals
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS report_folded (
+            order_id INTEGER PRIMARY KEY,
+            day TEXT,
+            driver_id INTEGER NOT NULL,
+            completed INTEGER NOT NULL,
+            revenue INTEGER NOT NULL,
+            rating_sum INTEGER NOT NULL,
+            rating_count INTEGER NOT NULL
+        )
+    """)
+    # Последнее учтённое событие order_events; строки нет — нужна полная пересборка
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS report_checkpoint (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last_event_id INTEGER NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+async def _migration_order_expired(conn):
+    """статус заказа expired и событие expired в журнале"""
+    # Остальные триггеры уже есть (IF NOT EXISTS), добавится только новый
+    for statement in ORDER_EVENTS_TRIGGERS:
+        await conn.execute(statement)
+
+
+MIGRATIONS = [
+    _migration_base_schema,
+    _migration_driver_name,
+    _migration_orders_indexes,
+    _migration_driver_rating_aggregates,
+    _migration_fsm_state,
+    _migration_passengers,
+    _migration_daily_driver_stats,
+    _migration_orders_created_index,
+    _migration_order_events,
+    _migration_report_checkpoint,
+    _migration_order_expired,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+async def _schema_version(conn) -> int:
+    cur = await conn.execute("PRAGMA user_version")
+    row = await cur.fetchone()
+    await cur.close()
+    return row[0]
+
+
+async def migrate(conn):
+    """Применить недостающие миграции, каждую в своей транзакции"""
+    if await _schema_version(conn) >= SCHEMA_VERSION:
+        return  # схема актуальна — никакой интроспекции
+
+    for number, migration in enumerate(MIGRATIONS, start=1):
+        # IMMEDIATE сразу берёт блокировку записи: два процесса
+        # не применят одну миграцию дважды
+        await conn.execute("BEGIN IMMEDIATE")
+        try:
+            if await _schema_version(conn) >= number:
+                await conn.execute("ROLLBACK")
+                continue
+            await migration(conn)
+            await conn.execute(f"PRAGMA user_version = {number}")
+        except BaseException:
+            await conn.execute("ROLLBACK")
+            raise
+        await conn.execute("COMMIT")
+        print(f"Миграция {number}: {migration.__doc__}")
+
+
+# ---------------------
+# Пайплайн записи (group commit)
+# ---------------------
+def start_write_pipeline(batch_size: int = WRITE_BATCH_SIZE,
+                         flush_latency: float = WRITE_FLUSH_LATENCY):
+    """Запустить задачу-писателя. Без неё каждая запись коммитится отдельно."""
+    global _write_queue, _writer_task
+    if _writer_task is not None:
+        return
+    _write_queue = asyncio.Queue()
+    _writer_task = asyncio.create_task(_writer_loop(batch_size, flush_latency))
+
+
+async def stop_write_pipeline():
+    """Закоммитить всё, что уже в очереди, и остановить писателя"""
+    global _write_queue, _writer_task
+    if _writer_task is None:
+        return
+    await _write_queue.put(None)
+    await _writer_task
+    _write_queue = None
+    _writer_task = None
+
+
+async def _write(op):
+    """
+    Выполнить изменение op(conn) и дождаться коммита.
+    Возвращает результат op — после возврата запись уже видна всем читателям.
+    """
+    if _writer_task is None:
+        # Второй BEGIN на том же соединении упал бы с «transaction within a transaction»
+        async with _write_lock:
+            await db_conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = await op(db_conn)
+            except BaseException:
+                await db_conn.execute("ROLLBACK")
+                raise
+            await db_conn.execute("COMMIT")
+            return result
+
+    fut = asyncio.get_running_loop().create_future()
+    await _write_queue.put((op, fut))
+    return await fut
+
+
+async def execute_write(op):
+    """Выполнить произвольное изменение op(conn) через пайплайн записи"""
+    return await _write(op)
+
+
+async def _writer_loop(batch_size: int, flush_latency: float):
+    loop = asyncio.get_running_loop()
+    stopping = False
+    while not stopping:
+        item = await _write_queue.get()
+        if item is None:
+            break
+        batch = [item]
+        deadline = loop.time() + flush_latency
+        # Добираем пачку: сначала всё, что уже лежит в очереди,
+        # потом ждём новые изменения не дольше flush_latency
+        while len(batch) < batch_size:
+            try:
+                item = _write_queue.get_nowait()
+            except asyncio.QueueEmpty:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(_write_queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            if item is None:
+                stopping = True
+                break
+            batch.append(item)
+        await _commit_batch(batch)
+
+
+async def _commit_batch(batch):
+    results = []
     try:
-        cursor = await db_conn.execute("PRAGMA table_info(orders)")
-        columns = await cursor.fetchall()
-        column_names = [col[1] for col in columns]
-
-        # Добавляем completed если нет
-        if 'completed' not in column_names:
-            print("Добавляем колонку 'completed'...")
-            await db_conn.execute("ALTER TABLE orders ADD COLUMN completed INTEGER DEFAULT 0")
-            print("Колонка 'completed' добавлена!")
-
-        # Добавляем trip_type если нет
-        if 'trip_type' not in column_names:
-            print("Добавляем колонку 'trip_type'...")
-            await db_conn.execute("ALTER TABLE orders ADD COLUMN trip_type TEXT DEFAULT 'city'")
-            print("Колонка 'trip_type' добавлена!")
-
-        # Добавляем rating если нет
-        if 'rating' not in column_names:
-            print("Добавляем колонку 'rating'...")
-            await db_conn.execute("ALTER TABLE orders ADD COLUMN rating INTEGER DEFAULT 0")
-            print("Колонка 'rating' добавлена!")
-
-        await cursor.close()
+        # IMMEDIATE — блокировка записи берётся сразу (с ожиданием busy_timeout),
+        # а не при первом UPDATE, где конфликт с другим процессом уже не ждут
+        await db_conn.execute("BEGIN IMMEDIATE")
+        for op, fut in batch:
+            # Savepoint на каждое изменение: ошибка одного вызова
+            # не откатывает остальные изменения пачки
+            await db_conn.execute("SAVEPOINT write_op")
+            try:
+                result = await op(db_conn)
+            except Exception as e:
+                await db_conn.execute("ROLLBACK TO write_op")
+                await db_conn.execute("RELEASE write_op")
+                results.append((fut, e, None))
+                continue
+            await db_conn.execute("RELEASE write_op")
+            results.append((fut, None, result))
+        await db_conn.execute("COMMIT")
     except Exception as e:
-        print(f"Ошибка при миграции: {e}")
+        if db_conn.in_transaction:
+            await db_conn.execute("ROLLBACK")
+        print(f"Ошибка записи пачки: {e}")
+        for _, fut in batch:
+            if not fut.done():
+                fut.set_exception(e)
+        return
 
-    await db_conn.commit()
-    print("База данных инициализирована!")
+    for fut, exc, result in results:
+        if fut.done():
+            continue
+        if exc is not None:
+            fut.set_exception(exc)
+        else:
+            fut.set_result(result)
 
 
 # ---------------------
 # Функции работы с БД
 # ---------------------
+# Пишущие функции возвращают изменённую строку (RETURNING *) и кладут её
+# в кэш уже после коммита — следующие чтения не ходят в SQLite
+async def _write_row(sql: str, params) -> "aiosqlite.Row | None":
+    async def op(conn):
+        cur = await conn.execute(sql, params)
+        row = await cur.fetchone()
+        await cur.close()
+        return row
+    return await _write(op)
+
+
 async def insert_order(from_addr, to_addr, price, phone, passenger_id, trip_type='city'):
-    cur = await db_conn.execute(
-        "INSERT INTO orders (from_addr,to_addr,price,phone,passenger_id,trip_type) VALUES (?,?,?,?,?,?)",
+    row = await _write_row(
+        "INSERT INTO orders (from_addr,to_addr,price,phone,passenger_id,trip_type) "
+        "VALUES (?,?,?,?,?,?) RETURNING *",
         (from_addr, to_addr, price, phone, passenger_id, trip_type)
     )
-    await db_conn.commit()
-    last_id = cur.lastrowid
-    await cur.close()
-    return last_id
+    order_cache.put(row["id"], row)
+    return row["id"]
+
+
+# ---------------------
+# Профили пассажиров
+# ---------------------
+RECENT_ADDRESSES = 4  # сколько последних адресов помним
+
+
+def _recent_addresses(addresses: list, *new, prepend: bool = True) -> list:
+    """Список адресов без повторов, не длиннее RECENT_ADDRESSES"""
+    new = [a for a in new if a]
+    merged = [*new, *addresses] if prepend else [*addresses, *new]
+    return list(dict.fromkeys(merged))[:RECENT_ADDRESSES]
+
+
+_NO_PASSENGER = object()  # в кэше: профиля нет — новичок не ходит в БД на каждом шаге
+
+
+async def get_passenger(user_id):
+    """Профиль пассажира (id, phone, addresses, orders_count) или None"""
+    row = passenger_cache.get(user_id)
+    if row is None:
+        cur = await read_conn.execute("SELECT * FROM passengers WHERE id=?", (user_id,))
+        row = await cur.fetchone()
+        await cur.close()
+        passenger_cache.put(user_id, _NO_PASSENGER if row is None else row)
+    return None if row is _NO_PASSENGER else row
+
+
+def passenger_addresses(row) -> list:
+    """Последние адреса пассажира, самый свежий первым"""
+    if row is None or not row["addresses"]:
+        return []
+    return json.loads(row["addresses"])
+
+
+async def save_passenger(user_id, phone, from_addr=None, to_addr=None):
+    """Запомнить проверенный телефон и адреса заказа"""
+    current = await get_passenger(user_id)
+    addresses = _recent_addresses(passenger_addresses(current), from_addr, to_addr)
+    row = await _write_row(
+        "INSERT INTO passengers (id, phone, addresses, orders_count) VALUES (?, ?, ?, 1) "
+        "ON CONFLICT(id) DO UPDATE SET phone=excluded.phone, addresses=excluded.addresses, "
+        "orders_count=orders_count + 1, updated_at=CURRENT_TIMESTAMP RETURNING *",
+        (user_id, phone, json.dumps(addresses, ensure_ascii=False))
+    )
+    passenger_cache.put(user_id, row)
+    return row
 
 
 async def update_group_message_id(order_id, message_id):
-    await db_conn.execute(
-        "UPDATE orders SET group_message_id=? WHERE id=?",
+    """Запомнить пост заказа в группе; возвращает строку заказа на момент записи"""
+    row = await _write_row(
+        "UPDATE orders SET group_message_id=? WHERE id=? RETURNING *",
         (message_id, order_id)
     )
-    await db_conn.commit()
+    order_cache.put(order_id, row)
+    return row
 
 
-async def get_order(order_id):
-    cur = await db_conn.execute("SELECT * FROM orders WHERE id=?", (order_id,))
+async def get_order(order_id, cached: bool = True):
+    """cached=False — прочитать из БД: заказ мог принять другой процесс (supervisor.py)"""
+    row = order_cache.get(order_id) if cached else None
+    if row is not None:
+        return row
+    cur = await read_conn.execute("SELECT * FROM orders WHERE id=?", (order_id,))
     row = await cur.fetchone()
     await cur.close()
+    order_cache.put(order_id, row)
     return row
 
 
 async def try_accept_order(order_id, driver_id):
-    await db_conn.execute(
-        "UPDATE orders SET status='accepted', driver_id=? WHERE id=? AND status='new'",
-        (driver_id, order_id)
+    return await claim_order(order_id, driver_id) is not None
+
+
+async def complete_order(order_id, driver_id=None):
+    """
+    Отметить заказ завершённым. С driver_id — только если заказ принят этим
+    водителем и ещё не завершён. Возвращает строку заказа или None.
+    """
+    if driver_id is None:
+        row = await _write_row("UPDATE orders SET completed=1 WHERE id=? RETURNING *", (order_id,))
+    else:
+        row = await _write_row(
+            "UPDATE orders SET completed=1 "
+            "WHERE id=? AND driver_id=? AND status='accepted' AND COALESCE(completed, 0)=0 RETURNING *",
+            (order_id, driver_id)
+        )
+    order_cache.put(order_id, row)
+    return row
+
+
+async def set_rating(order_id, rating: int):
+    """
+    Сохранить оценку заказа и учесть её в агрегатах водителя — одной транзакцией.
+    Оценить можно только завершённую поездку с водителем, и только один раз.
+    Возвращает строку заказа или None, если заказ уже оценён или поездка не завершена.
+    """
+    rating = _check_stars(rating)
+
+    async def op(conn):
+        cur = await conn.execute(
+            "UPDATE orders SET rating=? "
+            "WHERE id=? AND COALESCE(rating, 0)=0 "
+            "AND status='accepted' AND completed=1 AND driver_id IS NOT NULL RETURNING *",
+            (rating, order_id)
+        )
+        order = await cur.fetchone()
+        await cur.close()
+        driver = None
+        if order:
+            cur = await conn.execute(_RATE_DRIVER_SQL[rating], (order["driver_id"], rating))
+            driver = await cur.fetchone()
+            await cur.close()
+        return order, driver
+
+    order, driver = await _write(op)
+    if order is not None:
+        order_cache.put(order_id, order)
+    if driver is not None:
+        driver_cache.put(driver["id"], driver)
+    return order
+
+
+async def rate_driver(driver_id: int, new_rating: int):
+    new_rating = _check_stars(new_rating)
+    row = await _write_row(_RATE_DRIVER_SQL[new_rating], (driver_id, new_rating))
+    driver_cache.put(driver_id, row)
+
+
+async def register_driver(driver_id: int, name: str = None):
+    if driver_cache.get(driver_id) is not None:
+        return  # уже зарегистрирован
+    row = await _write_row(
+        "INSERT INTO drivers (id, name) VALUES (?, ?) "
+        "ON CONFLICT(id) DO UPDATE SET name=COALESCE(drivers.name, excluded.name) "
+        "RETURNING *",
+        (driver_id, name)
     )
-    await db_conn.commit()
+    driver_cache.put(driver_id, row)
 
-    cur = await db_conn.execute("SELECT driver_id FROM orders WHERE id=?", (order_id,))
-    row = await cur.fetchone()
-    await cur.close()
-    return bool(row and row[0] == driver_id)
 
+# ---------------------
+# Захват заказа водителем
+# ---------------------
+async def claim_order(order_id: int, driver_id: int, driver_name: str = None):
+    """
+    Попытаться принять заказ. Возвращает строку заказа победителю, иначе None.
+    Проигравшие отклоняются без обращения к БД.
+    """
+    claim = _claims.get(order_id)
+    if claim is not None:
+        # Повторное нажатие победителя — отдаём ту же строку
+        if claim not in (_CLAIM_PENDING, _CLAIM_LOST) and claim["driver_id"] == driver_id:
+            return claim
+        return None
+
+    # Проверка и запись без await между ними — атомарно для event loop
+    _claims[order_id] = _CLAIM_PENDING
+    if len(_claims) > CLAIMS_MAX:
+        _claims.popitem(last=False)
 
-async def complete_order(order_id):
-    await db_conn.execute("UPDATE orders SET completed=1 WHERE id=?", (order_id,))
-    await db_conn.commit()
+    try:
+        row = await _write_row(
+            "UPDATE orders SET status='accepted', driver_id=?, driver_name=? "
+            "WHERE id=? AND status='new' RETURNING *",
+            (driver_id, driver_name, order_id)
+        )
+    except Exception:
+        # Запись не удалась — освобождаем заказ для следующей попытки
+        _claims.pop(order_id, None)
+        raise
 
+    _claims[order_id] = row if row is not None else _CLAIM_LOST
+    if row is not None:
+        order_cache.put(order_id, row)
+    else:
+        order_cache.invalidate(order_id)
+    return row
 
-async def set_rating(order_id, rating: int):
-    # Сохраняем рейтинг в заказе
-    await db_conn.execute("UPDATE orders SET rating=? WHERE id=?", (rating, order_id))
-    await db_conn.commit()
-    
-    # Обновляем средний рейтинг водителя
-    cur = await db_conn.execute("SELECT driver_id FROM orders WHERE id=?", (order_id,))
-    row = await cur.fetchone()
+
+async def expire_order(order_id: int):
+    """Закрыть заказ, который никто не принял; None — его уже приняли или закрыли"""
+    row = await _write_row(
+        "UPDATE orders SET status='expired' WHERE id=? AND status='new' RETURNING *", (order_id,)
+    )
+    if row is not None:
+        order_cache.put(order_id, row)
+        # Поздние нажатия «Қабылдау» отклоняются без обращения к БД
+        _claims[order_id] = _CLAIM_LOST
+        if len(_claims) > CLAIMS_MAX:
+            _claims.popitem(last=False)
+    else:
+        order_cache.invalidate(order_id)
+    return row
+
+
+async def expire_stale_orders(max_age: float) -> int:
+    """Закрыть одним UPDATE открытые заказы старше max_age секунд (без уведомлений)"""
+    async def op(conn):
+        cur = await conn.execute(
+            "UPDATE orders SET status='expired' WHERE status='new' AND created_at < datetime('now', ?)",
+            (f"-{int(max_age)} seconds",)
+        )
+        await cur.close()
+        return cur.rowcount
+    return await _write(op)
+
+
+async def open_orders(shard: int = 0, shards: int = 1) -> list:
+    """
+    Заказы status='new' с возрастом в секундах — одним проходом по частичному
+    индексу idx_orders_open. shard/shards — только заказы пассажиров этого воркера.
+    """
+    cur = await read_conn.execute(
+        "SELECT id, passenger_id, group_message_id, "
+        "(julianday('now') - julianday(created_at)) * 86400 AS age "
+        "FROM orders INDEXED BY idx_orders_open "
+        "WHERE status='new' AND COALESCE(passenger_id, 0) % ? = ? ORDER BY created_at",
+        (shards, shard)
+    )
+    rows = await cur.fetchall()
     await cur.close()
-    if row and row[0]:
-        driver_id = row[0]
-        await rate_driver(driver_id, rating)
+    return rows
 
 
-async def rate_driver(driver_id: int, new_rating: float):
-    cur = await db_conn.execute("SELECT rating, rating_count FROM drivers WHERE id=?", (driver_id,))
-    row = await cur.fetchone()
+async def busy_drivers(driver_ids, hours: int) -> set:
+    """Кто из водителей сейчас везёт пассажира: принял заказ за hours часов и не завершил"""
+    driver_ids = list(driver_ids)
+    if not driver_ids:
+        return set()
+    cur = await read_conn.execute(
+        f"SELECT DISTINCT driver_id FROM orders "
+        f"WHERE driver_id IN ({','.join('?' * len(driver_ids))}) AND created_at >= datetime('now', ?) "
+        f"AND status='accepted' AND COALESCE(completed, 0)=0",
+        (*driver_ids, f"-{hours} hours")
+    )
+    rows = await cur.fetchall()
     await cur.close()
+    return {row[0] for row in rows}
+
+
+# ---------------------
+# Рейтинг водителей
+# ---------------------
+# drivers хранит сумму, количество и гистограмму оценок 1–5;
+# средний рейтинг пересчитывается в том же UPSERT, атомарно
+def _rate_driver_sql(stars: int) -> str:
+    return f"""
+        INSERT INTO drivers (id, rating, rating_sum, rating_count, stars_{stars})
+        VALUES (?1, ?2 * 1.0, ?2, 1, 1)
+        ON CONFLICT(id) DO UPDATE SET
+            rating_sum = rating_sum + excluded.rating_sum,
+            rating_count = rating_count + 1,
+            rating = (rating_sum + excluded.rating_sum) * 1.0 / (rating_count + 1),
+            stars_{stars} = stars_{stars} + 1
+        RETURNING *
+    """
+
 
-    if row:
-        old_rating, rating_count = row
-        total_score = old_rating * rating_count + new_rating
-        new_count = rating_count + 1
-        new_avg = total_score / new_count
-        await db_conn.execute(
-            "UPDATE drivers SET rating=?, rating_count=? WHERE id=?",
-            (new_avg, new_count, driver_id)
+_RATE_DRIVER_SQL = {stars: _rate_driver_sql(stars) for stars in range(1, 6)}
+
+
+def _check_stars(rating) -> int:
+    rating = int(rating)
+    if rating not in _RATE_DRIVER_SQL:
+        raise ValueError(f"Оценка должна быть от 1 до 5: {rating}")
+    return rating
+
+
+async def get_driver_rating(driver_id: int, cached: bool = True):
+    """Средний рейтинг, число оценок и гистограмма [1⭐..5⭐] водителя"""
+    row = await get_driver(driver_id, cached)
+    if not row:
+        return {'average': 0.0, 'count': 0, 'stars': [0] * 5}
+    return {
+        'average': row["rating"] or 0.0,
+        'count': row["rating_count"] or 0,
+        'stars': [row[f"stars_{stars}"] or 0 for stars in range(1, 6)],
+    }
+
+
+async def rebuild_rating_aggregates(conn=None):
+    """
+    Пересобрать агрегаты рейтинга всех водителей из orders.rating за один проход.
+    Вызывают миграция 4 и python stats.py --rebuild-ratings.
+    """
+    async def op(conn):
+        await conn.execute(
+            "UPDATE drivers SET rating=0, rating_sum=0, rating_count=0, "
+            "stars_1=0, stars_2=0, stars_3=0, stars_4=0, stars_5=0"
         )
+        await conn.execute("""
+            INSERT INTO drivers (id, rating, rating_sum, rating_count,
+                                 stars_1, stars_2, stars_3, stars_4, stars_5)
+            SELECT driver_id, SUM(rating) * 1.0 / COUNT(*), SUM(rating), COUNT(*),
+                   SUM(rating = 1), SUM(rating = 2), SUM(rating = 3),
+                   SUM(rating = 4), SUM(rating = 5)
+            FROM orders
+            WHERE driver_id IS NOT NULL AND rating BETWEEN 1 AND 5
+            GROUP BY driver_id
+            ON CONFLICT(id) DO UPDATE SET
+                rating = excluded.rating,
+                rating_sum = excluded.rating_sum,
+                rating_count = excluded.rating_count,
+                stars_1 = excluded.stars_1,
+                stars_2 = excluded.stars_2,
+                stars_3 = excluded.stars_3,
+                stars_4 = excluded.stars_4,
+                stars_5 = excluded.stars_5
+        """)
+    if conn is not None:
+        await op(conn)  # уже внутри транзакции (миграция)
     else:
-        await db_conn.execute(
-            "INSERT INTO drivers (id, rating, rating_count) VALUES (?, ?, ?)",
-            (driver_id, new_rating, 1)
+        await _write(op)
+    driver_cache.clear()
+
+
+# ---------------------
+# Дневные агрегаты по водителям
+# ---------------------
+# daily_driver_stats — сумма по заказам за день их создания (created_at) и
+# водителю (0 — ещё не принят). Таблицу ведут триггеры на orders: при любом
+# изменении учитываемых полей вклад старой строки вычитается, новой — прибавляется,
+# поэтому все пути записи (бот, миграции, ручные правки) остаются согласованными.
+def _daily_contribution(row: str, sign: str) -> str:
+    """VALUES-часть upsert-а: вклад строки OLD/NEW в агрегаты со знаком sign"""
+    return f"""
+        VALUES (
+            DATE({row}.created_at),
+            COALESCE({row}.driver_id, 0),
+            {sign}1,
+            {sign}(COALESCE({row}.completed, 0) = 1),
+            {sign}(CASE WHEN {row}.status = 'accepted' OR COALESCE({row}.completed, 0) = 1
+                        THEN COALESCE({row}.price, 0) ELSE 0 END),
+            {sign}COALESCE({row}.rating, 0),
+            {sign}(COALESCE({row}.rating, 0) > 0)
         )
-    await db_conn.commit()
+    """
 
 
-async def register_driver(driver_id: int, name: str = None):
-    cur = await db_conn.execute("SELECT id FROM drivers WHERE id=?", (driver_id,))
-    row = await cur.fetchone()
-    await cur.close()
+_DAILY_UPSERT = """
+    INSERT INTO daily_driver_stats (day, driver_id, orders, completed, revenue, rating_sum, rating_count)
+    {values}
+    ON CONFLICT(day, driver_id) DO UPDATE SET
+        orders = orders + excluded.orders,
+        completed = completed + excluded.completed,
+        revenue = revenue + excluded.revenue,
+        rating_sum = rating_sum + excluded.rating_sum,
+        rating_count = rating_count + excluded.rating_count;
+"""
 
-    if not row:
-        await db_conn.execute(
-            "INSERT INTO drivers (id, name) VALUES (?, ?)",
-            (driver_id, name)
+DAILY_STATS_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_daily_stats_insert AFTER INSERT ON orders BEGIN
+        {_DAILY_UPSERT.format(values=_daily_contribution('NEW', '+'))}
+    END
+    """,
+    # group_message_id и прочие поля на агрегаты не влияют — триггер на них не срабатывает
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_daily_stats_update
+    AFTER UPDATE OF created_at, driver_id, status, completed, price, rating ON orders BEGIN
+        {_DAILY_UPSERT.format(values=_daily_contribution('OLD', '-'))}
+        {_DAILY_UPSERT.format(values=_daily_contribution('NEW', '+'))}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_daily_stats_delete AFTER DELETE ON orders BEGIN
+        {_DAILY_UPSERT.format(values=_daily_contribution('OLD', '-'))}
+    END
+    """,
+]
+
+# Агрегаты с нуля по сырой таблице — для пересборки и для сверки
+DAILY_STATS_FROM_ORDERS_SQL = """
+    SELECT DATE(created_at) AS day,
+           COALESCE(driver_id, 0) AS driver_id,
+           COUNT(*) AS orders,
+           SUM(COALESCE(completed, 0) = 1) AS completed,
+           SUM(CASE WHEN status = 'accepted' OR COALESCE(completed, 0) = 1
+                    THEN COALESCE(price, 0) ELSE 0 END) AS revenue,
+           SUM(COALESCE(rating, 0)) AS rating_sum,
+           SUM(COALESCE(rating, 0) > 0) AS rating_count
+    FROM orders
+    GROUP BY 1, 2
+"""
+DAILY_STATS_CLEAR_SQL = "DELETE FROM daily_driver_stats"
+DAILY_STATS_REBUILD_SQL = f"""
+    INSERT INTO daily_driver_stats (day, driver_id, orders, completed, revenue, rating_sum, rating_count)
+    {DAILY_STATS_FROM_ORDERS_SQL}
+"""
+# Расхождения агрегатов с orders: строки, которые есть только с одной стороны
+# или отличаются хоть одним счётчиком (нулевые строки агрегатов не в счёт)
+DAILY_STATS_CHECK_SQL = f"""
+    WITH raw AS ({DAILY_STATS_FROM_ORDERS_SQL}),
+    agg AS (
+        SELECT day, driver_id, orders, completed, revenue, rating_sum, rating_count
+        FROM daily_driver_stats
+        WHERE orders != 0 OR completed != 0 OR revenue != 0 OR rating_sum != 0 OR rating_count != 0
+    )
+    SELECT 'orders' AS side, * FROM (SELECT * FROM raw EXCEPT SELECT * FROM agg)
+    UNION ALL
+    SELECT 'daily_driver_stats' AS side, * FROM (SELECT * FROM agg EXCEPT SELECT * FROM raw)
+    ORDER BY day, driver_id, side
+"""
+
+
+# ---------------------
+# Журнал событий заказов
+# ---------------------
+# order_events — created/accepted/completed/rated/expired по каждому заказу. Пишут его
+# триггеры на orders, поэтому событие коммитится вместе с изменением заказа
+# из любого процесса. Читатели (админка) идут по id > последнего прочитанного.
+ORDER_EVENTS_KEEP_DAYS = 30  # сколько дней хранить журнал
+
+ORDER_EVENTS_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_order_events_created AFTER INSERT ON orders BEGIN
+        INSERT INTO order_events (order_id, kind, driver_id) VALUES (NEW.id, 'created', NEW.driver_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_order_events_accepted AFTER UPDATE OF status ON orders
+    WHEN NEW.status = 'accepted' AND OLD.status IS NOT 'accepted' BEGIN
+        INSERT INTO order_events (order_id, kind, driver_id) VALUES (NEW.id, 'accepted', NEW.driver_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_order_events_completed AFTER UPDATE OF completed ON orders
+    WHEN NEW.completed = 1 AND OLD.completed IS NOT 1 BEGIN
+        INSERT INTO order_events (order_id, kind, driver_id) VALUES (NEW.id, 'completed', NEW.driver_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_order_events_expired AFTER UPDATE OF status ON orders
+    WHEN NEW.status = 'expired' AND OLD.status IS NOT 'expired' BEGIN
+        INSERT INTO order_events (order_id, kind, driver_id) VALUES (NEW.id, 'expired', NULL);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_order_events_rated AFTER UPDATE OF rating ON orders
+    WHEN COALESCE(NEW.rating, 0) > 0 AND COALESCE(OLD.rating, 0) = 0 BEGIN
+        INSERT INTO order_events (order_id, kind, driver_id) VALUES (NEW.id, 'rated', NEW.driver_id);
+    END
+    """,
+]
+
+
+async def prune_order_events(keep_days: int = ORDER_EVENTS_KEEP_DAYS) -> int:
+    """Удалить события старше keep_days дней; возвращает число удалённых"""
+    async def op(conn):
+        cur = await conn.execute(
+            "DELETE FROM order_events WHERE created_at < DATETIME('now', ?)", (f"-{keep_days} days",)
         )
-        await db_conn.commit()
+        return cur.rowcount
+    return await _write(op)
 
 
 # ---------------------
 # Новые функции для истории заказов
 # ---------------------
-async def get_driver(driver_id: int):
-    """Получить информацию о водителе"""
-    cur = await db_conn.execute("SELECT * FROM drivers WHERE id=?", (driver_id,))
+async def get_driver(driver_id: int, cached: bool = True):
+    """cached=False — прочитать из БД: оценку мог записать другой процесс (supervisor.py)"""
+    row = driver_cache.get(driver_id) if cached else None
+    if row is not None:
+        return row
+    cur = await read_conn.execute("SELECT * FROM drivers WHERE id=?", (driver_id,))
     row = await cur.fetchone()
     await cur.close()
+    driver_cache.put(driver_id, row)
     return row
 
 
 async def get_driver_orders(driver_id: int):
     """Получить все заказы водителя (сортировка по дате, новые первые)"""
-    cur = await db_conn.execute(
-        "SELECT * FROM orders WHERE driver_id=? ORDER BY created_at DESC",
-        (driver_id,)
-    )
+    # Для длинных историй лучше iter_order_history — он не держит всё в памяти
+    return [row async for row in iter_order_history(driver_id, role='driver')]
+
+
+# ---------------------
+# История заказов с keyset-пагинацией
+# ---------------------
+# Курсор — пара (created_at, id) граничного заказа. Страница ищется по индексу
+# (driver_id|passenger_id, created_at) от курсора, поэтому N-я страница
+# стоит столько же, сколько первая.
+HISTORY_PAGE_SIZE = 5
+_HISTORY_COLUMNS = {'driver': 'driver_id', 'passenger': 'passenger_id'}
+
+
+async def get_order_history_page(user_id: int, role: str = 'passenger', cursor=None,
+                                 direction: str = 'older', page_size: int = HISTORY_PAGE_SIZE):
+    """
+    Страница истории (новые заказы первыми).
+    direction='older' — заказы старше cursor (cursor=None — самая свежая страница),
+    direction='newer' — заказы новее cursor.
+    Возвращает (rows, older_cursor, newer_cursor); курсор None — дальше страниц нет.
+    """
+    column = _HISTORY_COLUMNS[role]
+    if direction == 'newer':
+        sql = (f"SELECT * FROM orders WHERE {column}=? AND (created_at, id) > (?, ?) "
+               "ORDER BY created_at, id LIMIT ?")
+        params = (user_id, cursor[0], cursor[1], page_size + 1)
+    elif cursor is not None:
+        sql = (f"SELECT * FROM orders WHERE {column}=? AND (created_at, id) < (?, ?) "
+               "ORDER BY created_at DESC, id DESC LIMIT ?")
+        params = (user_id, cursor[0], cursor[1], page_size + 1)
+    else:
+        sql = (f"SELECT * FROM orders WHERE {column}=? "
+               "ORDER BY created_at DESC, id DESC LIMIT ?")
+        params = (user_id, page_size + 1)
+
+    cur = await read_conn.execute(sql, params)
     rows = await cur.fetchall()
     await cur.close()
-    return rows
\ No newline at end of file
+
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if direction == 'newer':
+        rows.reverse()
+        has_older, has_newer = True, has_more
+    else:
+        has_older, has_newer = has_more, cursor is not None
+
+    if not rows:
+        return [], None, None
+    older = (rows[-1]["created_at"], rows[-1]["id"]) if has_older else None
+    newer = (rows[0]["created_at"], rows[0]["id"]) if has_newer else None
+    return rows, older, newer
+
+
+async def iter_order_history(user_id: int, role: str = 'passenger', page_size: int = 100):
+    """Все заказы пользователя, новые первыми, постранично — память не растёт"""
+    cursor = None
+    while True:
+        rows, cursor, _ = await get_order_history_page(user_id, role, cursor, 'older', page_size)
+        for row in rows:
+            yield row
+        if cursor is None:
+            return
@@ -0,0 +1,216 @@
+# dispatch.py — выбор водителей для нового заказа.
+# Водитель на смене — в реестре OnlineRegistry: /online, трансляция геолокации
+# или любое действие продлевают смену, без них она истекает через
+# DRIVER_HEARTBEAT_TTL. Последние точки водителей на смене лежат в сеточном
+# индексе: ячейка ~1 км, поиск идёт кольцами ячеек от точки подачи и
+# останавливается, как только дальше ближе уже не найти. Заказ предлагается в
+# личку волнами по DISPATCH_K водителей (сначала ближайшие), каждая следующая
+# волна — через DISPATCH_OFFER_TIMEOUT, после последней заказ уходит в группу.
+# Ничего про Telegram здесь нет — см. bot.py.
+#
+#   DISPATCH_ENABLED=1 python bot.py
+import heapq
+import math
+import os
+import time
+from collections import OrderedDict
+
+DISPATCH_ENABLED = os.getenv("DISPATCH_ENABLED", "0") == "1"
+DISPATCH_K = int(os.getenv("DISPATCH_K", "3"))                           # водителей в одной волне
+DISPATCH_WAVES = int(os.getenv("DISPATCH_WAVES", "2"))                   # волн в личку до группы
+DISPATCH_RADIUS_KM = float(os.getenv("DISPATCH_RADIUS_KM", "5"))         # дальше — сразу в группу
+DISPATCH_OFFER_TIMEOUT = float(os.getenv("DISPATCH_OFFER_TIMEOUT", "20"))  # секунд на одну волну
+DRIVER_HEARTBEAT_TTL = int(os.getenv("DRIVER_HEARTBEAT_TTL", "1800"))    # смена без признаков жизни, секунд
+DISPATCH_BUSY_HOURS = 3     # принятый и не завершённый заказ моложе этого — водитель занят
+LOCATION_TTL = 600          # сколько верить разовой (не live) геолокации, секунд
+GRID_CELL_DEG = 0.01        # сторона ячейки: ~1.1 км по широте
+EARTH_RADIUS_KM = 6371.0
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Расстояние по поверхности Земли, км"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+class GridIndex:
+    """
+    Последние позиции водителей: ячейка сетки → {driver_id}. Обновление точки —
+    O(1), поиск k ближайших смотрит только ячейки вокруг точки подачи.
+    Устаревшие точки удаляются лениво, когда поиск на них натыкается.
+    """
+
+    def __init__(self, cell_deg: float = GRID_CELL_DEG):
+        self.cell_deg = cell_deg
+        self._cells = {}      # (i, j) → set(driver_id)
+        self._positions = {}  # driver_id → (lat, lon, ячейка, истекает)
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, driver_id):
+        return driver_id in self._positions
+
+    def _cell(self, lat: float, lon: float):
+        return math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg)
+
+    def update(self, driver_id: int, lat: float, lon: float, expires: float):
+        """Новая точка водителя; expires — время (time.time()), после которого она не в счёт"""
+        cell = self._cell(lat, lon)
+        old = self._positions.get(driver_id)
+        if old is not None and old[2] != cell:
+            self._discard(driver_id, old[2])
+        self._cells.setdefault(cell, set()).add(driver_id)
+        self._positions[driver_id] = (lat, lon, cell, expires)
+
+    def remove(self, driver_id: int):
+        old = self._positions.pop(driver_id, None)
+        if old is not None:
+            self._discard(driver_id, old[2])
+
+    def _discard(self, driver_id: int, cell):
+        drivers = self._cells.get(cell)
+        if drivers is not None:
+            drivers.discard(driver_id)
+            if not drivers:
+                del self._cells[cell]
+
+    def position(self, driver_id: int):
+        """(lat, lon) или None"""
+        entry = self._positions.get(driver_id)
+        return entry[:2] if entry is not None else None
+
+    def nearest(self, lat: float, lon: float, k: int, radius_km: float = DISPATCH_RADIUS_KM,
+                now: float = None, exclude=()) -> list:
+        """До k ближайших водителей в радиусе: [(км, driver_id)] по возрастанию расстояния"""
+        now = time.time() if now is None else now
+        ci, cj = self._cell(lat, lon)
+        # Точка внутри центральной ячейки: всё за кольцом r не ближе r узких сторон ячейки
+        cell_km = self.cell_deg * math.pi / 180 * EARTH_RADIUS_KM
+        step_km = cell_km * max(math.cos(math.radians(lat)), 0.01)
+        found = []
+        ring = 0
+        while True:
+            for cell in self._ring(ci, cj, ring):
+                for driver_id in list(self._cells.get(cell, ())):
+                    d_lat, d_lon, _, expires = self._positions[driver_id]
+                    if expires < now:
+                        self.remove(driver_id)
+                        continue
+                    if driver_id in exclude:
+                        continue
+                    km = haversine_km(lat, lon, d_lat, d_lon)
+                    if km <= radius_km:
+                        found.append((km, driver_id))
+            reach = ring * step_km  # всё, что ближе, уже просмотрено
+            best = heapq.nsmallest(k, found)
+            if (len(best) == k and best[-1][0] <= reach) or reach >= radius_km or not self._cells:
+                return best
+            ring += 1
+
+    @staticmethod
+    def _ring(ci: int, cj: int, ring: int):
+        if ring == 0:
+            yield ci, cj
+            return
+        for dj in range(-ring, ring + 1):
+            yield ci - ring, cj + dj
+            yield ci + ring, cj + dj
+        for di in range(-ring + 1, ring):
+            yield ci + di, cj - ring
+            yield ci + di, cj + ring
+
+    def brute_nearest(self, lat: float, lon: float, k: int, radius_km: float = DISPATCH_RADIUS_KM,
+                      now: float = None, exclude=()) -> list:
+        """То же перебором всех водителей — для сверки в sim_dispatch.py"""
+        now = time.time() if now is None else now
+        found = [
+            (haversine_km(lat, lon, d_lat, d_lon), driver_id)
+            for driver_id, (d_lat, d_lon, _, expires) in self._positions.items()
+            if expires >= now and driver_id not in exclude
+        ]
+        return heapq.nsmallest(k, [item for item in found if item[0] <= radius_km])
+
+
+class OnlineRegistry:
+    """
+    Водители на смене и их последние точки. Порядок словаря — по последнему
+    сигналу, поэтому истёкшие смены снимаются с начала, без обхода всех.
+    """
+
+    def __init__(self, ttl: float = DRIVER_HEARTBEAT_TTL, index: GridIndex = None):
+        self.ttl = ttl
+        self.index = index if index is not None else GridIndex()
+        self._seen = OrderedDict()  # driver_id → время последнего сигнала
+        self._offered = {}          # driver_id → когда последний раз предлагали заказ
+
+    def __len__(self):
+        return len(self._seen)
+
+    def go_online(self, driver_id: int, now: float = None):
+        self._seen[driver_id] = time.time() if now is None else now
+        self._seen.move_to_end(driver_id)
+
+    def touch(self, driver_id: int, now: float = None) -> bool:
+        """Сигнал от водителя продлевает смену; False — водитель не на смене"""
+        if not self.is_online(driver_id, now):
+            return False
+        self.go_online(driver_id, now)
+        return True
+
+    def go_offline(self, driver_id: int):
+        self._seen.pop(driver_id, None)
+        self._offered.pop(driver_id, None)
+        self.index.remove(driver_id)
+
+    def is_online(self, driver_id: int, now: float = None) -> bool:
+        self._expire(time.time() if now is None else now)
+        return driver_id in self._seen
+
+    def locate(self, driver_id: int, lat: float, lon: float, expires: float):
+        """Точка водителя на смене; вне смены точка не нужна"""
+        if driver_id in self._seen:
+            self.index.update(driver_id, lat, lon, expires)
+
+    def online(self, now: float = None) -> list:
+        self._expire(time.time() if now is None else now)
+        return list(self._seen)
+
+    def _expire(self, now: float):
+        while self._seen:
+            driver_id, seen = next(iter(self._seen.items()))
+            if seen + self.ttl >= now:
+                break
+            self.go_offline(driver_id)
+
+    def offered(self, driver_ids, now: float = None):
+        now = time.time() if now is None else now
+        for driver_id in driver_ids:
+            self._offered[driver_id] = now
+
+    def candidates(self, pickup, limit: int, radius_km: float = DISPATCH_RADIUS_KM,
+                   now: float = None) -> list:
+        """
+        До limit водителей на смене: [(км или None, driver_id)]. С точкой подачи —
+        сначала ближайшие в радиусе, затем те, чьей точки нет; без неё — все
+        по давности последнего предложения, чтобы заказы доставались по очереди.
+        """
+        now = time.time() if now is None else now
+        self._expire(now)
+        found = []
+        if pickup is not None:
+            found = self.index.nearest(*pickup, limit, radius_km, now)
+        # Без точки подачи расстояние неизвестно всем, иначе — тем, у кого нет точки
+        rest = sorted(
+            (driver_id for driver_id in self._seen if pickup is None or driver_id not in self.index),
+            key=lambda driver_id: self._offered.get(driver_id, 0)
+        )
+        found.extend((None, driver_id) for driver_id in rest)
+        return found[:limit]
+
+
+def plan_waves(candidates: list, size: int = DISPATCH_K, waves: int = DISPATCH_WAVES) -> list:
+    """Кандидаты по порядку → не больше waves волн по size водителей"""
+    return [candidates[i:i + size] for i in range(0, min(len(candidates), size * waves), size)]
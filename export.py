@@ -0,0 +1,112 @@
+# export.py — выгрузка заказов и расчётов с водителями в CSV для бухгалтерии.
+# Генераторы общие для админки (потоковый ответ Flask) и stats.py (файл/stdout):
+# строки читаются из курсора SQLite по мере отправки, поэтому год заказов
+# выгружается в постоянной памяти, а первые байты уходят сразу.
+import csv
+from datetime import datetime, timedelta
+
+CSV_CHUNK_ROWS = 500  # строк в одном куске ответа
+CSV_BOM = "\ufeff"  # чтобы Excel открыл UTF-8 с кириллицей без мастера импорта
+# Текст, который Excel принял бы за формулу (адрес «=HYPERLINK(...)» от пассажира),
+# получает апостроф впереди и остаётся текстом; так же и «+7...» — без апострофа
+# Excel превратил бы номер в число и потерял плюс
+CSV_FORMULA_CHARS = ("=", "+", "-", "@", "\t", "\r")
+
+ORDERS_COLUMNS = ["id", "created_at", "status", "completed", "trip_type", "from_addr", "to_addr",
+                  "price", "driver_id", "driver_name", "driver_share", "service_share", "rating"]
+SETTLEMENTS_COLUMNS = ["driver_id", "driver_name", "orders", "completed", "revenue",
+                       "driver_share", "service_share"]
+
+
+def next_day(day: str):
+    """'2026-10-18' → '2026-10-19'; None, если дата не разбирается"""
+    try:
+        return (datetime.strptime(day, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+    except ValueError:
+        return None
+
+
+class _Line:
+    """Файл для csv.writer, который возвращает строку вместо записи"""
+
+    def write(self, value):
+        return value
+
+
+def csv_cell(value):
+    """Значение ячейки, безопасное для Excel: строки с символа формулы — как текст"""
+    if isinstance(value, str) and value.startswith(CSV_FORMULA_CHARS):
+        return "'" + value
+    return value
+
+
+def _csv_chunks(header, rows):
+    writer = csv.writer(_Line())
+    yield CSV_BOM + writer.writerow(header)
+    chunk = []
+    for row in rows:
+        chunk.append(writer.writerow([csv_cell(value) for value in row]))
+        if len(chunk) == CSV_CHUNK_ROWS:
+            yield "".join(chunk)
+            chunk = []
+    if chunk:
+        yield "".join(chunk)
+
+
+def orders_csv(conn, date_from: str, date_to: str, driver_percent: float, service_percent: float):
+    """
+    Заказы за период [date_from, date_to] по возрастанию времени.
+    Доли считаются по заказам, которые входят в выручку (принят или завершён).
+    """
+    conditions = []
+    params = [driver_percent, service_percent]
+    if date_from:
+        conditions.append("o.created_at >= ?")
+        params.append(date_from)
+    if date_to and next_day(date_to):
+        conditions.append("o.created_at < ?")
+        params.append(next_day(date_to))
+    rows = conn.execute(f"""
+        SELECT o.id, o.created_at, o.status, o.completed, o.trip_type, o.from_addr, o.to_addr,
+               o.price, o.driver_id, COALESCE(d.name, o.driver_name),
+               CASE WHEN o.status = 'accepted' OR o.completed = 1 THEN CAST(o.price * ? AS INTEGER) END,
+               CASE WHEN o.status = 'accepted' OR o.completed = 1 THEN CAST(o.price * ? AS INTEGER) END,
+               NULLIF(o.rating, 0)
+        FROM orders o
+        LEFT JOIN drivers d ON d.id = o.driver_id
+        {"WHERE " + " AND ".join(conditions) if conditions else ""}
+        ORDER BY o.created_at, o.id
+    """, params)
+    try:
+        yield from _csv_chunks(ORDERS_COLUMNS, rows)
+    finally:
+        rows.close()
+
+
+def settlements_csv(conn, date_from: str, date_to: str, driver_percent: float, service_percent: float):
+    """Расчёт с водителями за период — из дневных агрегатов daily_driver_stats"""
+    conditions = ["s.driver_id != 0"]  # 0 — заказы без водителя
+    params = []
+    if date_from:
+        conditions.append("s.day >= ?")
+        params.append(date_from)
+    if date_to:
+        conditions.append("s.day <= ?")
+        params.append(date_to)
+    rows = conn.execute(f"""
+        SELECT s.driver_id, d.name, SUM(s.orders), SUM(s.completed), SUM(s.revenue)
+        FROM daily_driver_stats s
+        LEFT JOIN drivers d ON d.id = s.driver_id
+        WHERE {" AND ".join(conditions)}
+        GROUP BY s.driver_id
+        HAVING SUM(s.orders) > 0
+        ORDER BY SUM(s.revenue) DESC, s.driver_id
+    """, params)
+    try:
+        yield from _csv_chunks(SETTLEMENTS_COLUMNS, (
+            (driver_id, name, orders, completed, revenue,
+             int(revenue * driver_percent), int(revenue * service_percent))
+            for driver_id, name, orders, completed, revenue in rows
+        ))
+    finally:
+        rows.close()
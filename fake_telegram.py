@@ -0,0 +1,193 @@
+# fake_telegram.py — локальная замена Telegram Bot API для нагрузочных тестов.
+# Понимает getUpdates (long polling), sendMessage, answerCallbackQuery и ещё
+# несколько методов, которые нужны боту. Настоящий Dispatcher опрашивает его так же,
+# как api.telegram.org: достаточно выставить TELEGRAM_API_URL.
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter
+
+import aiohttp
+from aiohttp import web
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "LoadTestBot", "username": "load_test_bot"}
+
+
+class FakeTelegram:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency  # имитация задержки ответа API, секунд
+        self.calls = Counter()  # число вызовов по методам
+        self.webhook_url = None
+        self._updates = []
+        self._new_updates = asyncio.Event()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._callback_ids = itertools.count(1)
+        self._listeners = []
+        self._runner = None
+        self._session = None
+        self.url = None
+
+    # ---------------------
+    # Запуск и остановка
+    # ---------------------
+    async def start(self, host: str = "127.0.0.1", port: int = 0):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self):
+        self.release_pollers()
+        if self._session is not None:
+            await self._session.close()
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def release_pollers(self):
+        """Отпустить висящие getUpdates, чтобы polling остановился без ожидания таймаута"""
+        self._new_updates.set()
+
+    def subscribe(self, listener):
+        """listener(method, params, result) вызывается на каждый запрос бота"""
+        self._listeners.append(listener)
+
+    # ---------------------
+    # Входящие апдейты
+    # ---------------------
+    async def push_update(self, update: dict) -> int:
+        update["update_id"] = next(self._update_ids)
+        if self.webhook_url:
+            await self._post_webhook(update)
+        else:
+            self._updates.append(update)
+            self._new_updates.set()
+        return update["update_id"]
+
+    async def _post_webhook(self, update: dict):
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+        async with self._session.post(self.webhook_url, json=update) as response:
+            await response.read()
+
+    def message(self, user_id: int, text: str = None, contact: dict = None,
+                location: dict = None, first_name: str = "User") -> dict:
+        user = {"id": user_id, "is_bot": False, "first_name": first_name}
+        msg = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": first_name},
+            "from": user,
+        }
+        if text is not None:
+            msg["text"] = text
+            if text.startswith("/"):
+                command = text.split()[0]
+                msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        if contact is not None:
+            msg["contact"] = contact
+        if location is not None:
+            msg["location"] = location
+        return {"message": msg}
+
+    def callback(self, user_id: int, data: str, chat_id: int, message_id: int,
+                 first_name: str = "Driver") -> dict:
+        callback_id = str(next(self._callback_ids))
+        return {"callback_query": {
+            "id": callback_id,
+            "from": {"id": user_id, "is_bot": False, "first_name": first_name},
+            "chat_instance": str(chat_id),
+            "data": data,
+            "message": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "supergroup" if chat_id < 0 else "private"},
+                "from": BOT_USER,
+                "text": "",
+            },
+        }}
+
+    # ---------------------
+    # Методы Bot API
+    # ---------------------
+    async def _handle(self, request: web.Request):
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        self.calls[method] += 1
+
+        if method.lower() == "getupdates":
+            result = await self._get_updates(params)
+        else:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            result = self._call(method.lower(), params)
+
+        for listener in self._listeners:
+            listener(method, params, result)
+        return web.json_response({"ok": True, "result": result})
+
+    async def _get_updates(self, params: dict):
+        offset = int(params.get("offset", 0) or 0)
+        timeout = float(params.get("timeout", 0) or 0)
+        limit = int(params.get("limit", 100) or 100)
+        if offset < 0:
+            self._updates = self._updates[offset:]
+        elif offset:
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:limit]
+
+    def _call(self, method: str, params: dict):
+        if method == "getme":
+            return BOT_USER
+        if method == "sendmessage":
+            chat_id = int(params["chat_id"])
+            result = {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "supergroup" if chat_id < 0 else "private"},
+                "from": BOT_USER,
+                "text": params.get("text", ""),
+            }
+            if params.get("reply_markup"):
+                markup = json.loads(params["reply_markup"])
+                if "inline_keyboard" in markup:
+                    result["reply_markup"] = markup
+            return result
+        if method in ("editmessagetext", "editmessagereplymarkup"):
+            chat_id = int(params.get("chat_id", 0) or 0)
+            return {
+                "message_id": int(params.get("message_id", 0) or 0),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "supergroup" if chat_id < 0 else "private"},
+                "from": BOT_USER,
+                "text": params.get("text", ""),
+            }
+        if method == "setwebhook":
+            self.webhook_url = params.get("url")
+            return True
+        if method == "deletewebhook":
+            self.webhook_url = None
+            if params.get("drop_pending_updates") in ("True", "true", "1"):
+                self._updates.clear()
+            return True
+        if method == "getwebhookinfo":
+            return {"url": self.webhook_url or "", "has_custom_certificate": False,
+                    "pending_update_count": len(self._updates)}
+        if method == "getchatmember":
+            # В фейковой группе водителей состоят все
+            user_id = int(params.get("user_id", 0) or 0)
+            return {"user": {"id": user_id, "is_bot": False, "first_name": "Driver"}, "status": "member"}
+        # answerCallbackQuery, deleteMessage и прочее — просто «ок»
+        return True
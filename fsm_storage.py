@@ -0,0 +1,108 @@
+# fsm_storage.py — FSM-хранилище aiogram, которое переживает рестарт бота.
+# Чтение идёт из памяти (как у MemoryStorage), а изменения копятся и раз в
+# FSM_FLUSH_INTERVAL секунд уходят в таблицу fsm_state одной пачкой через
+# пайплайн записи db.py. Десяток update_data за заказ превращается в одну запись.
+import asyncio
+import json
+
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+
+import db
+
+FSM_FLUSH_INTERVAL = 1.0  # секунд
+
+
+class SQLiteStorage(MemoryStorage):
+    def __init__(self, flush_interval: float = FSM_FLUSH_INTERVAL):
+        super().__init__()
+        self.flush_interval = flush_interval
+        self.flushes = 0  # сколько раз писали в БД
+        self.writes = 0   # сколько строк записали
+        self._dirty = set()
+        self._flusher: asyncio.Task | None = None
+
+    async def start(self):
+        """Загрузить сохранённые состояния и запустить фоновый сброс. Вызывать после db.init_db()"""
+        cur = await db.db_conn.execute("SELECT chat, user, state, data FROM fsm_state")
+        rows = await cur.fetchall()
+        await cur.close()
+        for row in rows:
+            self.data.setdefault(row["chat"], {})[row["user"]] = {
+                'state': row["state"],
+                'data': json.loads(row["data"]) if row["data"] else {},
+                'bucket': {},
+            }
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_loop())
+        print(f"FSM: восстановлено состояний — {len(rows)}")
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+        await super().close()
+
+    # ---------------------
+    # Запись: помечаем адрес грязным, в БД попадёт при следующем сбросе
+    # ---------------------
+    async def set_state(self, *, chat=None, user=None, state=None):
+        await super().set_state(chat=chat, user=user, state=state)
+        self._mark(chat, user)
+
+    async def set_data(self, *, chat=None, user=None, data=None):
+        await super().set_data(chat=chat, user=user, data=data)
+        self._mark(chat, user)
+
+    async def update_data(self, *, chat=None, user=None, data=None, **kwargs):
+        await super().update_data(chat=chat, user=user, data=data, **kwargs)
+        self._mark(chat, user)
+
+    def _mark(self, chat, user):
+        chat_id, user_id = map(str, self.check_address(chat=chat, user=user))
+        self._dirty.add((chat_id, user_id))
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"FSM: ошибка сохранения состояний: {e}")
+
+    async def flush(self):
+        """Записать все накопленные изменения одной транзакцией"""
+        if not self._dirty or db.db_conn is None:
+            return
+        dirty, self._dirty = self._dirty, set()
+
+        upserts, deletes = [], []
+        for chat_id, user_id in dirty:
+            entry = self.data.get(chat_id, {}).get(user_id)
+            if entry is None or (entry['state'] is None and not entry['data']):
+                deletes.append((chat_id, user_id))
+            else:
+                upserts.append((chat_id, user_id, entry['state'], json.dumps(entry['data'], ensure_ascii=False)))
+
+        async def op(conn):
+            if upserts:
+                await conn.executemany(
+                    "INSERT INTO fsm_state (chat, user, state, data) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(chat, user) DO UPDATE SET state=excluded.state, data=excluded.data",
+                    upserts
+                )
+            if deletes:
+                await conn.executemany("DELETE FROM fsm_state WHERE chat=? AND user=?", deletes)
+
+        try:
+            await db.execute_write(op)
+        except Exception:
+            # Не потерять изменения: вернём адреса в очередь на следующий сброс
+            self._dirty |= dirty
+            raise
+        self.flushes += 1
+        self.writes += len(dirty)
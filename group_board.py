@@ -0,0 +1,83 @@
+# group_board.py — пост заказа в группе водителей показывает его текущее состояние.
+# Когда заказ принят, завершён или истёк, сообщение в группе (orders.group_message_id)
+# переписывается без кнопки «Қабылдау», и водители перестают жать на занятый заказ.
+# Правки идут через общую очередь send_scheduler с лимитом группы. В очереди на
+# каждое сообщение — не больше одной правки: новое состояние просто заменяет
+# ещё не отправленное, и текст берётся в момент отправки. Несколько быстрых
+# переходов (принят → завершён, пока группа ждёт токен) дают один editMessageText.
+# Снять кнопку — срочно (PRIORITY_BOARD, раньше новых заказов: в пике иначе
+# правка приходит, когда все уже нажали); остальные правки — в общем порядке.
+from collections import Counter
+
+from aiogram.utils.exceptions import (
+    MessageCantBeEdited, MessageIdInvalid, MessageNotModified, MessageToEditNotFound,
+)
+
+from send_scheduler import PRIORITY_BOARD
+
+# Сообщение уже в нужном виде или его больше нет — повторять нечего
+GONE_ERRORS = (MessageNotModified, MessageToEditNotFound, MessageCantBeEdited, MessageIdInvalid)
+
+
+class GroupBoard:
+    """
+    update(message_id, text, reply_markup, priority) ставит правку сообщения
+    чата chat_id в очередь outbox; пока правка ждёт отправки, следующие update
+    того же сообщения только меняют её содержимое, а место в очереди остаётся
+    за первой.
+    """
+
+    def __init__(self, outbox, chat_id: int):
+        self.outbox = outbox
+        self.chat_id = chat_id
+        self.counters = Counter()  # updates / coalesced / edited / gone / failed
+        self._pending = {}  # message_id → (text, reply_markup, priority), ещё не отправлено
+        self._queued = set()  # message_id, у которых задача уже в очереди или в полёте
+
+    def update(self, message_id: int, text: str, reply_markup=None, priority: int = PRIORITY_BOARD):
+        self.counters['updates'] += 1
+        if message_id in self._pending:
+            self.counters['coalesced'] += 1
+        self._pending[message_id] = (text, reply_markup, priority)
+        if message_id not in self._queued:
+            self._queued.add(message_id)
+            self._submit(message_id, priority)
+
+    def stats(self) -> dict:
+        return {'pending': len(self._pending), **self.counters}
+
+    def _submit(self, message_id: int, priority: int):
+        future = self.outbox.submit(self.chat_id, lambda: self._edit(message_id), priority)
+        future.add_done_callback(lambda f: self._finished(message_id, f))
+
+    async def _edit(self, message_id: int):
+        # Берём самое свежее состояние на момент отправки
+        state = self._pending.pop(message_id, None)
+        if state is None:
+            return None
+        text, reply_markup, _ = state
+        try:
+            result = await self.outbox.bot.edit_message_text(
+                text, self.chat_id, message_id, reply_markup=reply_markup
+            )
+        except GONE_ERRORS:
+            self.counters['gone'] += 1
+            return None
+        except Exception:
+            # RetryAfter и сетевые ошибки outbox повторит — с этим или более новым состоянием
+            self._pending.setdefault(message_id, state)
+            raise
+        self.counters['edited'] += 1
+        return result
+
+    def _finished(self, message_id: int, future):
+        self._queued.discard(message_id)
+        if future.cancelled() or future.exception() is not None:
+            # outbox сдался или остановлен — состояние этого сообщения отбрасываем
+            self.counters['failed'] += 1
+            self._pending.pop(message_id, None)
+            return
+        # Пока правка была в полёте, заказ успел измениться ещё раз
+        if message_id in self._pending:
+            self._queued.add(message_id)
+            self._submit(message_id, self._pending[message_id][2])
@@ -0,0 +1,98 @@
+# lifecycle.py — жизненный цикл заказа, который никто не принимает.
+# Каждые ORDER_BUMP_AFTER секунд открытый заказ заново поднимается в группе,
+# через ORDER_EXPIRE_AFTER он закрывается статусом expired, пассажир получает
+# уведомление. На каждый заказ — два таймера в колесе (scheduler.TimerWheel):
+# O(1) на заказ вместо периодического обхода всей таблицы orders. После
+# рестарта таймеры восстанавливаются одним запросом по idx_orders_open.
+# Ничего про Telegram здесь нет — см. bot.py.
+import os
+from collections import Counter
+
+ORDER_BUMP_AFTER = int(os.getenv("ORDER_BUMP_AFTER", "300"))      # поднять в группе, секунд
+ORDER_EXPIRE_AFTER = int(os.getenv("ORDER_EXPIRE_AFTER", "1200"))  # закрыть как expired, секунд
+# Заказы, просроченные сильнее, закрываются при старте одним UPDATE и без уведомлений
+ORDER_STALE_AFTER = 2 * ORDER_EXPIRE_AFTER
+
+
+class OrderLifecycle:
+    """
+    Таймеры открытых заказов. on_bump(order_id) и on_expire(order_id) — корутины
+    бота; обе возвращают False, если заказ уже не открыт (принят другим воркером).
+    """
+
+    def __init__(self, wheel, on_bump, on_expire,
+                 bump_after: float = ORDER_BUMP_AFTER, expire_after: float = ORDER_EXPIRE_AFTER):
+        self.wheel = wheel
+        self.on_bump = on_bump
+        self.on_expire = on_expire
+        self.bump_after = bump_after
+        self.expire_after = expire_after
+        self.counters = Counter()  # tracked / bumped / expired / closed
+        self._timers = {}  # order_id → [таймер подъёма или None, таймер закрытия]
+
+    def __len__(self):
+        return len(self._timers)
+
+    def __contains__(self, order_id):
+        return order_id in self._timers
+
+    def track(self, order_id: int, age: float = 0.0, bump_now: bool = False):
+        """Поставить таймеры заказу возрастом age секунд; bump_now — поднять на ближайшем тике"""
+        self.forget(order_id)
+        expire = self.wheel.call_later(max(0.0, self.expire_after - age), self._expire, order_id)
+        self._timers[order_id] = [None, expire]
+        self._schedule_bump(order_id, 0.0 if bump_now else self._next_bump(age), age)
+        self.counters['tracked'] += 1
+
+    def forget(self, order_id: int) -> bool:
+        """Снять таймеры: заказ принят или закрыт"""
+        timers = self._timers.pop(order_id, None)
+        if timers is None:
+            return False
+        for timer in timers:
+            if timer is not None:
+                timer.cancel()
+        self.counters['closed'] += 1
+        return True
+
+    def rebuild(self, rows) -> int:
+        """Таймеры открытых заказов после рестарта: строки (id, ..., group_message_id, age)"""
+        for row in rows:
+            # Нет поста в группе — заказ ждал волн в личку, их таймеры пропали с процессом
+            self.track(row['id'], row['age'], bump_now=row['group_message_id'] is None)
+        return len(rows)
+
+    def stats(self) -> dict:
+        return {'open': len(self._timers), **self.counters}
+
+    def _next_bump(self, age: float) -> float:
+        if not self.bump_after:
+            return None
+        return self.bump_after - age % self.bump_after
+
+    def _schedule_bump(self, order_id: int, delay, age: float):
+        # Подъём в последний тик перед закрытием (или позже) не нужен
+        if delay is None or age + delay >= self.expire_after - self.wheel.tick:
+            return
+        self._timers[order_id][0] = self.wheel.call_later(delay, self._bump, order_id, age + delay)
+
+    async def _bump(self, order_id: int, age: float):
+        timers = self._timers.get(order_id)
+        if timers is None:
+            return
+        timers[0] = None
+        if not await self.on_bump(order_id):
+            self.forget(order_id)
+            return
+        self.counters['bumped'] += 1
+        if order_id in self._timers:
+            self._schedule_bump(order_id, self._next_bump(age), age)
+
+    async def _expire(self, order_id: int):
+        timers = self._timers.pop(order_id, None)
+        if timers is None:
+            return
+        if timers[0] is not None:
+            timers[0].cancel()
+        if await self.on_expire(order_id):
+            self.counters['expired'] += 1
@@ -0,0 +1,356 @@
+# loadgen.py — сквозной нагрузочный тест bot.py против fake_telegram.py.
+# Тысячи пассажиров проходят весь сценарий OrderStates, M водителей
+# наперегонки жмут «Қабылдау». Печатает пропускную способность и
+# p50/p95/p99 задержки по каждому хендлеру. Нагрузка детерминирована seed-ом.
+#
+#   python loadgen.py --passengers 2000 --drivers 10 --concurrency 100 --seed 1
+#   python loadgen.py --passengers 2000 --compare   # polling, webhook и supervisor
+#   python loadgen.py --mode supervisor --workers 4  # бот в нескольких процессах
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from fake_telegram import FakeTelegram
+
+GROUP_ID = -1001234567890
+PASSENGER_BASE_ID = 100_000
+DRIVER_BASE_ID = 900_000
+STEP_TIMEOUT = 15  # секунд на ответ бота
+COMPARE_MODES = ["polling", "webhook", "supervisor"]
+
+STREETS = ["Төле би", "Абай", "Қонаев", "Байтұрсынов", "Жібек жолы", "Рысқұлов", "Әл-Фараби"]
+OPERATOR_CODES = ["707", "775", "701", "702", "747", "705", "777"]
+
+
+def percentile(values, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(p / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+class Scenario:
+    def __init__(self, fake: FakeTelegram, args):
+        self.fake = fake
+        self.args = args
+        self.rnd = random.Random(args.seed)
+        self.latencies = defaultdict(list)   # хендлер → задержки, секунд
+        self.errors = defaultdict(int)
+        self.orders_sent = 0
+        self.group_posts = 0
+        self.claims = defaultdict(int)       # order callback_data → число победителей
+        self._chat_waiters = {}
+        self._callback_waiters = {}
+        self._races = []
+        self.extra = {}  # метрики самого бота для отчёта
+        fake.subscribe(self._on_call)
+
+    # ---------------------
+    # Ответы бота
+    # ---------------------
+    def _on_call(self, method: str, params: dict, result):
+        method = method.lower()
+        if method == "sendmessage":
+            chat_id = int(params["chat_id"])
+            if chat_id == GROUP_ID:
+                self._on_group_message(params, result)
+                return
+            waiter = self._chat_waiters.pop(chat_id, None)
+            if waiter and not waiter.done():
+                waiter.set_result(params.get("text", ""))
+        elif method == "answercallbackquery":
+            waiter = self._callback_waiters.pop(params["callback_query_id"], None)
+            if waiter and not waiter.done():
+                waiter.set_result(params.get("text", ""))
+
+    def _on_group_message(self, params: dict, result):
+        markup = json.loads(params.get("reply_markup") or "{}")
+        buttons = [b for row in markup.get("inline_keyboard", []) for b in row]
+        if not buttons:
+            return
+        data = buttons[0]["callback_data"]
+        self.group_posts += 1
+        race = asyncio.get_running_loop().create_task(self._race(data, result["message_id"]))
+        self._races.append(race)
+
+    # ---------------------
+    # Участники
+    # ---------------------
+    async def _send_and_wait(self, handler: str, update: dict, waiters: dict, key):
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        waiters[key] = waiter
+        started = time.perf_counter()
+        await self.fake.push_update(update)
+        try:
+            text = await asyncio.wait_for(waiter, STEP_TIMEOUT)
+        except asyncio.TimeoutError:
+            waiters.pop(key, None)
+            self.errors[handler] += 1
+            return None
+        self.latencies[handler].append(time.perf_counter() - started)
+        return text
+
+    def passenger_steps(self, rnd: random.Random):
+        street_from, street_to = rnd.sample(STREETS, 2)
+        return [
+            ("start_cmd", "/start"),
+            ("start_order", "🚕 Такси шақыру"),
+            ("get_trip_type", "🏙 Қала ішінде"),
+            ("get_from_addr", f"{street_from} {rnd.randint(1, 200)}"),
+            ("get_to_addr", f"{street_to} {rnd.randint(1, 200)}"),
+            ("get_price", str(rnd.choice([500, 700, 1000, 1500]))),
+            ("get_phone_text", f"+7{rnd.choice(OPERATOR_CODES)}{rnd.randint(0, 9_999_999):07d}"),
+        ]
+
+    async def passenger(self, index: int, steps, think: float):
+        user_id = PASSENGER_BASE_ID + index
+        for handler, text in steps:
+            if think:
+                await asyncio.sleep(think)
+            update = self.fake.message(user_id, text)
+            if await self._send_and_wait(handler, update, self._chat_waiters, user_id) is None:
+                return
+        self.orders_sent += 1
+
+    async def _race(self, data: str, message_id: int):
+        rnd = random.Random(f"{self.args.seed}:{data}")
+        drivers = rnd.sample(range(self.args.drivers), min(self.args.drivers, self.args.racers))
+
+        async def tap(driver_index: int):
+            await asyncio.sleep(rnd.random() * self.args.jitter / 1000)
+            update = self.fake.callback(DRIVER_BASE_ID + driver_index, data, GROUP_ID, message_id)
+            key = update["callback_query"]["id"]
+            text = await self._send_and_wait("callback_accept", update, self._callback_waiters, key)
+            if text and "қабылданды" in text:
+                self.claims[data] += 1
+
+        await asyncio.gather(*(tap(d) for d in drivers))
+
+    async def run(self):
+        args = self.args
+        sem = asyncio.Semaphore(args.concurrency)
+        # Все случайные решения принимаются заранее — прогоны с одним seed одинаковы
+        plans = []
+        for i in range(args.passengers):
+            steps = self.passenger_steps(self.rnd)
+            think = self.rnd.expovariate(1000 / args.think) if args.think else 0
+            plans.append((i, steps, think))
+
+        async def one(plan):
+            async with sem:
+                await self.passenger(*plan)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(plan) for plan in plans))
+        # Посты в группу идут через очередь бота и могут отставать от пассажиров
+        deadline = time.perf_counter() + STEP_TIMEOUT
+        while self.group_posts < self.orders_sent and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+        while self._races:
+            races, self._races = self._races, []
+            await asyncio.gather(*races)
+        return time.perf_counter() - started
+
+    def report(self, elapsed: float) -> dict:
+        handlers = {}
+        for handler, values in self.latencies.items():
+            handlers[handler] = {
+                'count': len(values),
+                'errors': self.errors.get(handler, 0),
+                'p50_ms': percentile(values, 50) * 1000,
+                'p95_ms': percentile(values, 95) * 1000,
+                'p99_ms': percentile(values, 99) * 1000,
+            }
+        updates = sum(len(v) for v in self.latencies.values())
+        double_wins = sum(1 for wins in self.claims.values() if wins > 1)
+        return {
+            'seed': self.args.seed,
+            'mode': self.args.mode,
+            'elapsed_s': elapsed,
+            'orders': self.orders_sent,
+            'orders_per_s': self.orders_sent / elapsed if elapsed else 0.0,
+            'updates': updates,
+            'updates_per_s': updates / elapsed if elapsed else 0.0,
+            'claimed_orders': len(self.claims),
+            'double_wins': double_wins,
+            'api_calls': dict(self.fake.calls),
+            'handlers': handlers,
+            **self.extra,
+        }
+
+
+def print_report(result: dict):
+    print(f"\nРежим: {result['mode']}, seed={result['seed']}")
+    print(f"Заказов: {result['orders']} за {result['elapsed_s']:.2f} с "
+          f"→ {result['orders_per_s']:.1f} заказов/с")
+    print(f"Апдейтов: {result['updates']} → {result['updates_per_s']:.1f} апдейтов/с")
+    print(f"Принято заказов: {result['claimed_orders']}, двойных побед: {result['double_wins']}")
+    print(f"\n{'хендлер':<18}{'кол-во':>8}{'ошибок':>8}{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}")
+    for handler, row in result['handlers'].items():
+        print(f"{handler:<18}{row['count']:>8}{row['errors']:>8}"
+              f"{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}")
+    print(f"\nВызовы API: {result['api_calls']}")
+    if result.get('outbox'):
+        print(f"Очередь отправки: {result['outbox']}")
+
+
+def configure_bot_env(fake_url: str, db_path: str, telegram_limits: bool = False):
+    """Направить bot.py на фейковый API и временную базу (до импорта bot)"""
+    os.environ["BOT_TOKEN"] = "123456789:LOADTEST"
+    os.environ["GROUP_ID"] = str(GROUP_ID)
+    os.environ["TELEGRAM_API_URL"] = fake_url
+    os.environ["DB_PATH"] = db_path
+    if not telegram_limits:
+        # Меряем сам бот, а не лимиты Telegram: снимаем ограничения очереди отправки
+        for name in ("SEND_GLOBAL_RATE", "SEND_PRIVATE_RATE", "SEND_GROUP_RATE"):
+            os.environ[name] = "1000000"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def run_polling(fake: FakeTelegram, scenario: Scenario, args):
+    import bot as taxi_bot
+    from aiogram import Bot
+
+    await taxi_bot.on_startup(taxi_bot.dp)
+    Bot.set_current(taxi_bot.bot)
+    polling = asyncio.create_task(taxi_bot.dp.start_polling(timeout=20, relax=args.relax))
+    try:
+        elapsed = await scenario.run()
+        scenario.extra['outbox'] = taxi_bot.outbox.stats()
+        return elapsed
+    finally:
+        taxi_bot.dp.stop_polling()
+        fake.release_pollers()
+        await polling
+        await taxi_bot.on_shutdown(taxi_bot.dp)
+        await (await taxi_bot.bot.get_session()).close()
+
+
+async def run_webhook(fake: FakeTelegram, scenario: Scenario, args):
+    from aiohttp import web
+    import webhook
+
+    port = free_port()
+    app = webhook.build_app(webhook_url=f"http://127.0.0.1:{port}{webhook.WEBHOOK_PATH}")
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()  # on_startup: init_db и setWebhook на фейковый API
+    site = web.TCPSite(runner, "127.0.0.1", port)
+    await site.start()
+    try:
+        elapsed = await scenario.run()
+        scenario.extra['outbox'] = webhook.taxi_bot.outbox.stats()
+        scenario.extra['webhook_processed'] = app["pool"].processed
+        return elapsed
+    finally:
+        await runner.cleanup()
+
+
+async def run_supervisor(fake: FakeTelegram, scenario: Scenario, args):
+    # Супервизор — отдельный процесс со своими воркерами; фейковый API остаётся здесь
+    env = dict(os.environ, BOT_WORKERS=str(args.workers))
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "supervisor.py"), env=env
+    )
+    try:
+        # Ждём первого getUpdates: до него супервизор сбрасывает очередь апдейтов
+        while not fake.calls["getUpdates"]:
+            if proc.returncode is not None:
+                raise RuntimeError(f"supervisor.py завершился с кодом {proc.returncode}")
+            await asyncio.sleep(0.05)
+        elapsed = await scenario.run()
+        scenario.extra['workers'] = args.workers
+        return elapsed
+    finally:
+        if proc.returncode is None:
+            proc.terminate()
+        fake.release_pollers()
+        await proc.wait()
+
+
+async def main(args):
+    fake = FakeTelegram(latency=args.api_latency / 1000)
+    fake_url = await fake.start()
+    scenario = Scenario(fake, args)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        configure_bot_env(fake_url, os.path.join(tmp, "loadgen.db"), args.telegram_limits)
+        try:
+            if args.mode == "webhook":
+                elapsed = await run_webhook(fake, scenario, args)
+            elif args.mode == "supervisor":
+                elapsed = await run_supervisor(fake, scenario, args)
+            else:
+                elapsed = await run_polling(fake, scenario, args)
+        finally:
+            await fake.stop()
+
+    result = scenario.report(elapsed)
+    print_report(result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    return result
+
+
+def compare(argv):
+    """Прогнать один и тот же сценарий в каждом режиме (отдельными процессами) и свести результаты"""
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in COMPARE_MODES:
+            out = os.path.join(tmp, f"{mode}.json")
+            subprocess.run([sys.executable, __file__, *argv, "--mode", mode, "--json", out], check=True)
+            with open(out, encoding="utf-8") as f:
+                results[mode] = json.load(f)
+
+    print(f"\n{'режим':<10}{'заказов/с':>11}{'апдейтов/с':>12}{'p50 мс':>9}{'p95 мс':>9}{'p99 мс':>9}")
+    for mode, result in results.items():
+        all_latencies = result['handlers'].values()
+        # Сводные перцентили — худший хендлер по каждому перцентилю
+        print(f"{mode:<10}{result['orders_per_s']:>11.1f}{result['updates_per_s']:>12.1f}"
+              f"{max(h['p50_ms'] for h in all_latencies):>9.1f}"
+              f"{max(h['p95_ms'] for h in all_latencies):>9.1f}"
+              f"{max(h['p99_ms'] for h in all_latencies):>9.1f}")
+    return results
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест bot.py против локального Bot API")
+    parser.add_argument("--passengers", type=int, default=1000, help="сколько пассажиров оформят заказ")
+    parser.add_argument("--drivers", type=int, default=10, help="водителей в группе")
+    parser.add_argument("--racers", type=int, default=10, help="сколько водителей жмут на каждый заказ")
+    parser.add_argument("--concurrency", type=int, default=100, help="пассажиров одновременно")
+    parser.add_argument("--think", type=float, default=0, help="средняя пауза пассажира между шагами, мс")
+    parser.add_argument("--jitter", type=float, default=50, help="разброс нажатий водителей, мс")
+    parser.add_argument("--api-latency", type=float, default=0, help="задержка ответа фейкового API, мс")
+    parser.add_argument("--relax", type=float, default=0.1, help="пауза между getUpdates, как у executor")
+    parser.add_argument("--telegram-limits", action="store_true",
+                        help="оставить лимиты отправки Telegram (по умолчанию сняты)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--mode", choices=COMPARE_MODES, default="polling")
+    parser.add_argument("--workers", type=int, default=4, help="процессов бота в режиме supervisor")
+    parser.add_argument("--compare", action="store_true", help="сравнить все режимы на одном сценарии")
+    parser.add_argument("--json", help="сохранить результат в JSON-файл")
+    return parser
+
+
+if __name__ == "__main__":
+    cli_args = build_parser().parse_args()
+    if cli_args.compare:
+        compare([a for a in sys.argv[1:] if a != "--compare"])
+    else:
+        asyncio.run(main(cli_args))
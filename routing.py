@@ -0,0 +1,158 @@
+# routing.py — маршрутизация кнопок без цепочки lambda-фильтров.
+# Тексты reply-кнопок ищутся одним обращением к словарю, callback_data —
+# по префиксу до первого "_" (одноуровневое префиксное дерево) и сразу
+# разбирается в типизированный NamedTuple. Стоимость выбора хендлера не
+# растёт с числом кнопок: в aiogram регистрируется по одному хендлеру на
+# сообщения и на callback-и, остальное решает Router.
+from typing import NamedTuple
+
+from aiogram import Dispatcher, types
+from aiogram.dispatcher import FSMContext
+from aiogram.dispatcher.handler import SkipHandler
+
+ANY_STATE = '*'
+SEPARATOR = '_'
+
+
+class CallbackRoute:
+    """
+    Кодек callback_data вида "prefix_поле1_поле2". Формат совпадает с тем,
+    что бот уже рассылал, поэтому старые кнопки в группе продолжают работать.
+    """
+
+    def __init__(self, prefix: str, payload: type):
+        if SEPARATOR in prefix:
+            raise ValueError(f"Префикс не может содержать {SEPARATOR!r}: {prefix}")
+        self.prefix = prefix
+        self.payload = payload
+        self._casts = tuple(payload.__annotations__.values())
+
+    def encode(self, *values) -> str:
+        data = SEPARATOR.join((self.prefix, *map(str, values)))
+        if len(data.encode()) > 64:
+            raise ValueError(f"callback_data длиннее 64 байт: {data}")
+        return data
+
+    def decode(self, fields: list):
+        """Поля после префикса → payload; None, если данные испорчены"""
+        if len(fields) != len(self._casts):
+            return None
+        try:
+            return self.payload(*(cast(value) for cast, value in zip(self._casts, fields)))
+        except ValueError:
+            return None
+
+
+# ---------------------
+# Callback-и бота
+# ---------------------
+class OrderPayload(NamedTuple):
+    order_id: int
+
+
+class RatePayload(NamedTuple):
+    order_id: int
+    stars: int
+
+
+class HistoryPayload(NamedTuple):
+    role: str       # d — водитель, p — пассажир
+    direction: str  # n — новее, o — старше
+    stamp: str      # created_at курсора, YYYYmmddHHMMSS
+    order_id: int
+
+
+ACCEPT = CallbackRoute('accept', OrderPayload)
+COMPLETE = CallbackRoute('complete', OrderPayload)
+RATE = CallbackRoute('rate', RatePayload)
+HISTORY = CallbackRoute('hist', HistoryPayload)
+
+
+class Router:
+    def __init__(self):
+        self._texts = {}      # текст кнопки → (хендлер, состояния)
+        self._callbacks = {}  # префикс → (маршрут, хендлер, состояния)
+
+    # ---------------------
+    # Регистрация
+    # ---------------------
+    def text(self, *texts: str, state=None):
+        """
+        Хендлер reply-кнопки: handler(message, state).
+        state — как в aiogram: None (вне сценария), '*' или состояние/список состояний.
+        """
+        def decorator(handler):
+            states = _state_names(state)
+            for text in texts:
+                if text in self._texts:
+                    raise ValueError(f"Кнопка уже зарегистрирована: {text}")
+                self._texts[text] = (handler, states)
+            return handler
+        return decorator
+
+    def callback(self, route: CallbackRoute, state=ANY_STATE):
+        """Хендлер inline-кнопки: handler(callback, payload)"""
+        def decorator(handler):
+            if route.prefix in self._callbacks:
+                raise ValueError(f"Префикс уже зарегистрирован: {route.prefix}")
+            self._callbacks[route.prefix] = (route, handler, _state_names(state))
+            return handler
+        return decorator
+
+    def setup(self, dp: Dispatcher):
+        """Подключить к диспетчеру; вызывать там, где раньше стояли фильтры кнопок"""
+        dp.register_message_handler(self._on_text, content_types=types.ContentType.TEXT, state=ANY_STATE)
+        dp.register_callback_query_handler(self._on_callback, state=ANY_STATE)
+
+    # ---------------------
+    # Поиск
+    # ---------------------
+    def match_text(self, text: str):
+        """(хендлер, состояния) для текста кнопки или None"""
+        return self._texts.get(text)
+
+    def match_callback(self, data: str):
+        """(хендлер, состояния, payload) для callback_data или None"""
+        prefix, _, rest = (data or '').partition(SEPARATOR)
+        entry = self._callbacks.get(prefix)
+        if entry is None:
+            return None
+        route, handler, states = entry
+        payload = route.decode(rest.split(SEPARATOR) if rest else [])
+        if payload is None:
+            return None
+        return handler, states, payload
+
+    # ---------------------
+    # Хендлеры aiogram
+    # ---------------------
+    async def _on_text(self, message: types.Message, state: FSMContext):
+        entry = self.match_text(message.text)
+        if entry is None:
+            raise SkipHandler()  # не кнопка — дальше по цепочке (шаги FSM)
+        handler, states = entry
+        if states is not ANY_STATE and await state.get_state() not in states:
+            raise SkipHandler()
+        await handler(message, state)
+
+    async def _on_callback(self, callback: types.CallbackQuery, state: FSMContext):
+        match = self.match_callback(callback.data)
+        if match is None:
+            raise SkipHandler()
+        handler, states, payload = match
+        if states is not ANY_STATE and await state.get_state() not in states:
+            raise SkipHandler()
+        await handler(callback, payload)
+
+
+def _state_names(state):
+    if state == ANY_STATE:
+        return ANY_STATE
+    if not isinstance(state, (list, tuple, set, frozenset)):
+        state = [state]
+    names = set()
+    for item in state:
+        if item == ANY_STATE:
+            return ANY_STATE
+        names.update(getattr(item, 'all_states_names', None) or [getattr(item, 'state', item)])
+    return frozenset(names)
@@ -0,0 +1,227 @@
+# scheduler.py — один планировщик таймеров на весь бот.
+# Таймеры заказов (очередная волна предложений, переход в группу) лежат в одной
+# куче и обслуживаются одной задачей asyncio, а не отдельной спящей задачей на
+# каждый заказ. Отменённый таймер остаётся в куче и выбрасывается, когда
+# доходит до верха; если отменённых больше половины, куча пересобирается.
+# Долгие и многочисленные таймеры (жизненный цикл заказов) — в TimerWheel:
+# хэшированное колесо поверх того же планировщика.
+import asyncio
+import heapq
+import itertools
+import math
+from collections import Counter
+
+
+class Timer:
+    __slots__ = ('when', 'seq', 'callback', 'args', 'cancelled', '_scheduler')
+
+    def __init__(self, when, seq, callback, args, scheduler):
+        self.when = when
+        self.seq = seq
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+        self._scheduler = scheduler
+
+    def __lt__(self, other):
+        return (self.when, self.seq) < (other.when, other.seq)
+
+    def cancel(self):
+        if not self.cancelled:
+            self.cancelled = True
+            self._scheduler._cancelled(self)
+
+
+class Scheduler:
+    """
+    call_later/call_at ставят callback(*args) на время loop.time(); корутину,
+    которую вернул callback, планировщик запускает отдельной задачей, чтобы
+    медленный обработчик не задерживал остальные таймеры.
+    """
+
+    def __init__(self):
+        self.counters = Counter()  # scheduled / fired / cancelled / failed
+        self._heap = []
+        self._seq = itertools.count()
+        self._cancelled_count = 0
+        self._wakeup = None
+        self._runner = None
+        self._running = set()
+
+    # ---------------------
+    # Запуск и остановка
+    # ---------------------
+    def start(self):
+        if self._runner is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._runner = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Остановиться; несработавшие таймеры отбрасываются"""
+        if self._runner is None:
+            return
+        self._runner.cancel()
+        try:
+            await self._runner
+        except asyncio.CancelledError:
+            pass
+        self._runner = None
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+        self._heap.clear()
+        self._cancelled_count = 0
+
+    # ---------------------
+    # Таймеры
+    # ---------------------
+    def call_at(self, when: float, callback, *args) -> Timer:
+        timer = Timer(when, next(self._seq), callback, args, self)
+        heapq.heappush(self._heap, timer)
+        self.counters['scheduled'] += 1
+        # Новый таймер раньше всех — разбудить цикл, чтобы он пересчитал сон
+        if self._wakeup is not None and self._heap[0] is timer:
+            self._wakeup.set()
+        return timer
+
+    def call_later(self, delay: float, callback, *args) -> Timer:
+        return self.call_at(asyncio.get_running_loop().time() + delay, callback, *args)
+
+    def _cancelled(self, timer: Timer):
+        self.counters['cancelled'] += 1
+        self._cancelled_count += 1
+        if self._cancelled_count > len(self._heap) // 2:
+            self._heap = [t for t in self._heap if not t.cancelled]
+            heapq.heapify(self._heap)
+            self._cancelled_count = 0
+
+    def stats(self) -> dict:
+        return {
+            'pending': len(self._heap) - self._cancelled_count,
+            'running': len(self._running),
+            **self.counters,
+        }
+
+    # ---------------------
+    # Цикл
+    # ---------------------
+    async def _sleep(self, timeout):
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            while self._heap and self._heap[0].cancelled:
+                heapq.heappop(self._heap)
+                self._cancelled_count -= 1
+            if not self._heap:
+                await self._sleep(None)
+                continue
+            delay = self._heap[0].when - loop.time()
+            if delay > 0:
+                await self._sleep(delay)
+                continue
+            self._fire(heapq.heappop(self._heap))
+
+    def _fire(self, timer: Timer):
+        timer.cancelled = True  # уже не в куче: поздний cancel() ничего не делает
+        self.counters['fired'] += 1
+        try:
+            result = timer.callback(*timer.args)
+        except Exception as e:
+            self.counters['failed'] += 1
+            print(f"Ошибка таймера {timer.callback.__name__}: {e}")
+            return
+        if asyncio.iscoroutine(result):
+            task = asyncio.create_task(result)
+            self._running.add(task)
+            task.add_done_callback(self._done)
+
+    def _done(self, task: asyncio.Task):
+        self._running.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            self.counters['failed'] += 1
+            print(f"Ошибка таймера: {task.exception()}")
+
+
+# ---------------------
+# Колесо таймеров
+# ---------------------
+class WheelTimer:
+    __slots__ = ('slot', 'rounds', 'callback', 'args', 'cancelled', '_wheel')
+
+    def __init__(self, slot, rounds, callback, args, wheel):
+        self.slot = slot
+        self.rounds = rounds
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+        self._wheel = wheel
+
+    def cancel(self):
+        if not self.cancelled:
+            self.cancelled = True
+            self._wheel._remove(self)
+
+
+class TimerWheel:
+    """
+    Хэшированное колесо: slots ячеек по tick секунд. Таймер кладётся в ячейку
+    (сейчас + задержка) по модулю slots и помнит, сколько полных оборотов ему
+    ждать. Добавление и отмена — O(1), за тик разбирается одна ячейка. Точность —
+    один тик, раньше срока таймер не срабатывает. Колесо тикает через Scheduler
+    и только пока в нём есть таймеры.
+    """
+
+    def __init__(self, scheduler: Scheduler, tick: float = 1.0, slots: int = 512):
+        self.scheduler = scheduler
+        self.tick = tick
+        self._slots = [set() for _ in range(slots)]
+        self._cursor = 0      # ячейка, разобранная последним тиком
+        self._next = None     # loop.time() следующего тика
+        self._ticker = None
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def call_later(self, delay: float, callback, *args) -> WheelTimer:
+        now = asyncio.get_running_loop().time()
+        if self._ticker is None:
+            self._next = now + self.tick
+            self._ticker = self.scheduler.call_at(self._next, self._tick)
+        # Номер тика (1 — ближайший), который наступит не раньше now + delay;
+        # допуск — чтобы погрешность float не сдвигала таймер на целый тик
+        ticks = max(1, math.ceil((now + delay - self._next) / self.tick - 1e-9) + 1)
+        slots = len(self._slots)
+        timer = WheelTimer((self._cursor + ticks) % slots, (ticks - 1) // slots, callback, args, self)
+        self._slots[timer.slot].add(timer)
+        self._count += 1
+        return timer
+
+    def _remove(self, timer: WheelTimer):
+        self._slots[timer.slot].discard(timer)
+        self._count -= 1
+
+    def _tick(self):
+        now = asyncio.get_running_loop().time()
+        # Цикл событий мог задержаться — догоняем пропущенные тики
+        while self._next <= now and self._count:
+            self._cursor = (self._cursor + 1) % len(self._slots)
+            slot = self._slots[self._cursor]
+            for timer in list(slot):
+                if timer.rounds:
+                    timer.rounds -= 1
+                    continue
+                slot.discard(timer)
+                self._count -= 1
+                self.scheduler._fire(timer)
+            self._next += self.tick
+        if self._count:
+            self._ticker = self.scheduler.call_at(self._next, self._tick)
+        else:
+            self._ticker = None
@@ -0,0 +1,310 @@
+# send_scheduler.py — очередь исходящих сообщений с лимитами Telegram.
+# Токен-бакеты на весь бот и на каждый чат, классы приоритета (рассылка заказа
+# и подтверждение водителю идут раньше ответов меню), RetryAfter и сетевые
+# ошибки с backoff. Хендлер ставит сообщение в очередь и не ждёт HTTP-запроса,
+# если ему не нужен message_id.
+# У каждого чата своя очередь; в общей куче ready лежат только головы чатов,
+# которым можно отправлять прямо сейчас. Чат без токена «паркуется» до момента,
+# когда токен появится, и выборка не перебирает его задачи на каждом проходе.
+import asyncio
+import heapq
+import itertools
+import random
+from collections import Counter
+
+from aiogram.utils.exceptions import NetworkError, RestartingTelegram, RetryAfter
+
+# Классы приоритета: меньше — раньше
+PRIORITY_BOARD = 0      # пост занятого заказа в группе теряет кнопку (group_board.py)
+PRIORITY_BROADCAST = 1  # новый заказ в группу водителей
+PRIORITY_CLAIM = 2      # подтверждение принятого заказа
+PRIORITY_REPLY = 3      # ответы пассажирам в меню
+PRIORITY_NAMES = {
+    PRIORITY_BOARD: 'board',
+    PRIORITY_BROADCAST: 'broadcast',
+    PRIORITY_CLAIM: 'claim',
+    PRIORITY_REPLY: 'reply',
+}
+
+# Лимиты Bot API: ~30 сообщений/с на бота, ~1/с в личный чат, 20/мин в группу
+GLOBAL_RATE = 30.0
+GLOBAL_BURST = 30
+PRIVATE_RATE = 1.0
+PRIVATE_BURST = 5
+GROUP_RATE = 20 / 60
+GROUP_BURST = 5
+
+MAX_RETRIES = 5
+MAX_BACKOFF = 30.0  # секунд
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+        self.blocked_until = 0.0  # после RetryAfter чат молчит до этого момента
+
+    def delay(self, now: float) -> float:
+        """Через сколько секунд будет доступен токен (0 — уже есть)"""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, until: float):
+        self.blocked_until = max(self.blocked_until, until)
+
+
+class _Job:
+    __slots__ = ('priority', 'seq', 'chat_id', 'call', 'future', 'on_sent', 'attempt')
+
+    def __init__(self, priority, seq, chat_id, call, future, on_sent):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.call = call
+        self.future = future
+        self.on_sent = on_sent
+        self.attempt = 0
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class SendScheduler:
+    def __init__(self, bot, global_rate: float = GLOBAL_RATE, private_rate: float = PRIVATE_RATE,
+                 group_rate: float = GROUP_RATE, concurrency: int = 8, max_retries: int = MAX_RETRIES):
+        self.bot = bot
+        self.global_rate = global_rate
+        self.private_rate = private_rate
+        self.group_rate = group_rate
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.counters = Counter()  # sent / retried / retry_after / failed
+        self._chats = {}     # chat_id → куча задач чата по (priority, seq)
+        self._queued = 0     # задач во всех очередях чатов
+        self._ready = []     # куча (priority, seq, chat_id) голов чатов, готовых к отправке
+        self._parked = []    # куча (когда появится токен, chat_id) для чатов без токена
+        self._parked_until = {}  # chat_id → время из _parked (остальные записи устарели)
+        self._seq = itertools.count()
+        self._buckets = {}
+        self._busy_chats = set()  # в каждый чат — не больше одного запроса сразу
+        self._global = None
+        self._slots = None
+        self._wakeup = None
+        self._runner = None
+        self._inflight = set()
+
+    # ---------------------
+    # Запуск и остановка
+    # ---------------------
+    def start(self):
+        if self._runner is not None:
+            return
+        loop = asyncio.get_running_loop()
+        self._global = TokenBucket(self.global_rate, max(GLOBAL_BURST, 1), loop.time())
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._wakeup = asyncio.Event()
+        self._runner = asyncio.create_task(self._run())
+
+    async def close(self, timeout: float = 10.0):
+        """Дослать очередь (не дольше timeout) и остановиться"""
+        if self._runner is None:
+            return
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while (self._queued or self._inflight) and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+        self._runner.cancel()
+        try:
+            await self._runner
+        except asyncio.CancelledError:
+            pass
+        self._runner = None
+        for jobs in self._chats.values():
+            for job in jobs:
+                if not job.future.done():
+                    job.future.cancel()
+        self._chats.clear()
+        self._queued = 0
+        self._ready.clear()
+        self._parked.clear()
+        self._parked_until.clear()
+
+    # ---------------------
+    # Постановка в очередь
+    # ---------------------
+    def submit(self, chat_id: int, call, priority: int = PRIORITY_REPLY, on_sent=None) -> asyncio.Future:
+        """
+        Поставить запрос call() к Bot API в очередь чата chat_id.
+        Возвращает future с результатом; ждать его нужно только ради результата.
+        on_sent(result) — корутина, которую планировщик вызовет после отправки.
+        """
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_consume_exception)
+        job = _Job(priority, next(self._seq), chat_id, call, future, on_sent)
+        self._push(job)
+        self._wakeup.set()
+        return future
+
+    def send_message(self, chat_id: int, text: str, priority: int = PRIORITY_REPLY,
+                     on_sent=None, **kwargs) -> asyncio.Future:
+        return self.submit(
+            chat_id, lambda: self.bot.send_message(chat_id, text, **kwargs), priority, on_sent
+        )
+
+    def stats(self) -> dict:
+        """Глубина очереди по классам приоритета и счётчики отправки"""
+        depth = Counter(PRIORITY_NAMES.get(job.priority, str(job.priority))
+                        for jobs in self._chats.values() for job in jobs)
+        return {
+            'queued': self._queued,
+            'queued_by_priority': dict(depth),
+            'in_flight': len(self._inflight),
+            **self.counters,
+        }
+
+    # ---------------------
+    # Выборка и отправка
+    # ---------------------
+    def _bucket(self, chat_id: int, now: float) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if chat_id < 0:
+                bucket = TokenBucket(self.group_rate, GROUP_BURST, now)
+            else:
+                bucket = TokenBucket(self.private_rate, PRIVATE_BURST, now)
+            self._buckets[chat_id] = bucket
+        return bucket
+
+    def _push(self, job: _Job):
+        jobs = self._chats.setdefault(job.chat_id, [])
+        heapq.heappush(jobs, job)
+        self._queued += 1
+        # Новая голова чата — пересчитать его место; иначе чат уже учтён
+        if jobs[0] is job:
+            self._schedule_chat(job.chat_id, asyncio.get_running_loop().time())
+
+    def _schedule_chat(self, chat_id: int, now: float):
+        """Положить голову чата в ready или припарковать чат до появления токена"""
+        jobs = self._chats.get(chat_id)
+        if not jobs or chat_id in self._busy_chats or chat_id in self._parked_until:
+            return
+        delay = self._bucket(chat_id, now).delay(now)
+        if delay > 0:
+            self._parked_until[chat_id] = now + delay
+            heapq.heappush(self._parked, (now + delay, chat_id))
+        else:
+            heapq.heappush(self._ready, (jobs[0].priority, jobs[0].seq, chat_id))
+
+    def _unpark(self, now: float):
+        while self._parked and self._parked[0][0] <= now:
+            until, chat_id = heapq.heappop(self._parked)
+            if self._parked_until.get(chat_id) == until:
+                del self._parked_until[chat_id]
+                self._schedule_chat(chat_id, now)
+
+    def _pick(self):
+        """Самая приоритетная голова готового чата; устаревшие записи ready отбрасываются"""
+        while self._ready:
+            _, seq, chat_id = heapq.heappop(self._ready)
+            jobs = self._chats.get(chat_id)
+            if not jobs or jobs[0].seq != seq or chat_id in self._busy_chats:
+                continue
+            job = heapq.heappop(jobs)
+            if not jobs:
+                del self._chats[chat_id]
+            self._queued -= 1
+            return job
+        return None
+
+    async def _sleep(self, timeout):
+        # Просыпаемся раньше, если пришла новая задача или освободился чат
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            self._unpark(now)
+            if not self._ready:
+                await self._sleep(self._parked[0][0] - now if self._parked else None)
+                continue
+            delay = self._global.delay(now)
+            if delay > 0:
+                await self._sleep(delay)
+                continue
+            job = self._pick()
+            if job is None:
+                continue
+            self._global.take()
+            self._bucket(job.chat_id, now).take()
+            await self._slots.acquire()
+            self._busy_chats.add(job.chat_id)
+            task = asyncio.create_task(self._deliver(job))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _deliver(self, job: _Job):
+        loop = asyncio.get_running_loop()
+        try:
+            result = await job.call()
+        except RetryAfter as e:
+            self.counters['retry_after'] += 1
+            self._bucket(job.chat_id, loop.time()).block(loop.time() + e.timeout)
+            self._retry(job, e)
+        except (NetworkError, RestartingTelegram) as e:
+            backoff = min(MAX_BACKOFF, 0.5 * 2 ** job.attempt) * (1 + random.random() / 2)
+            self._bucket(job.chat_id, loop.time()).block(loop.time() + backoff)
+            self._retry(job, e)
+        except Exception as e:
+            self.counters['failed'] += 1
+            print(f"Не удалось отправить в чат {job.chat_id}: {e}")
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            self.counters['sent'] += 1
+            if not job.future.done():
+                job.future.set_result(result)
+            if job.on_sent is not None:
+                try:
+                    await job.on_sent(result)
+                except Exception as e:
+                    print(f"Ошибка обработчика после отправки в чат {job.chat_id}: {e}")
+        finally:
+            self._busy_chats.discard(job.chat_id)
+            self._slots.release()
+            self._schedule_chat(job.chat_id, loop.time())
+            self._wakeup.set()
+
+    def _retry(self, job: _Job, error: Exception):
+        job.attempt += 1
+        if job.attempt > self.max_retries:
+            self.counters['failed'] += 1
+            print(f"Не удалось отправить в чат {job.chat_id} после {self.max_retries} попыток: {error}")
+            if not job.future.done():
+                job.future.set_exception(error)
+            return
+        self.counters['retried'] += 1
+        # Тот же seq — сообщение остаётся первым в очереди своего чата;
+        # чат занят, в ready он вернётся, когда _deliver закончится
+        self._push(job)
+
+
+def _consume_exception(future: asyncio.Future):
+    # Ошибку уже залогировал планировщик; без этого asyncio ругается
+    # на future, результат которого никто не ждал
+    if not future.cancelled():
+        future.exception()
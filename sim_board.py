@@ -0,0 +1,182 @@
+# sim_board.py — сколько проигравших нажатий «Қабылдау» убирает group_board.py.
+# Всплеск: --orders заказов сразу (или --rate в минуту) уходят в группу через
+# настоящий SendScheduler с лимитом группы, Bot API — fake_telegram.py, захват —
+# db.claim_order на временной базе. Каждый из --drivers водителей с вероятностью
+# --tap жмёт на пост через экспоненциальное время (среднее --reaction с); если к
+# этому моменту пост уже переписан и кнопки нет, нажатия не будет. Победитель
+# через --trip с в среднем завершает поездку. Режимы на одном и том же потоке нажатий:
+#   off   — пост не меняется (как раньше);
+#   naive — отдельный editMessageText на каждый переход;
+#   board — GroupBoard: правки с объединением по сообщению.
+# Время ускорено в --speed раз (лимиты и задержки пересчитаны), в отчёте —
+# секунды реального времени Telegram.
+#
+#   python sim_board.py --orders 40 --drivers 30
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+
+from aiogram import Bot
+from aiogram.bot.api import TelegramAPIServer
+
+import db
+import send_scheduler
+from fake_telegram import FakeTelegram
+from group_board import GroupBoard
+from send_scheduler import SendScheduler, PRIORITY_BOARD, PRIORITY_BROADCAST, PRIORITY_CLAIM, PRIORITY_REPLY
+
+GROUP_ID = -1001234567890
+DRIVER_BASE_ID = 900_000
+MODES = ["off", "naive", "board"]
+PRIORITIES = {'board': PRIORITY_BOARD, 'broadcast': PRIORITY_BROADCAST, 'claim': PRIORITY_CLAIM}
+
+
+def percentile(values, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def plan_taps(args) -> list:
+    """Для каждого заказа — задержки нажатий водителей после появления поста, секунд"""
+    rnd = random.Random(args.seed)
+    plan = []
+    for _ in range(args.orders):
+        taps = [(rnd.expovariate(1 / args.reaction), DRIVER_BASE_ID + d)
+                for d in range(args.drivers) if rnd.random() < args.tap]
+        plan.append((sorted(taps), rnd.expovariate(1 / args.trip)))
+    return plan
+
+
+async def simulate(mode: str, args, plan) -> dict:
+    speed = args.speed
+    fake = FakeTelegram(latency=args.api_latency / 1000 / speed)
+    url = await fake.start()
+    bot = Bot(token="123456789:SIMBOARD", server=TelegramAPIServer.from_base(url))
+    outbox = SendScheduler(bot, global_rate=send_scheduler.GLOBAL_RATE * speed,
+                           group_rate=send_scheduler.GROUP_RATE * speed)
+    board = GroupBoard(outbox, GROUP_ID)
+    tmp = tempfile.TemporaryDirectory()
+    await db.init_db(os.path.join(tmp.name, "sim.db"))
+    outbox.start()
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+
+    edited = {}  # message_id → когда Telegram принял правку
+    counts = {'taps': 0, 'lost': 0, 'skipped': 0}
+    hidden_after = []  # от захвата до исчезновения кнопки, секунд
+    post_delay = []    # от заказа до поста в группе, секунд
+    claimed_at = {}
+    tasks = []
+
+    def on_call(method, params, result):
+        if method.lower() == "editmessagetext":
+            message_id = int(params["message_id"])
+            if message_id not in edited and message_id in claimed_at:
+                hidden_after.append((loop.time() - claimed_at[message_id]) * speed)
+            edited.setdefault(message_id, loop.time())
+
+    fake.subscribe(on_call)
+
+    def show(message_id: int, text: str, priority: int):
+        if mode == "board":
+            board.update(message_id, text, priority=priority)
+        elif mode == "naive":
+            outbox.submit(GROUP_ID, lambda: bot.edit_message_text(text, GROUP_ID, message_id), priority)
+
+    async def complete(order_id: int, message_id: int, driver_id: int, trip: float):
+        await asyncio.sleep(trip / speed)
+        await db.complete_order(order_id, driver_id)
+        show(message_id, f"🏁 Сапар аяқталды #{order_id}", PRIORITY_REPLY)
+
+    async def tap(order_id: int, message_id: int, delay: float, driver_id: int, trip: float):
+        await asyncio.sleep(delay / speed)
+        if message_id in edited:
+            counts['skipped'] += 1
+            return
+        counts['taps'] += 1
+        if await db.claim_order(order_id, driver_id) is None:
+            counts['lost'] += 1
+            return
+        claimed_at[message_id] = loop.time()
+        show(message_id, f"✅ Тапсырыс қабылданды #{order_id}", PRIORITIES[args.priority])
+        await complete(order_id, message_id, driver_id, trip)
+
+    def posted(order_id: int, taps, trip: float):
+        created = loop.time()
+
+        async def on_sent(msg):
+            post_delay.append((loop.time() - created) * speed)
+            for delay, driver_id in taps:
+                tasks.append(asyncio.create_task(tap(order_id, msg.message_id, delay, driver_id, trip)))
+        return on_sent
+
+    for n, (taps, trip) in enumerate(plan):
+        if n and args.rate:
+            await asyncio.sleep(60 / args.rate / speed)
+        order_id = await db.insert_order("A", "B", 700, "+77070000000", 1)
+        outbox.send_message(GROUP_ID, f"🚕 Жаңа тапсырыс #{order_id}", priority=PRIORITY_BROADCAST,
+                            on_sent=posted(order_id, taps, trip))
+    # Ждём, пока разойдутся посты, отработают нажатия и уйдут правки
+    while outbox.stats()['queued'] or outbox.stats()['in_flight'] or not all(t.done() for t in tasks):
+        await asyncio.sleep(0.05)
+        tasks = [t for t in tasks if not t.done()]
+    await asyncio.sleep(0.2)
+    elapsed = (loop.time() - started) * speed
+
+    await outbox.close()
+    await (await bot.get_session()).close()
+    await fake.stop()
+    await db.close_db()
+    tmp.cleanup()
+    return {
+        'mode': mode,
+        'orders': len(plan),
+        'elapsed': elapsed,
+        'edits': fake.calls['editMessageText'],
+        'hidden_p50': percentile(hidden_after, 50),
+        'hidden_p90': percentile(hidden_after, 90),
+        'post_p50': percentile(post_delay, 50),
+        'post_p90': percentile(post_delay, 90),
+        'board': board.stats() if mode == "board" else {},
+        **counts,
+    }
+
+
+async def main(args):
+    plan = plan_taps(args)
+    burst = f"{args.rate:g} в минуту" if args.rate else "все сразу"
+    print(f"Заказов {args.orders} ({burst}), водителей {args.drivers}, нажимают {args.tap:.0%} "
+          f"через ~{args.reaction:g} с, поездка ~{args.trip:g} с, приоритет правки «принят» {args.priority}")
+    print(f"{'режим':<8}{'нажатий':>9}{'проиграли':>11}{'на заказ':>10}{'без кнопки':>12}"
+          f"{'правок':>8}{'кнопка ушла p50':>17}{'p90':>8}{'пост p50':>10}{'p90':>8}")
+    results = []
+    for mode in MODES:
+        r = await simulate(mode, args, plan)
+        results.append(r)
+        print(f"{mode:<8}{r['taps']:>9}{r['lost']:>11}{r['lost'] / r['orders']:>10.2f}{r['skipped']:>12}"
+              f"{r['edits']:>8}{r['hidden_p50']:>15.1f} с{r['hidden_p90']:>6.1f} с"
+              f"{r['post_p50']:>8.1f} с{r['post_p90']:>6.1f} с")
+    base = results[0]['lost']
+    for r in results[1:]:
+        saved = 1 - r['lost'] / base if base else 0.0
+        print(f"{r['mode']}: проигравших нажатий меньше на {saved:.0%}")
+    print(f"board: {results[-1]['board']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Правка поста в группе против проигравших нажатий")
+    parser.add_argument("--orders", type=int, default=40)
+    parser.add_argument("--rate", type=float, default=0, help="заказов в минуту, 0 — все сразу")
+    parser.add_argument("--drivers", type=int, default=30)
+    parser.add_argument("--tap", type=float, default=0.3, help="доля водителей, которые жмут на пост")
+    parser.add_argument("--reaction", type=float, default=20, help="среднее время до нажатия, секунд")
+    parser.add_argument("--trip", type=float, default=600, help="средняя поездка, секунд")
+    parser.add_argument("--api-latency", type=float, default=100, help="задержка Bot API, мс")
+    parser.add_argument("--priority", choices=PRIORITIES, default="board", help="класс приоритета правки «принят»")
+    parser.add_argument("--speed", type=float, default=20, help="ускорение времени")
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(main(parser.parse_args()))
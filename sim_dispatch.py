@@ -0,0 +1,196 @@
+# sim_dispatch.py — офлайн-симуляция раздачи заказов без Telegram и БД.
+# Синтетический город: водители и заказы вокруг центра Алматы, заказы приходят
+# пуассоновским потоком. Сравниваются режимы на одном и том же потоке:
+#   broadcast — заказ в группу, берёт тот, кто нажал первым, где бы он ни был;
+#   nearest   — заказ k ближайшим свободным (dispatch.GridIndex) в личку,
+#               через DISPATCH_OFFER_TIMEOUT — в группу;
+#   waves     — --waves волн по k ближайших через каждые DISPATCH_OFFER_TIMEOUT
+#               (прошлые волны могут принять и позже), затем группа.
+# Водитель, увидевший заказ, берёт его с вероятностью --accept через
+# экспоненциальное время со средним --response секунд. Победитель занят на
+# подачу и поездку (--speed км/ч) и освобождается в точке высадки. Решение
+# по заказу принимается в момент его появления: водитель-победитель занят
+# сразу, пока едет отклик, — в обоих режимах одинаково.
+#
+#   python sim_dispatch.py --drivers 200 --orders 2000
+import argparse
+import heapq
+import math
+import random
+import statistics
+import time
+
+import dispatch
+
+CENTER = (43.238, 76.889)  # Алматы
+CITY_KM = 12               # полуширина города
+UNMATCHED_AFTER = 300      # секунд без отклика — заказ потерян
+KM_PER_DEG = math.pi / 180 * dispatch.EARTH_RADIUS_KM
+
+
+def random_point(rnd: random.Random, hotspots):
+    """Точка в городе: половина — у «горячих» мест (вокзал, рынок), половина — где угодно"""
+    if rnd.random() < 0.5:
+        lat, lon = rnd.choice(hotspots)
+        spread = 1.0
+    else:
+        lat, lon = CENTER
+        spread = CITY_KM / 2
+    return (lat + rnd.gauss(0, spread) / KM_PER_DEG,
+            lon + rnd.gauss(0, spread) / (KM_PER_DEG * math.cos(math.radians(CENTER[0]))))
+
+
+def percentile(values, p):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def responses(rnd, drivers, accept: float, response: float):
+    """[(задержка отклика, driver_id)] тех, кто возьмёт заказ, по возрастанию"""
+    taps = [(rnd.expovariate(1 / response), driver_id) for driver_id in drivers if rnd.random() < accept]
+    return sorted(taps)
+
+
+# Сколько волн в личку до группы в каждом режиме
+WAVES = {
+    "broadcast": lambda args: 0,
+    "nearest": lambda args: 1,
+    "waves": lambda args: args.waves,
+}
+
+
+def simulate(mode: str, args, seed: int) -> dict:
+    rnd = random.Random(seed)
+    hotspots = [random_point(rnd, [CENTER]) for _ in range(5)]
+    positions = {driver_id: random_point(rnd, hotspots) for driver_id in range(args.drivers)}
+    index = dispatch.GridIndex()
+    for driver_id, (lat, lon) in positions.items():
+        index.update(driver_id, lat, lon, math.inf)
+    free = set(positions)
+
+    # Поток заказов одинаков в обоих режимах: свой генератор с тем же зерном
+    orders_rnd = random.Random(seed + 1)
+    events = []  # (время, порядок, вид, данные)
+    now = 0.0
+    for n in range(args.orders):
+        now += orders_rnd.expovariate(args.rate / 60)
+        heapq.heappush(events, (now, n, "order", (random_point(orders_rnd, hotspots),
+                                                   random_point(orders_rnd, hotspots))))
+
+    latencies, pickups, messages = [], [], 0
+    notified = 0  # скольким водителям пришло уведомление о заказе (личка + группа)
+    fallbacks = unmatched = 0
+    seq = args.orders
+    while events:
+        now, _, kind, data = heapq.heappop(events)
+        if kind == "free":
+            driver_id, (lat, lon) = data
+            positions[driver_id] = (lat, lon)
+            index.update(driver_id, lat, lon, math.inf)
+            free.add(driver_id)
+            continue
+
+        pickup, dropoff = data
+        waves = WAVES[mode](args)
+        nearest = index.nearest(*pickup, args.k * waves, args.radius, now=now) if waves else []
+        plan = dispatch.plan_waves(nearest, args.k, waves)
+        # Волна w уходит в момент w * timeout, группа — после последней волны
+        taps = []
+        for number, wave in enumerate(plan):
+            taps += [(number * args.timeout + delay, driver_id)
+                     for delay, driver_id in responses(rnd, [d for _, d in wave], args.accept, args.response)]
+        group_at = len(plan) * args.timeout
+        taps.sort()
+        if not taps or taps[0][0] > group_at:
+            # В группу: предложенные в личку ещё могут нажать, остальные видят пост в группе
+            if plan:
+                fallbacks += 1
+            offered = {driver_id for _, driver_id in nearest}
+            messages += 1
+            notified += len(free - offered)
+            taps = sorted(taps + [(group_at + delay, driver_id) for delay, driver_id
+                                  in responses(rnd, free - offered, args.accept, args.response)])
+        winner = taps[0] if taps else None
+        # Волны после победы уже не отправляются
+        sent = sum(len(wave) for number, wave in enumerate(plan)
+                   if winner is None or number * args.timeout <= winner[0])
+        messages += sent
+        notified += sent
+
+        if winner is None or winner[0] > UNMATCHED_AFTER:
+            unmatched += 1
+            continue
+        latency, driver_id = winner
+        km = dispatch.haversine_km(*positions[driver_id], *pickup)
+        latencies.append(latency)
+        pickups.append(km)
+        free.discard(driver_id)
+        index.remove(driver_id)
+        trip_km = km + dispatch.haversine_km(*pickup, *dropoff)
+        seq += 1
+        heapq.heappush(events, (now + latency + trip_km / args.speed * 3600, seq, "free", (driver_id, dropoff)))
+
+    matched = len(latencies)
+    return {
+        "mode": mode,
+        "matched": matched / args.orders * 100,
+        "unmatched": unmatched,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p90": percentile(latencies, 90),
+        "pickup_mean": statistics.fmean(pickups) if pickups else float("nan"),
+        "pickup_p90": percentile(pickups, 90),
+        "messages": messages / args.orders,
+        "notified": notified / args.orders,
+        "fallbacks": fallbacks,
+    }
+
+
+def bench_index(args, seed: int):
+    """Поиск k ближайших: сетка против перебора, результаты должны совпасть"""
+    rnd = random.Random(seed)
+    hotspots = [random_point(rnd, [CENTER]) for _ in range(5)]
+    index = dispatch.GridIndex()
+    for driver_id in range(args.drivers):
+        index.update(driver_id, *random_point(rnd, hotspots), math.inf)
+    points = [random_point(rnd, hotspots) for _ in range(2000)]
+
+    timings = {}
+    results = {}
+    for name, search in (("сетка", index.nearest), ("перебор", index.brute_nearest)):
+        started = time.perf_counter()
+        results[name] = [search(lat, lon, args.k, args.radius, now=0) for lat, lon in points]
+        timings[name] = (time.perf_counter() - started) / len(points) * 1e6
+    mismatches = sum(
+        [driver_id for _, driver_id in a] != [driver_id for _, driver_id in b]
+        for a, b in zip(results["сетка"], results["перебор"])
+    )
+    print(f"Поиск {args.k} ближайших среди {args.drivers} водителей: сетка {timings['сетка']:.1f} мкс, "
+          f"перебор {timings['перебор']:.1f} мкс, расхождений {mismatches} из {len(points)}")
+    return mismatches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Симуляция: группа против k ближайших водителей")
+    parser.add_argument("--drivers", type=int, default=200)
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument("--rate", type=float, default=6, help="заказов в минуту")
+    parser.add_argument("--k", type=int, default=dispatch.DISPATCH_K)
+    parser.add_argument("--radius", type=float, default=dispatch.DISPATCH_RADIUS_KM, help="км")
+    parser.add_argument("--waves", type=int, default=dispatch.DISPATCH_WAVES)
+    parser.add_argument("--timeout", type=float, default=dispatch.DISPATCH_OFFER_TIMEOUT, help="секунд на волну")
+    parser.add_argument("--accept", type=float, default=0.3, help="вероятность, что водитель возьмёт заказ")
+    parser.add_argument("--response", type=float, default=10, help="среднее время отклика, секунд")
+    parser.add_argument("--speed", type=float, default=30, help="км/ч")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'режим':<10}{'принято':>9}{'потеряно':>10}{'отклик p50':>12}{'p90':>9}"
+          f"{'подача ср.':>12}{'p90':>10}{'сообщ./заказ':>14}{'увидели':>9}{'в группу':>10}")
+    for mode in WAVES:
+        r = simulate(mode, args, args.seed)
+        print(f"{r['mode']:<10}{r['matched']:>8.1f}%{r['unmatched']:>10}{r['latency_p50']:>10.1f} с"
+              f"{r['latency_p90']:>7.1f} с{r['pickup_mean']:>9.2f} км{r['pickup_p90']:>7.2f} км"
+              f"{r['messages']:>14.2f}{r['notified']:>9.1f}{r['fallbacks']:>10}")
+    bench_index(args, args.seed)
@@ -1,35 +1,377 @@
 # stats.py — консольная статистика
+#
+#   python stats.py                 # выручка по водителям за всё время
+#   python stats.py --period week --from 2026-10-01 --to 2026-10-31
+#   python stats.py --check         # сверить отчёты с orders
+#   python stats.py --rebuild       # пересобрать отчёты с нуля
+#   python stats.py --check-daily   # сверить daily_driver_stats с orders
+#   python stats.py --rebuild-daily # пересобрать daily_driver_stats из orders
+#   python stats.py --rebuild-ratings # пересобрать рейтинги водителей из оценок заказов
+#   python stats.py --export orders --from 2026-01-01 --to 2026-12-31 --out orders.csv
+#   python stats.py --export settlements --from 2026-10-01 --to 2026-10-31 > settlements.csv
+#
+# Отчёты инкрементальные: итоги по периодам лежат в report_totals, контрольная
+# точка — id последнего учтённого события order_events. Каждый запуск доучитывает
+# только заказы, по которым после неё были события, поэтому время работы зависит
+# от числа новых изменений, а не от размера orders. Если журнал уже почищен
+# дальше контрольной точки (отчёты долго не запускали), они пересобираются.
+import argparse
+import asyncio
+import contextlib
 import sqlite3
+import sys
+import time
+
+import aiosqlite
+
+from db import (
+    BUSY_TIMEOUT_MS,
+    DAILY_STATS_CHECK_SQL,
+    DAILY_STATS_CLEAR_SQL,
+    DAILY_STATS_FROM_ORDERS_SQL,
+    DAILY_STATS_REBUILD_SQL,
+    SCHEMA_VERSION,
+    migrate,
+    rebuild_rating_aggregates,
+)
+from export import orders_csv, settlements_csv
 
 DB_PATH = "taxi.db"
 DRIVER_PERCENT = 0.8  # 80% водителю; поменяй при необходимости
+SERVICE_PERCENT = 0.2  # 20% сервису
+EXPORTS = {"orders": orders_csv, "settlements": settlements_csv}
+PERIODS = ("day", "week", "month")
+# Начало периода, в который попадает дата {day}; неделя начинается с понедельника
+PERIOD_START_SQL = {
+    "day": "{day}",
+    "week": "DATE({day}, 'weekday 0', '-6 days')",
+    "month": "strftime('%Y-%m-01', {day})",
+}
+
+# ---------------------
+# Свёртка заказов в report_totals
+# ---------------------
+# Вклад заказа в отчёты — по тем же правилам, что daily_driver_stats
+REPORT_FOLD_SQL = """
+    INSERT INTO report_folded (order_id, day, driver_id, completed, revenue, rating_sum, rating_count)
+    SELECT id,
+           DATE(created_at),
+           COALESCE(driver_id, 0),
+           COALESCE(completed, 0) = 1,
+           CASE WHEN status = 'accepted' OR COALESCE(completed, 0) = 1 THEN COALESCE(price, 0) ELSE 0 END,
+           COALESCE(rating, 0),
+           COALESCE(rating, 0) > 0
+    FROM orders
+    {where}
+"""
+
+# Прибавить (sign='+') или вычесть (sign='-') вклад заказов во все три периода
+REPORT_TOTALS_SQL = f"""
+    INSERT INTO report_totals (period, start, driver_id, orders, completed, revenue, rating_sum, rating_count)
+    SELECT p.period,
+           CASE p.period
+               WHEN 'day' THEN {PERIOD_START_SQL["day"].format(day="f.day")}
+               WHEN 'week' THEN {PERIOD_START_SQL["week"].format(day="f.day")}
+               ELSE {PERIOD_START_SQL["month"].format(day="f.day")}
+           END,
+           f.driver_id,
+           {{sign}}COUNT(*), {{sign}}SUM(f.completed), {{sign}}SUM(f.revenue),
+           {{sign}}SUM(f.rating_sum), {{sign}}SUM(f.rating_count)
+    FROM report_folded f
+    CROSS JOIN (SELECT 'day' AS period UNION ALL SELECT 'week' UNION ALL SELECT 'month') p
+    WHERE f.day IS NOT NULL {{where}}
+    GROUP BY 1, 2, 3
+    ON CONFLICT(period, start, driver_id) DO UPDATE SET
+        orders = orders + excluded.orders,
+        completed = completed + excluded.completed,
+        revenue = revenue + excluded.revenue,
+        rating_sum = rating_sum + excluded.rating_sum,
+        rating_count = rating_count + excluded.rating_count
+"""
+_AFFECTED = "IN (SELECT order_id FROM temp.report_affected)"
+
+# Дневные итоги отчётов против сырой orders (нулевые строки не в счёт)
+REPORT_CHECK_SQL = f"""
+    WITH raw AS ({DAILY_STATS_FROM_ORDERS_SQL}),
+    agg AS (
+        SELECT start AS day, driver_id, orders, completed, revenue, rating_sum, rating_count
+        FROM report_totals
+        WHERE period = 'day'
+          AND (orders != 0 OR completed != 0 OR revenue != 0 OR rating_sum != 0 OR rating_count != 0)
+    )
+    SELECT 'orders' AS side, * FROM (SELECT * FROM raw EXCEPT SELECT * FROM agg)
+    UNION ALL
+    SELECT 'report_totals' AS side, * FROM (SELECT * FROM agg EXCEPT SELECT * FROM raw)
+    ORDER BY day, driver_id, side
+"""
+
+
+def _journal_gap(conn, last_event_id: int) -> bool:
+    """Есть ли события после контрольной точки, которых в журнале уже нет"""
+    seq = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'order_events'").fetchone()
+    if seq is None or seq[0] <= last_event_id:
+        return False
+    first = conn.execute("SELECT MIN(id) FROM order_events").fetchone()[0]
+    return first is None or first > last_event_id + 1
+
+
+def _rebuild(conn) -> int:
+    conn.execute("DELETE FROM report_totals")
+    conn.execute("DELETE FROM report_folded")
+    conn.execute(REPORT_FOLD_SQL.format(where=""))
+    conn.execute(REPORT_TOTALS_SQL.format(sign="+", where=""))
+    return conn.execute("SELECT COUNT(*) FROM report_folded").fetchone()[0]
+
+
+def _fold(conn, last_event_id: int) -> int:
+    """Переучесть заказы с событиями после last_event_id: вычесть старый вклад, прибавить новый"""
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS report_affected (order_id INTEGER PRIMARY KEY)")
+    conn.execute("DELETE FROM temp.report_affected")
+    conn.execute(
+        "INSERT OR IGNORE INTO temp.report_affected SELECT order_id FROM order_events WHERE id > ?",
+        (last_event_id,),
+    )
+    affected = conn.execute("SELECT COUNT(*) FROM temp.report_affected").fetchone()[0]
+    if affected:
+        conn.execute(REPORT_TOTALS_SQL.format(sign="-", where="AND f.order_id " + _AFFECTED))
+        conn.execute("DELETE FROM report_folded WHERE order_id " + _AFFECTED)
+        conn.execute(REPORT_FOLD_SQL.format(where="WHERE id " + _AFFECTED))
+        conn.execute(REPORT_TOTALS_SQL.format(sign="+", where="AND f.order_id " + _AFFECTED))
+    return affected
+
+
+def update_reports(conn, rebuild: bool = False) -> str:
+    """Довести report_totals до текущего состояния orders; возвращает строку для лога"""
+    started = time.perf_counter()
+    conn.execute("BEGIN IMMEDIATE")  # пока сворачиваем, бот не меняет ни orders, ни журнал
+    try:
+        row = conn.execute("SELECT last_event_id FROM report_checkpoint WHERE id = 1").fetchone()
+        last_event_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM order_events").fetchone()[0]
+        if rebuild or row is None or _journal_gap(conn, row[0]):
+            done = f"пересобрано заказов: {_rebuild(conn)}"
+        else:
+            done = f"доучтено заказов: {_fold(conn, row[0])}"
+        conn.execute(
+            "INSERT INTO report_checkpoint (id, last_event_id) VALUES (1, ?) "
+            "ON CONFLICT(id) DO UPDATE SET last_event_id = excluded.last_event_id, updated_at = CURRENT_TIMESTAMP",
+            (last_event_id,),
+        )
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return f"Отчёты обновлены, {done}, {(time.perf_counter() - started) * 1000:.1f} мс"
+
+
+async def _migrate(path: str):
+    conn = await aiosqlite.connect(path, isolation_level=None)
+    try:
+        await conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        conn.row_factory = aiosqlite.Row
+        await migrate(conn)
+    finally:
+        await conn.close()
+
+
+def connect(path: str = DB_PATH):
+    """
+    Соединение с базой, схема которой доведена до версии бота: свежая база или
+    taxi.db, которую бот ещё не мигрировал, получают те же таблицы (включая
+    report_*), что создал бы db.init_db.
+    """
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+        # Лог миграций — в stderr: stdout может быть CSV-выгрузкой
+        with contextlib.redirect_stdout(sys.stderr):
+            asyncio.run(_migrate(path))
+    return conn
+
+# ---------------------
+# Вывод отчётов
+# ---------------------
+_DRIVER_NAME = """
+    CASE WHEN t.driver_id = 0 THEN 'Без водителя'
+         ELSE COALESCE(d.name, CAST(t.driver_id AS TEXT)) END
+"""
 
-def show_stats():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT COALESCE(driver_name, CAST(driver_id AS TEXT)) as driver,
-               COUNT(*) as cnt,
-               COALESCE(SUM(price),0) as total
-        FROM orders
-        WHERE status='accepted'
-        GROUP BY driver
-        ORDER BY total DESC
-    """)
-    rows = cur.fetchall()
+
+def report_rows(conn, period: str = None, date_from: str = "", date_to: str = ""):
+    """
+    (начало периода, водитель, заказов, выполнено, выручка) с именами из drivers.
+    Без period — итоги за всё время (сумма помесячных), начало периода пустое.
+    date_from/date_to выбирают периоды, которые пересекаются с [date_from, date_to]:
+    неделя или месяц, начатые до date_from, тоже попадают в отчёт.
+    """
+    if not period:
+        return conn.execute(f"""
+            SELECT '', {_DRIVER_NAME}, SUM(t.orders), SUM(t.completed), SUM(t.revenue) AS total
+            FROM report_totals t
+            LEFT JOIN drivers d ON d.id = t.driver_id
+            WHERE t.period = 'month'
+            GROUP BY t.driver_id
+            HAVING SUM(t.orders) > 0
+            ORDER BY total DESC
+        """).fetchall()
+
+    conditions = ["t.period = ?", "t.orders > 0"]
+    params = [period]
+    if date_from:
+        conditions.append(f"t.start >= {PERIOD_START_SQL[period].format(day='?')}")
+        params.append(date_from)
+    if date_to:
+        conditions.append("t.start <= ?")
+        params.append(date_to)
+    return conn.execute(f"""
+        SELECT t.start, {_DRIVER_NAME}, t.orders, t.completed, t.revenue
+        FROM report_totals t
+        LEFT JOIN drivers d ON d.id = t.driver_id
+        WHERE {" AND ".join(conditions)}
+        ORDER BY t.start DESC, t.revenue DESC
+    """, params).fetchall()
+
+
+def show_stats(path: str = DB_PATH, period: str = None, date_from: str = "", date_to: str = ""):
+    conn = connect(path)
+    print(update_reports(conn), file=sys.stderr)
+    rows = report_rows(conn, period, date_from, date_to)
     conn.close()
 
     if not rows:
-        print("Нет принятых заказов для расчёта.")
+        print("Нет заказов для расчёта.")
         return
 
     print("Статистика по водителям:\n")
-    for driver, cnt, total in rows:
+    current = None
+    for start, driver, cnt, completed, total in rows:
+        if start and start != current:
+            current = start
+            print(f"📅 {start}")
+        indent = "  " if start else ""
         driver_share = int(total * DRIVER_PERCENT)
-        service_share = int(total - driver_share)
-        print(f"{driver}: {cnt} заказ(ов), всего {total} ₸")
-        print(f"  → Водителю: {driver_share} ₸")
-        print(f"  → Сервису:  {service_share} ₸\n")
+        service_share = int(total * SERVICE_PERCENT)
+        print(f"{indent}{driver}: {cnt} заказ(ов), выполнено {completed}, всего {total} ₸")
+        print(f"{indent}  → Водителю: {driver_share} ₸")
+        print(f"{indent}  → Сервису:  {service_share} ₸\n")
+
+
+def check_reports(path: str = DB_PATH) -> bool:
+    """Обновить отчёты и сверить дневные итоги с orders; True — расхождений нет"""
+    conn = connect(path)
+    print(update_reports(conn))
+    rows = conn.execute(REPORT_CHECK_SQL).fetchall()
+    conn.close()
+    if not rows:
+        print("report_totals сходится с orders ✅")
+        return True
+    print(f"Расхождений: {len(rows)} (день, водитель: заказы, завершено, выручка, сумма оценок, оценок)")
+    for side, day, driver_id, *counters in rows:
+        print(f"  {side:<14} {day} водитель {driver_id}: {counters}")
+    print("Пересоберите отчёты: python stats.py --rebuild")
+    return False
+
+
+def rebuild_reports(path: str = DB_PATH):
+    conn = connect(path)
+    print(update_reports(conn, rebuild=True))
+    conn.close()
+
+# ---------------------
+# Дневные агрегаты и выгрузка
+# ---------------------
+def check_daily(path: str = DB_PATH) -> bool:
+    """Сверить дневные агрегаты с сырой таблицей orders; True — расхождений нет"""
+    conn = connect(path)
+    rows = conn.execute(DAILY_STATS_CHECK_SQL).fetchall()
+    conn.close()
+    if not rows:
+        print("daily_driver_stats сходится с orders ✅")
+        return True
+    print(f"Расхождений: {len(rows)} (день, водитель: заказы, завершено, выручка, сумма оценок, оценок)")
+    for side, day, driver_id, *counters in rows:
+        print(f"  {side:<18} {day} водитель {driver_id}: {counters}")
+    print("Пересоберите агрегаты: python stats.py --rebuild-daily")
+    return False
+
+def rebuild_daily(path: str = DB_PATH):
+    """Пересобрать дневные агрегаты одной транзакцией (бот может работать)"""
+    conn = connect(path)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(DAILY_STATS_CLEAR_SQL)
+        conn.execute(DAILY_STATS_REBUILD_SQL)
+        days = conn.execute("SELECT COUNT(DISTINCT day) FROM daily_driver_stats").fetchone()[0]
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    print(f"daily_driver_stats пересобрана: {days} дн.")
+
+async def _rebuild_ratings(path: str) -> int:
+    conn = await aiosqlite.connect(path, isolation_level=None)
+    try:
+        await conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        await conn.execute("BEGIN IMMEDIATE")
+        try:
+            await rebuild_rating_aggregates(conn)
+        except BaseException:
+            await conn.execute("ROLLBACK")
+            raise
+        await conn.execute("COMMIT")
+        cur = await conn.execute("SELECT COUNT(*) FROM drivers WHERE rating_count > 0")
+        return (await cur.fetchone())[0]
+    finally:
+        await conn.close()
+
+def rebuild_ratings(path: str = DB_PATH):
+    """
+    Пересобрать рейтинги водителей из orders.rating одной транзакцией.
+    Работающий бот увидит новые значения, когда истечёт его кэш водителей.
+    """
+    connect(path).close()  # схема — до версии бота
+    drivers = asyncio.run(_rebuild_ratings(path))
+    print(f"Рейтинги пересобраны: водителей с оценками — {drivers}.")
+
+def export_csv(kind: str, date_from: str, date_to: str, out: str = None, path: str = DB_PATH):
+    """Выгрузить CSV в файл (или stdout) по кускам — память не растёт с периодом"""
+    conn = connect(path)
+    stream = open(out, "w", encoding="utf-8", newline="") if out else sys.stdout
+    try:
+        for chunk in EXPORTS[kind](conn, date_from, date_to, DRIVER_PERCENT, SERVICE_PERCENT):
+            stream.write(chunk)
+    finally:
+        if out:
+            stream.close()
+        conn.close()
 
 if __name__ == "__main__":
-    show_stats()
+    parser = argparse.ArgumentParser(description="Статистика такси")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--period", choices=PERIODS, help="итоги по дням/неделям/месяцам")
+    parser.add_argument("--check", action="store_true", help="сверить отчёты с orders")
+    parser.add_argument("--rebuild", action="store_true", help="пересобрать отчёты с нуля")
+    parser.add_argument("--check-daily", action="store_true", help="сверить дневные агрегаты с orders")
+    parser.add_argument("--rebuild-daily", action="store_true", help="пересобрать дневные агрегаты")
+    parser.add_argument("--rebuild-ratings", action="store_true", help="пересобрать рейтинги водителей")
+    parser.add_argument("--export", choices=sorted(EXPORTS), help="выгрузить CSV")
+    parser.add_argument("--from", dest="date_from", default="",
+                        help="начало интервала, ГГГГ-ММ-ДД; с --period — и весь период, в который оно попадает")
+    parser.add_argument("--to", dest="date_to", default="", help="конец интервала включительно, ГГГГ-ММ-ДД")
+    parser.add_argument("--out", help="файл CSV (по умолчанию stdout)")
+    args = parser.parse_args()
+    if args.export:
+        export_csv(args.export, args.date_from, args.date_to, args.out, args.db)
+    elif args.rebuild_ratings:
+        rebuild_ratings(args.db)
+    elif args.rebuild_daily:
+        rebuild_daily(args.db)
+    elif args.check_daily:
+        raise SystemExit(0 if check_daily(args.db) else 1)
+    elif args.check:
+        raise SystemExit(0 if check_reports(args.db) else 1)
+    elif args.rebuild:
+        rebuild_reports(args.db)
+    else:
+        show_stats(args.db, args.period, args.date_from, args.date_to)
@@ -0,0 +1,241 @@
+# stats_data.py — слой данных stats_gui.py без Tk.
+# Таблица показывает не все заказы, а окно вокруг видимых строк: OrderSource
+# читает строки по позиции (0 — самый новый заказ), OrderTable помнит окно и
+# отдаёт Treeview только разницу (какие строки удалить, вставить, поправить),
+# Loader выполняет чтение в фоновом потоке, чтобы интерфейс не замирал.
+#
+#   python stats_data.py --db taxi.db   # прогон без GUI: загрузка, прокрутка, обновление
+import argparse
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+DB_PATH = os.getenv("DB_PATH", "taxi.db")
+VISIBLE_ROWS = 30   # строк на экране
+WINDOW_BUFFER = 50  # строк про запас сверху и снизу окна
+ANCHORS_MAX = 256   # опорных точек в памяти; дольше всех не нужные вытесняются
+
+COLUMNS = ("id", "from_addr", "to_addr", "price", "phone", "status", "driver_id", "created_at")
+_SELECT = f"SELECT {', '.join(COLUMNS)} FROM orders"
+
+
+# ---------------------
+# Чтение orders по позициям
+# ---------------------
+class OrderSource:
+    """
+    Заказы от новых к старым по позиции в списке. Соединение открывается
+    в потоке, который первым читает, — читать дальше нужно из него же.
+    """
+
+    def __init__(self, path: str = DB_PATH):
+        self.path = path
+        self._conn = None
+        # Опорные точки позиция → id: окно рядом с известной точкой читается по id,
+        # без OFFSET от начала таблицы. LRU на ANCHORS_MAX точек: долгая прокрутка
+        # не копит их без предела
+        self._anchors = OrderedDict()
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path)
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def data_version(self) -> int:
+        """Меняется, только когда БД закоммитил кто-то другой (бот)"""
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def count(self):
+        """(всего заказов, максимальный id)"""
+        self._anchors.clear()
+        return self.conn.execute("SELECT COUNT(*), COALESCE(MAX(id), 0) FROM orders").fetchone()
+
+    def count_newer(self, max_id: int):
+        """(сколько заказов новее max_id, новый максимальный id); позиции старых сдвигаются"""
+        count, newest = self.conn.execute(
+            "SELECT COUNT(*), COALESCE(MAX(id), ?) FROM orders WHERE id > ?", (max_id, max_id)
+        ).fetchone()
+        if count:
+            self._anchors = OrderedDict(
+                (position + count, order_id) for position, order_id in self._anchors.items()
+            )
+        return count, newest
+
+    def window(self, offset: int, limit: int) -> list:
+        """Строки с позиции offset"""
+        anchor = max((p for p in self._anchors if p <= offset), default=None)
+        if anchor is None:
+            rows = self.conn.execute(f"{_SELECT} ORDER BY id DESC LIMIT ? OFFSET ?", (limit, offset)).fetchall()
+        else:
+            self._anchors.move_to_end(anchor)
+            rows = self.conn.execute(
+                f"{_SELECT} WHERE id <= ? ORDER BY id DESC LIMIT ? OFFSET ?",
+                (self._anchors[anchor], limit, offset - anchor),
+            ).fetchall()
+        if rows:
+            self._anchors[offset] = rows[0][0]
+            self._anchors.move_to_end(offset)
+            if len(self._anchors) > ANCHORS_MAX:
+                self._anchors.popitem(last=False)
+        return rows
+
+
+# ---------------------
+# Окно таблицы
+# ---------------------
+class Patch(NamedTuple):
+    """Что поменять в Treeview: строки окна идентифицируются по id заказа"""
+    total: int      # всего заказов
+    offset: int     # позиция первой строки окна
+    deleted: list   # id строк, ушедших из окна
+    inserted: list  # (индекс в окне, строка) по возрастанию индекса
+    updated: list   # строки, у которых поменялись поля (статус, водитель…)
+    added: int = 0  # новых заказов с прошлого обновления — на столько сдвинулись позиции
+
+
+class OrderTable:
+    """
+    Какие заказы сейчас в окне и что поменять после прокрутки или обновления.
+    Ни Tk, ни потоков: все методы вызываются из одного потока (Loader).
+    """
+
+    def __init__(self, source: OrderSource, visible: int = VISIBLE_ROWS, buffer: int = WINDOW_BUFFER):
+        self.source = source
+        self.visible = visible
+        self.buffer = buffer
+        self.total = 0
+        self.offset = 0
+        self.rows = []
+        self.max_id = 0
+        self._version = None
+
+    @property
+    def size(self) -> int:
+        return self.visible + 2 * self.buffer
+
+    def load(self) -> Patch:
+        """Первая загрузка (и полная перезагрузка): счётчики с нуля и окно с начала"""
+        self._version = self.source.data_version()
+        self.total, self.max_id = self.source.count()
+        self.offset = 0
+        return self._diff(self.source.window(0, self.size))
+
+    def scroll_to(self, first_visible: int):
+        """Окно под видимые строки с позиции first_visible; None — уже загружены"""
+        first_visible = max(0, min(first_visible, self.total - self.visible))
+        end = min(first_visible + self.visible, self.total)
+        if self.rows and self.offset <= first_visible and end <= self.offset + len(self.rows):
+            return None
+        self.offset = max(0, first_visible - self.buffer)
+        return self._diff(self.source.window(self.offset, self.size))
+
+    def refresh(self):
+        """
+        Доучесть изменения в БД; None — ничего не менялось. Новые заказы появляются
+        сверху, если окно у начала списка, иначе окно остаётся на тех же заказах.
+        """
+        version = self.source.data_version()
+        if version == self._version:
+            return None
+        self._version = version
+        added, self.max_id = self.source.count_newer(self.max_id)
+        self.total += added
+        if self.offset > 0:
+            self.offset += added
+        return self._diff(self.source.window(self.offset, self.size), added)
+
+    def _diff(self, rows: list, added: int = 0) -> Patch:
+        old = {row[0]: row for row in self.rows}
+        new_ids = {row[0] for row in rows}
+        patch = Patch(
+            total=self.total,
+            offset=self.offset,
+            deleted=[order_id for order_id in old if order_id not in new_ids],
+            inserted=[(index, row) for index, row in enumerate(rows) if row[0] not in old],
+            updated=[row for row in rows if row[0] in old and old[row[0]] != row],
+            added=added,
+        )
+        self.rows = rows
+        return patch
+
+
+# ---------------------
+# Фоновое чтение
+# ---------------------
+class Loader:
+    """
+    Один фоновый поток для всех чтений БД. Задачи с одним ключом схлопываются:
+    из нескольких прокруток подряд выполняется только последняя. Результат (или
+    исключение) отдаётся в deliver(callback, result) — GUI передаёт туда функцию,
+    которая перекладывает его в главный поток Tk.
+    """
+
+    def __init__(self, deliver):
+        self._deliver = deliver
+        self._pending = OrderedDict()  # ключ → (функция, callback)
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="stats-loader", daemon=True)
+        self._thread.start()
+
+    def submit(self, key, fn, callback):
+        with self._cond:
+            self._pending.pop(key, None)
+            self._pending[key] = (fn, callback)
+            self._cond.notify()
+
+    def close(self, timeout: float = 1.0):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                _, (fn, callback) = self._pending.popitem(last=False)
+            try:
+                result = fn()
+            except Exception as e:
+                result = e
+            self._deliver(callback, result)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Слой данных stats_gui без GUI")
+    parser.add_argument("--db", default=DB_PATH)
+    args = parser.parse_args()
+
+    table = OrderTable(OrderSource(args.db))
+
+    def timed(name, fn):
+        started = time.perf_counter()
+        patch = fn()
+        elapsed = (time.perf_counter() - started) * 1000
+        if patch is None:
+            print(f"{name:<28}{elapsed:8.2f} мс  без изменений")
+        else:
+            print(f"{name:<28}{elapsed:8.2f} мс  всего {patch.total}, окно с {patch.offset}: "
+                  f"-{len(patch.deleted)} +{len(patch.inserted)} ~{len(patch.updated)}")
+
+    timed("загрузка", table.load)
+    timed("прокрутка на 20 строк", lambda: table.scroll_to(20))
+    timed("прокрутка на 100 строк", lambda: table.scroll_to(100))
+    timed("прыжок в середину", lambda: table.scroll_to(table.total // 2))
+    timed("прокрутка на 100 строк", lambda: table.scroll_to(table.total // 2 + 100))
+    timed("прыжок в конец", lambda: table.scroll_to(table.total))
+    timed("обновление", table.refresh)
+    table.source.close()
@@ -1,43 +1,127 @@
-import sqlite3
+import queue
 import tkinter as tk
 from tkinter import ttk
 
-DB_PATH = r"C:\Users\Daulet\Desktop\LENGER TAXI24 BOT\taxi.db"
+from stats_data import DB_PATH, VISIBLE_ROWS, Loader, OrderSource, OrderTable
 
-def load_data():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT id, from_addr, to_addr, price, phone, status, driver_id, created_at FROM orders")
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+AUTO_REFRESH_MS = 3000  # как часто проверять новые заказы
+POLL_MS = 30            # как часто забирать результаты фонового потока
+
+# Результаты фонового потока; Tk трогаем только из главного потока
+results = queue.Queue()
+loader = Loader(lambda callback, result: results.put((callback, result)))
+table = OrderTable(OrderSource(DB_PATH))
+# Состояние того, что уже показано; table меняется в фоновом потоке, поэтому здесь копии
+first_visible = 0  # позиция верхней видимой строки во всём списке
+window_offset = 0  # позиция первой строки Treeview
+total_orders = 0
+
+def apply_patch(patch):
+    """Поправить в Treeview только то, что изменилось в окне"""
+    global first_visible, window_offset, total_orders
+    if patch is None:
+        return
+    if isinstance(patch, Exception):
+        status.set(f"Ошибка чтения БД: {patch}")
+        return
+    for order_id in patch.deleted:
+        tree.delete(order_id)
+    for index, row in patch.inserted:
+        tree.insert("", index, iid=row[0], values=row)
+    for row in patch.updated:
+        tree.item(row[0], values=row)
+    # Новые заказы сверху сдвигают позиции: кто листает список, остаётся на тех же заказах,
+    # кто смотрит в самое начало — видит новые
+    if first_visible > 0:
+        first_visible += patch.added
+    window_offset = patch.offset
+    total_orders = patch.total
+    # Сохраняем верхнюю видимую строку на месте, хотя окно сдвинулось
+    first_visible = max(0, min(first_visible, total_orders - 1))
+    rows = len(tree.get_children())
+    if rows:
+        tree.yview_moveto((first_visible - window_offset) / rows)
+    update_scrollbar()
+    status.set(f"Заказов: {patch.total}")
+
+def update_scrollbar():
+    total = max(total_orders, 1)
+    scrollbar.set(first_visible / total, min(1.0, (first_visible + VISIBLE_ROWS) / total))
+
+def scroll_to(position):
+    """Запомнить позицию и догрузить окно в фоне, если видимые строки за его краем"""
+    global first_visible
+    first_visible = max(0, min(int(position), total_orders - VISIBLE_ROWS))
+    update_scrollbar()
+    target = first_visible
+    loader.submit("scroll", lambda: table.scroll_to(target), apply_patch)
+
+def on_scrollbar(action, value, unit=None):
+    if action == "moveto":
+        scroll_to(float(value) * total_orders)
+    elif action == "scroll":
+        step = VISIBLE_ROWS if unit == "pages" else 1
+        scroll_to(first_visible + int(value) * step)
+
+def on_tree_scroll(lo, hi):
+    """Treeview прокрутился внутри окна (колесо, клавиши) — пересчитать позицию"""
+    rows = len(tree.get_children())
+    if not rows:
+        return
+    position = window_offset + round(float(lo) * rows)
+    if position != first_visible:
+        scroll_to(position)
 
 def refresh_table():
-    # очистка
-    for row in tree.get_children():
-        tree.delete(row)
-    # загрузка новых данных
-    for row in load_data():
-        tree.insert("", tk.END, values=row)
+    loader.submit("refresh", table.refresh, apply_patch)
+
+def auto_refresh():
+    refresh_table()
+    root.after(AUTO_REFRESH_MS, auto_refresh)
+
+def poll_results():
+    while True:
+        try:
+            callback, result = results.get_nowait()
+        except queue.Empty:
+            break
+        callback(result)
+    root.after(POLL_MS, poll_results)
+
+def on_close():
+    loader.close()
+    root.destroy()
 
 root = tk.Tk()
 root.title("Статистика заказов такси")
 
-# таблица
+# таблица: в Treeview только окно строк, полоса прокрутки — по всему списку
+frame = tk.Frame(root)
+frame.pack(fill=tk.BOTH, expand=True)
+
 columns = ("ID", "Откуда", "Куда", "Цена", "Телефон", "Статус", "ID водителя", "Создано")
-tree = ttk.Treeview(root, columns=columns, show="headings")
+tree = ttk.Treeview(frame, columns=columns, show="headings", height=VISIBLE_ROWS,
+                    yscrollcommand=on_tree_scroll)
 
 for col in columns:
     tree.heading(col, text=col)
     tree.column(col, width=120)
 
-tree.pack(fill=tk.BOTH, expand=True)
+scrollbar = ttk.Scrollbar(frame, orient=tk.VERTICAL, command=on_scrollbar)
+scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+status = tk.StringVar(value="Загрузка…")
+tk.Label(root, textvariable=status, anchor=tk.W).pack(fill=tk.X, padx=5)
 
 # кнопка обновления
 btn_refresh = tk.Button(root, text="🔄 Обновить", command=refresh_table)
 btn_refresh.pack(pady=5)
 
-# загрузка при старте
-refresh_table()
+# загрузка при старте — тоже в фоне
+loader.submit("load", table.load, apply_patch)
+root.after(POLL_MS, poll_results)
+root.after(AUTO_REFRESH_MS, auto_refresh)
+root.protocol("WM_DELETE_WINDOW", on_close)
 
 root.mainloop()
@@ -0,0 +1,57 @@
+# stress_claims.py — нагрузочная проверка захвата заказов:
+# N водителей одновременно жмут «Қабылдау» на каждый заказ,
+# победитель должен быть ровно один.
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+import db
+
+
+async def run(orders: int, drivers: int, seed: int):
+    rnd = random.Random(seed)
+    tmp = tempfile.TemporaryDirectory()
+    await db.init_db(os.path.join(tmp.name, "stress.db"))
+
+    order_ids = [
+        await db.insert_order("A", "B", 500, "+77070000000", 1) for _ in range(orders)
+    ]
+
+    async def tap(order_id, driver_id):
+        # Небольшой разброс, чтобы нажатия перемешались между заказами
+        await asyncio.sleep(rnd.random() / 1000)
+        return order_id, driver_id, await db.claim_order(order_id, driver_id)
+
+    taps = [tap(o, 1000 + d) for o in order_ids for d in range(drivers)]
+    rnd.shuffle(taps)
+    started = time.perf_counter()
+    results = await asyncio.gather(*taps)
+    elapsed = time.perf_counter() - started
+
+    winners = {}
+    for order_id, driver_id, row in results:
+        if row is not None:
+            assert order_id not in winners, f"заказ #{order_id}: два победителя"
+            winners[order_id] = driver_id
+    assert len(winners) == orders, "у некоторых заказов нет победителя"
+
+    for order_id, driver_id in winners.items():
+        row = await db.get_order(order_id, cached=False)
+        assert row["status"] == "accepted" and row["driver_id"] == driver_id, f"заказ #{order_id}: БД расходится"
+
+    await db.close_db()
+    tmp.cleanup()
+    print(f"{orders} заказов × {drivers} водителей: {len(results)} нажатий за {elapsed:.3f} с, "
+          f"ровно один победитель у каждого заказа ✅")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Стресс-тест захвата заказов")
+    parser.add_argument("--orders", type=int, default=200)
+    parser.add_argument("--drivers", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    asyncio.run(run(args.orders, args.drivers, args.seed))
@@ -0,0 +1,186 @@
+# supervisor.py — бот на нескольких процессах.
+# Супервизор сам опрашивает getUpdates и раздаёт апдейты N процессам-воркерам
+# по хэшу id пользователя: все шаги одного пассажира обрабатывает один воркер,
+# поэтому порядок FSM сохраняется. Каждый воркер — полноценный bot.py со своим
+# соединением к taxi.db; общие операции (захват заказа accept_) решает база:
+# UPDATE ... WHERE status='new' проходит ровно у одного процесса.
+# Смену водителя (/online, /offline, геолокация) проверяет воркер водителя и
+# передаёт остальным через их очереди смен — отдельные от апдейтов и без
+# лимита: изменение не теряется, даже когда воркер завален апдейтами, а
+# применяется к реестру без диспетчера.
+#
+#   BOT_WORKERS=4 python supervisor.py
+import asyncio
+import multiprocessing
+import os
+import signal
+
+from aiogram import Bot
+from aiogram.bot.api import TelegramAPIServer, TELEGRAM_PRODUCTION
+from aiogram.utils.exceptions import NetworkError
+from dotenv import load_dotenv
+
+load_dotenv()
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", str(os.cpu_count() or 2)))
+WORKER_QUEUE_SIZE = 1000  # апдейтов в очереди одного воркера
+POLL_TIMEOUT = 20         # long polling, секунд
+WORKER_START_TIMEOUT = 60  # ожидание готовности воркеров, секунд
+
+
+# ---------------------
+# Воркер
+# ---------------------
+def worker_main(index: int, workers: int, updates: multiprocessing.Queue, presence: list, ready):
+    """Точка входа процесса-воркера"""
+    # Лимиты Telegram общие на бота — делим их между воркерами
+    import send_scheduler
+    for name, default in (("SEND_GLOBAL_RATE", send_scheduler.GLOBAL_RATE),
+                          ("SEND_GROUP_RATE", send_scheduler.GROUP_RATE)):
+        os.environ[name] = str(float(os.getenv(name, default)) / workers)
+    # Таймеры открытых заказов после рестарта поднимает воркер их пассажира
+    os.environ["BOT_SHARD"] = f"{index}/{workers}"
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # останавливает супервизор
+    asyncio.run(_worker(index, updates, presence, ready))
+
+
+async def _worker(index: int, updates: multiprocessing.Queue, presence: list, ready):
+    import bot as taxi_bot
+    from webhook import UpdatePool
+
+    inbox = presence[index]
+    peers = [q for i, q in enumerate(presence) if i != index]
+
+    def share_presence(change: dict):
+        # Очередь без лимита: put не ждёт в цикле событий и сохраняет порядок изменений
+        for peer in peers:
+            peer.put(change)
+
+    async def apply_presence():
+        while True:
+            change = await loop.run_in_executor(None, inbox.get)
+            if change is None:
+                break
+            taxi_bot.apply_presence(change)
+
+    taxi_bot.share_presence = share_presence
+    await taxi_bot.on_startup(taxi_bot.dp)
+    pool = UpdatePool(taxi_bot.dp)
+    pool.start()
+    loop = asyncio.get_running_loop()
+    presence_task = asyncio.create_task(apply_presence())
+    ready.set()
+    print(f"Воркер {index} запущен (pid {os.getpid()})")
+    try:
+        while True:
+            data = await loop.run_in_executor(None, updates.get)
+            if data is None:
+                break
+            await pool.put(data)
+    finally:
+        inbox.put(None)
+        await presence_task
+        for peer in peers:
+            # Соседи могут быть уже остановлены — не ждать выхода из-за их очередей
+            peer.cancel_join_thread()
+        await pool.close()
+        await taxi_bot.on_shutdown(taxi_bot.dp)
+        await (await taxi_bot.bot.get_session()).close()
+        print(f"Воркер {index} остановлен")
+
+
+# ---------------------
+# Супервизор
+# ---------------------
+class Supervisor:
+    def __init__(self, workers: int = BOT_WORKERS):
+        self.workers = workers
+        self.routed = [0] * workers
+        self._ctx = multiprocessing.get_context("spawn")
+        self._queues = [self._ctx.Queue(WORKER_QUEUE_SIZE) for _ in range(workers)]
+        self._presence = [self._ctx.Queue() for _ in range(workers)]  # смены водителей, без лимита
+        self._procs = [None] * workers
+        self._ready = [self._ctx.Event() for _ in range(workers)]
+        self._stopping = False
+
+    def _spawn(self, index: int):
+        proc = self._ctx.Process(
+            target=worker_main, args=(index, self.workers, self._queues[index], self._presence, self._ready[index]),
+            name=f"bot-worker-{index}", daemon=True
+        )
+        proc.start()
+        self._procs[index] = proc
+
+    def _check_workers(self):
+        for index, proc in enumerate(self._procs):
+            if not proc.is_alive():
+                print(f"Воркер {index} упал (код {proc.exitcode}), перезапускаем")
+                self._spawn(index)
+
+    async def _route(self, update: dict):
+        from webhook import update_shard_key
+        index = update_shard_key(update) % self.workers
+        self.routed[index] += 1
+        queue = self._queues[index]
+        # put блокирует, если воркер не успевает — так держим backpressure
+        await asyncio.get_running_loop().run_in_executor(None, queue.put, update)
+
+    async def run(self, bot: Bot):
+        # Миграции один раз до запуска воркеров
+        import db
+        await db.init_db(os.getenv("DB_PATH", db.DB_PATH), write_pipeline=False)
+        await db.close_db()
+
+        for index in range(self.workers):
+            self._spawn(index)
+        loop = asyncio.get_running_loop()
+        for ready in self._ready:
+            await loop.run_in_executor(None, ready.wait, WORKER_START_TIMEOUT)
+
+        offset = 0
+        await bot.request("deleteWebhook", {"drop_pending_updates": True})
+        try:
+            while not self._stopping:
+                try:
+                    batch = await bot.request("getUpdates", {"offset": offset, "timeout": POLL_TIMEOUT})
+                except NetworkError as e:
+                    print(f"getUpdates: {e}")
+                    await asyncio.sleep(1)
+                    continue
+                for update in batch:
+                    await self._route(update)
+                    offset = update["update_id"] + 1
+                self._check_workers()
+        finally:
+            await self.shutdown()
+
+    def stop(self):
+        self._stopping = True
+
+    async def shutdown(self):
+        loop = asyncio.get_running_loop()
+        for queue in self._queues:
+            await loop.run_in_executor(None, queue.put, None)
+        for proc in self._procs:
+            if proc is not None:
+                await loop.run_in_executor(None, proc.join, 30)
+        print(f"Супервизор остановлен, апдейтов по воркерам: {self.routed}")
+
+
+async def main():
+    api_url = os.getenv("TELEGRAM_API_URL")
+    bot = Bot(
+        token=os.getenv("BOT_TOKEN"),
+        server=TelegramAPIServer.from_base(api_url) if api_url else TELEGRAM_PRODUCTION
+    )
+    supervisor = Supervisor()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, supervisor.stop)
+    try:
+        await supervisor.run(bot)
+    finally:
+        await (await bot.get_session()).close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
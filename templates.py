@@ -0,0 +1,57 @@
+# templates.py — заранее собранные клавиатуры и шаблоны сообщений.
+# aiogram на каждую отправку строит дерево объектов клавиатуры и сериализует
+# его в JSON (prepare_arg). Статические клавиатуры сериализуются один раз,
+# а у клавиатур с параметрами (номер заказа) готовый JSON режется на куски,
+# между которыми на отправке подставляются значения. Строки aiogram передаёт
+# в Bot API как есть, поэтому результат побайтно совпадает с прежним.
+import json
+from string import Formatter
+
+from aiogram.utils.payload import prepare_arg
+
+_MARK = "\ue000"  # символ из частной области Unicode, в JSON не экранируется
+
+
+def static(markup) -> str:
+    """JSON клавиатуры — ровно то, что aiogram отправил бы для объекта"""
+    return prepare_arg(markup)
+
+
+def _escape(value) -> str:
+    if isinstance(value, int):
+        return str(value)
+    return json.dumps(str(value), ensure_ascii=False)[1:-1]
+
+
+class KeyboardTemplate:
+    """
+    Клавиатура с параметрами. build(**params) вызывается один раз с метками
+    вместо значений; render(**values) склеивает готовые куски JSON.
+    """
+
+    def __init__(self, build, *params: str):
+        source = static(build(**{name: f"{_MARK}{name}{_MARK}" for name in params}))
+        parts = source.split(_MARK)
+        self.params = params
+        self._head = parts[0]
+        self._fields = list(zip(parts[1::2], parts[2::2]))  # (параметр, текст после него)
+
+    def render(self, **values) -> str:
+        out = [self._head]
+        for name, literal in self._fields:
+            out.append(_escape(values[name]))
+            out.append(literal)
+        return "".join(out)
+
+
+class TextTemplate:
+    """
+    Текст сообщения с полями str.format. Отдельный разбор шаблона в Python
+    медленнее встроенного str.format, поэтому render — просто его bound-метод;
+    шаблон нужен, чтобы тексты жили в одном реестре рядом с клавиатурами.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.fields = {field for _, field, _, _ in Formatter().parse(text) if field}  # имена полей
+        self.render = text.format
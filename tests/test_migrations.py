@@ -0,0 +1,63 @@
+# Миграции db.py на базе старой версии бота: orders без passenger_id и других колонок
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import db
+
+# Схема orders из dist/taxi.db (до появления passenger_id, completed, rating, trip_type)
+LEGACY_ORDERS = """
+    CREATE TABLE orders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        from_addr TEXT,
+        to_addr TEXT,
+        price INTEGER,
+        phone TEXT,
+        status TEXT DEFAULT 'new',
+        driver_id INTEGER,
+        group_message_id INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    , driver_name TEXT)
+"""
+LEGACY_DRIVERS = "CREATE TABLE drivers (id INTEGER PRIMARY KEY, name TEXT)"
+
+
+class LegacyMigrationTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "taxi.db")
+        conn = sqlite3.connect(self.path)
+        conn.execute(LEGACY_ORDERS)
+        conn.execute(LEGACY_DRIVERS)
+        conn.execute("INSERT INTO drivers (id, name) VALUES (7, 'Асқар')")
+        conn.execute("INSERT INTO orders (from_addr, to_addr, price, phone, status, driver_id) "
+                     "VALUES ('Абай 1', 'Төле би 2', 700, '+77071234567', 'accepted', 7)")
+        conn.commit()
+        conn.close()
+
+    async def asyncTearDown(self):
+        await db.close_db()
+        self.tmp.cleanup()
+
+    async def test_legacy_schema_migrates_to_latest(self):
+        await db.init_db(self.path, write_pipeline=False)
+        self.assertEqual(await db._schema_version(db.db_conn), db.SCHEMA_VERSION)
+        for table, columns in db.LEGACY_COLUMNS.items():
+            self.assertLessEqual(set(columns), await db._table_columns(db.db_conn, table))
+
+        order = await db.get_order(1, cached=False)
+        self.assertEqual((order['from_addr'], order['driver_id'], order['passenger_id']), ('Абай 1', 7, None))
+        # База после миграций рабочая: новый заказ и его захват
+        order_id = await db.insert_order("A", "B", 500, "+77070000000", 100)
+        self.assertIsNotNone(await db.claim_order(order_id, 7, "Асқар"))
+
+    async def test_migrations_are_idempotent(self):
+        await db.init_db(self.path, write_pipeline=False)
+        await db.close_db()
+        await db.init_db(self.path, write_pipeline=False)
+        self.assertEqual(await db._schema_version(db.db_conn), db.SCHEMA_VERSION)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+# Оценка поездки: только завершённый заказ с водителем, один раз; агрегаты водителя
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import db
+
+
+class SetRatingTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "taxi.db")
+        await db.init_db(self.path)
+        db.order_cache.clear()
+        db.driver_cache.clear()
+        db._claims.clear()  # id заказов в новой базе снова с 1
+
+    async def asyncTearDown(self):
+        await db.close_db()
+        self.tmp.cleanup()
+
+    async def order(self, status: str) -> int:
+        order_id = await db.insert_order("A", "B", 700, "+77071234567", 1)
+        if status in ("accepted", "completed"):
+            await db.claim_order(order_id, 7, "Асқар")
+        if status == "completed":
+            await db.complete_order(order_id, 7)
+        if status == "expired":
+            await db.expire_order(order_id)
+        return order_id
+
+    async def test_only_completed_trip_is_rated(self):
+        for status in ("new", "accepted", "expired"):
+            order_id = await self.order(status)
+            self.assertIsNone(await db.set_rating(order_id, 5), status)
+            self.assertEqual((await db.get_order(order_id, cached=False))["rating"], 0, status)
+        self.assertEqual((await db.get_driver_rating(7))["count"], 0)
+
+    async def test_completed_trip_is_rated_once(self):
+        order_id = await self.order("completed")
+        self.assertIsNotNone(await db.set_rating(order_id, 4))
+        self.assertIsNone(await db.set_rating(order_id, 1))
+        rating = await db.get_driver_rating(7)
+        self.assertEqual((rating["average"], rating["count"], rating["stars"]), (4.0, 1, [0, 0, 0, 1, 0]))
+
+    async def test_rebuild_matches_incremental(self):
+        for stars in (5, 3, 4):
+            await db.set_rating(await self.order("completed"), stars)
+        before = await db.get_driver_rating(7)
+        await db.rebuild_rating_aggregates()
+        self.assertEqual(await db.get_driver_rating(7), before)
+
+    async def test_uncached_rating_sees_other_process(self):
+        # Под supervisor.py оценку записывает воркер пассажира — здесь кэш о ней не знает
+        await db.register_driver(7, "Асқар")
+        self.assertEqual((await db.get_driver_rating(7))["count"], 0)
+        conn = sqlite3.connect(self.path)
+        conn.execute("UPDATE drivers SET rating=5, rating_sum=5, rating_count=1, stars_5=1 WHERE id=7")
+        conn.commit()
+        conn.close()
+        self.assertEqual((await db.get_driver_rating(7))["count"], 0)
+        self.assertEqual((await db.get_driver_rating(7, cached=False))["count"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+# stats.py на базе, которую бот ещё не открывал: пустой файл и taxi.db старой версии
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import db
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATS = os.path.join(ROOT, "stats.py")
+LEGACY_ORDERS = """
+    CREATE TABLE orders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        from_addr TEXT,
+        to_addr TEXT,
+        price INTEGER,
+        phone TEXT,
+        status TEXT DEFAULT 'new',
+        driver_id INTEGER,
+        group_message_id INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    , driver_name TEXT)
+"""
+
+
+class FreshDatabaseTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "taxi.db")
+        open(self.path, "w").close()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def stats(self, *args):
+        return subprocess.run([sys.executable, STATS, "--db", self.path, *args],
+                              cwd=ROOT, capture_output=True, text=True, timeout=60)
+
+    def test_empty_file(self):
+        result = self.stats()
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn("Нет заказов", result.stdout)
+        conn = sqlite3.connect(self.path)
+        self.assertEqual(conn.execute("PRAGMA user_version").fetchone()[0], db.SCHEMA_VERSION)
+        self.assertIsNotNone(conn.execute("SELECT last_event_id FROM report_checkpoint").fetchone())
+        conn.close()
+
+    def test_check_on_empty_file(self):
+        for args in (["--check"], ["--check-daily"], ["--rebuild"], ["--rebuild-daily"], ["--rebuild-ratings"]):
+            result = self.stats(*args)
+            self.assertEqual(result.returncode, 0, f"{args}: {result.stderr}")
+
+    def test_export_stdout_is_only_csv(self):
+        # Лог миграций не должен попасть в выгрузку
+        result = self.stats("--export", "orders")
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.splitlines(), ["\ufeff" + ",".join(
+            ["id", "created_at", "status", "completed", "trip_type", "from_addr", "to_addr",
+             "price", "driver_id", "driver_name", "driver_share", "service_share", "rating"])])
+
+    def test_daily_check_and_rebuild(self):
+        self.assertEqual(self.stats("--check-daily").returncode, 0)
+        conn = sqlite3.connect(self.path)
+        conn.execute("INSERT INTO orders (from_addr, to_addr, price, phone, status, driver_id, completed) "
+                     "VALUES ('Абай 1', 'Төле би 2', 700, '+77071234567', 'accepted', 7, 1)")
+        conn.commit()
+        # Триггеры ведут агрегаты сами; портим их вручную
+        conn.execute("UPDATE daily_driver_stats SET revenue = revenue + 100")
+        conn.commit()
+        conn.close()
+        result = self.stats("--check-daily")
+        self.assertEqual(result.returncode, 1, result.stdout)
+        self.assertIn("Расхождений: 2", result.stdout)
+        self.assertEqual(self.stats("--rebuild-daily").returncode, 0)
+        result = self.stats("--check-daily")
+        self.assertEqual(result.returncode, 0, result.stdout)
+
+    def test_from_inside_period_keeps_the_period(self):
+        self.assertEqual(self.stats().returncode, 0)
+        conn = sqlite3.connect(self.path)
+        # Понедельник и среда одной недели
+        for created_at in ("2026-10-12 09:00:00", "2026-10-14 09:00:00"):
+            conn.execute("INSERT INTO orders (from_addr, to_addr, price, status, driver_id, created_at) "
+                         "VALUES ('Абай 1', 'Төле би 2', 700, 'accepted', 7, ?)", (created_at,))
+        conn.commit()
+        conn.close()
+        for period, start in (("week", "2026-10-12"), ("month", "2026-10-01")):
+            result = self.stats("--period", period, "--from", "2026-10-14")
+            self.assertEqual(result.returncode, 0, result.stderr)
+            self.assertIn(f"📅 {start}", result.stdout)
+            self.assertIn("2 заказ(ов)", result.stdout)
+        result = self.stats("--period", "day", "--from", "2026-10-14")
+        self.assertNotIn("2026-10-12", result.stdout)
+        self.assertIn("📅 2026-10-14", result.stdout)
+
+    def test_legacy_orders(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute(LEGACY_ORDERS)
+        conn.execute("INSERT INTO orders (from_addr, to_addr, price, phone, status, driver_id) "
+                     "VALUES ('Абай 1', 'Төле би 2', 700, '+77071234567', 'accepted', 7)")
+        conn.commit()
+        conn.close()
+        result = self.stats("--check")
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn("пересобрано заказов: 1", result.stdout)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+# Чтения во время открытой пачки писателя db.py не видят её незакоммиченных строк
+import asyncio
+import os
+import tempfile
+import unittest
+
+import db
+
+
+class ReadIsolationTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        await db.init_db(os.path.join(self.tmp.name, "taxi.db"))
+        db.order_cache.clear()
+        db.driver_cache.clear()
+        db._claims.clear()  # id заказов в новой базе снова с 1
+
+    async def asyncTearDown(self):
+        await db.close_db()
+        self.tmp.cleanup()
+
+    async def test_rolled_back_row_is_not_read_or_cached(self):
+        inserted = asyncio.Event()
+        release = asyncio.Event()
+
+        async def op(conn):
+            await conn.execute("INSERT INTO orders (id, from_addr, to_addr, price) VALUES (77, 'A', 'B', 700)")
+            await conn.execute("INSERT INTO drivers (id, name) VALUES (7, 'Асқар')")
+            inserted.set()
+            await release.wait()
+            raise RuntimeError("откат изменения")
+
+        write = asyncio.create_task(db.execute_write(op))
+        await inserted.wait()
+        try:
+            # Пачка открыта, строки вставлены, но не закоммичены
+            self.assertIsNone(await db.get_order(77))
+            self.assertIsNone(await db.get_driver(7))
+        finally:
+            release.set()
+        with self.assertRaises(RuntimeError):
+            await write
+        self.assertIsNone(await db.get_order(77))
+        self.assertIsNone(await db.get_driver(7))
+
+    async def test_committed_write_is_visible_to_reads(self):
+        order_id = await db.insert_order("A", "B", 700, "+77071234567", 1)
+        db.order_cache.clear()
+        self.assertEqual((await db.get_order(order_id))["price"], 700)
+        await db.claim_order(order_id, 7, "Асқар")
+        self.assertEqual((await db.get_order(order_id, cached=False))["status"], "accepted")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+# webhook.py — запуск бота через webhook вместо long polling.
+# Telegram присылает апдейты POST-запросами на WEBHOOK_PATH; они раскладываются
+# по очередям ограниченного пула воркеров. Апдейты одного пользователя всегда
+# попадают к одному воркеру, поэтому порядок шагов FSM сохраняется. Если очереди
+# заполнены, ответ Telegram задерживается — это и есть backpressure.
+#
+#   WEBHOOK_HOST=https://taxi.example.com python webhook.py
+import asyncio
+import os
+
+from aiogram import Bot, Dispatcher, types
+from aiohttp import web
+
+import bot as taxi_bot
+
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "")  # публичный адрес, который видит Telegram
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # сверяется с X-Telegram-Bot-Api-Secret-Token
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", "8080"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "16"))      # одновременно обрабатываемых апдейтов
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "64"))  # очередь на одного воркера
+WEBHOOK_BATCH = 32  # сколько апдейтов воркер забирает из очереди за раз
+
+# Откуда брать id пользователя для разных типов апдейтов
+_SHARD_FIELDS = ("message", "edited_message", "callback_query", "inline_query",
+                 "chosen_inline_result", "shipping_query", "pre_checkout_query",
+                 "my_chat_member", "chat_member", "chat_join_request")
+
+
+def update_shard_key(data: dict) -> int:
+    """id пользователя (или чата) апдейта — по нему апдейт закрепляется за воркером"""
+    for field in _SHARD_FIELDS:
+        event = data.get(field)
+        if event:
+            sender = event.get("from") or event.get("chat") or {}
+            return int(sender.get("id", 0))
+    return 0
+
+
+class UpdatePool:
+    def __init__(self, dp: Dispatcher, workers: int = WEBHOOK_WORKERS,
+                 queue_size: int = WEBHOOK_QUEUE_SIZE, batch_size: int = WEBHOOK_BATCH):
+        self.dp = dp
+        self.batch_size = batch_size
+        self.processed = 0
+        self._queues = [asyncio.Queue(queue_size) for _ in range(workers)]
+        self._workers = []
+
+    def start(self):
+        for queue in self._queues:
+            self._workers.append(asyncio.create_task(self._work(queue)))
+
+    async def put(self, data: dict):
+        """Поставить апдейт в очередь его воркера; ждёт, если очередь полна"""
+        queue = self._queues[update_shard_key(data) % len(self._queues)]
+        await queue.put(types.Update(**data))
+
+    def depth(self) -> int:
+        return sum(queue.qsize() for queue in self._queues)
+
+    async def close(self):
+        """Дообработать очереди и остановить воркеры"""
+        for queue in self._queues:
+            await queue.join()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+
+    async def _work(self, queue: asyncio.Queue):
+        Bot.set_current(self.dp.bot)
+        Dispatcher.set_current(self.dp)
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < self.batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            for update in batch:
+                try:
+                    # Отдельная задача — свой контекст: aiogram кэширует состояние
+                    # FSM в ContextVar, и оно не должно перетечь в следующий апдейт
+                    await asyncio.create_task(self.dp.process_update(update))
+                except Exception as e:
+                    print(f"Ошибка обработки апдейта {update.update_id}: {e}")
+                finally:
+                    self.processed += 1
+                    queue.task_done()
+
+
+def build_app(dp: Dispatcher = taxi_bot.dp, webhook_url: str = None, **pool_options) -> web.Application:
+    """aiohttp-приложение с webhook-эндпоинтом; хуки старта/остановки — те же, что у polling"""
+    webhook_url = webhook_url or f"{WEBHOOK_HOST}{WEBHOOK_PATH}"
+    pool = UpdatePool(dp, **pool_options)
+    app = web.Application()
+    app["pool"] = pool
+
+    async def handle(request: web.Request):
+        if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+            return web.Response(status=403)
+        await pool.put(await request.json())
+        return web.Response()
+
+    async def on_startup(_):
+        await taxi_bot.on_startup(dp)
+        pool.start()
+        await dp.bot.set_webhook(webhook_url, drop_pending_updates=True, secret_token=WEBHOOK_SECRET)
+
+    async def on_shutdown(_):
+        await dp.bot.delete_webhook()
+        await pool.close()
+        await taxi_bot.on_shutdown(dp)
+        await dp.storage.close()
+        await (await dp.bot.get_session()).close()
+
+    app.router.add_post(WEBHOOK_PATH, handle)
+    app.on_startup.append(on_startup)
+    app.on_shutdown.append(on_shutdown)
+    return app
+
+
+if __name__ == '__main__':
+    if not WEBHOOK_HOST:
+        raise SystemExit("Укажите WEBHOOK_HOST — публичный https-адрес бота")
+    web.run_app(build_app(), host=WEBAPP_HOST, port=WEBAPP_PORT)